@@ -2,4 +2,18 @@ import os
 
 PROCESS_CANDIDATES_FILE = "data/process_candidates.py"
 DATA_FOLDER = str(os.path.join('data', 'pickles'))
-EXCLUSION_API_IP = 'http://127.0.0.1:8000'
\ No newline at end of file
+EXCLUSION_API_IP = 'http://127.0.0.1:8000'
+RT_WINDOW_AUTO_ADVANCE = False  # advance the active list's current rt from point queries
+COMPACTION_INTERVAL = None  # seconds between background compactions of the active list, None disables them
+COMPACTION_MAX_GROWTH = 0.0  # allowed volume growth of a merged interval over the union of its members
+SNAPSHOT_MODE = False  # serve queries from lock-free copy-on-write snapshots of the active list
+SNAPSHOT_MERGE_INTERVAL = 1.0  # seconds between merges of pending writes into a new snapshot
+QUERY_CACHE_SIZE = None  # number of cached point query results, None disables the cache
+QUERY_CACHE_MASS_PPM = None  # mass quantization of cached point queries, None uses exact values
+QUERY_CACHE_RT_WIDTH = None  # rt quantization of cached point queries, None uses exact values
+QUERY_CACHE_OOK0_WIDTH = None  # ook0 quantization of cached point queries, None uses exact values
+JOURNAL_FOLDER = None  # folder of the active list's crash recovery journal and snapshots, None disables the journal
+JOURNAL_SYNC_INTERVAL = 0.005  # seconds between group commits (fsyncs) of the journal
+JOURNAL_CHECKPOINT_INTERVAL = 300.0  # seconds between snapshots which truncate the journal, None disables them
+DELTA_SAVE_RATIO = 0.5  # repeated saves only write changes until they outgrow this fraction of the base, None disables
+SAVED_LIST_CACHE_SIZE = 8  # saved lists kept open for queries which check them alongside the active list
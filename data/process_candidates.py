@@ -1,3 +1,6 @@
+import math
+import struct
+
 import requests
 import json
 import time
@@ -60,19 +63,18 @@ def process_candidates(self, candidates, make_candidate, enable_individual_colli
         if len(candidates) == 0:
             return
 
-        charges = ''.join([f'&charge={candidate.precursor.charge}' for candidate in candidates])
-        masses = ''.join(
-            [f'&mass={calculate_mass(candidate.precursor.monoisotopic_mz, candidate.precursor.charge)}' for candidate in
-             candidates])
-        rts = ''.join([f'&rt={float(self._ms1_analysis_time)}' for candidate in candidates])
-        ook0s = ''.join([f'&ook0={candidate.one_over_k0}' for candidate in candidates])
-        ints = ''.join([f'&intensity={None}' for candidate in candidates])
-        exclusion_points_query = charges + masses + rts + ook0s + ints
-        exclusion_points_query = '?' + exclusion_points_query[1:]
-
-        response = requests.get(f'http://{paser_exclusion_api_ip}/exclusionlist/points{exclusion_points_query}')
-        data = response.text
-        exclusion_flags = json.loads(data)
+        # packed (charge: int8, mass: f64, rt: f32, ook0: f32, intensity: f32) records after a header, answered with
+        # one bit per candidate (least significant bit first), see exclusionms.apihandler.encode_points
+        rt = float(self._ms1_analysis_time)
+        record = struct.Struct('<bdfff')
+        body = struct.pack('<4sHHI', b'EXPT', 1, 0, len(candidates)) + b''.join(
+            record.pack(candidate.precursor.charge,
+                        calculate_mass(candidate.precursor.monoisotopic_mz, candidate.precursor.charge),
+                        rt, candidate.one_over_k0, math.nan) for candidate in candidates)
+
+        response = requests.post(f'http://{paser_exclusion_api_ip}/exclusionms/points/binary', data=body)
+        packed = response.content
+        exclusion_flags = [bool(packed[i >> 3] >> (i & 7) & 1) for i in range(len(candidates))]
 
         for i in sorted([i for i, flag in enumerate(exclusion_flags) if flag], reverse=True):
             candidates.pop(i)
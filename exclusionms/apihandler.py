@@ -1,12 +1,23 @@
 import json
-from typing import List
+import struct
+from typing import BinaryIO, List
 
+import numpy as np
 import requests
 
 from .components import ExclusionPoint, ExclusionInterval
+from .export import EXPORT_COLUMNS, POINT_COLUMNS, unpack_flags
 from .exceptions import UnexpectedStatusCodeException
 from .queryfactory import make_save_query, make_load_query, make_stats_query, \
-    make_exclusion_interval_query, make_clear_query, make_exclusion_points_query
+    make_exclusion_interval_query, make_clear_query, make_exclusion_points_query, make_advance_rt_query, \
+    make_save_job_query, make_upload_query, make_merge_query, make_exclusion_intervals_query, \
+    make_exclusion_points_post_query, make_exclusion_points_binary_query
+
+# binary points: little endian (charge, mass, rt, ook0, intensity) records, charge 0 and NaN are None
+POINT_RECORD = np.dtype([('charge', '<i1'), ('mass', '<f8'), ('rt', '<f4'), ('ook0', '<f4'), ('intensity', '<f4')])
+POINTS_MAGIC = b'EXPT'
+POINTS_VERSION = 1
+POINTS_HEADER = struct.Struct('<4sHHI')  # magic, version, reserved, record count
 
 
 def clear_active_exclusion_list(exclusion_api_ip: str):
@@ -15,17 +26,50 @@ def clear_active_exclusion_list(exclusion_api_ip: str):
         raise UnexpectedStatusCodeException(response.content)
 
 
-def load_active_exclusion_list(exclusion_api_ip: str, exid: str):
-    response = requests.post(make_load_query(exclusion_api_ip, exid))
+def load_active_exclusion_list(exclusion_api_ip: str, exid: str, binary: bool = False):
+    response = requests.post(make_load_query(exclusion_api_ip, exid, binary))
+    if response.status_code != 200:
+        raise UnexpectedStatusCodeException(response.content)
+
+
+def save_active_exclusion_list(exclusion_api_ip: str, exid: str, binary: bool = False, background: bool = False):
+    response = requests.post(make_save_query(exclusion_api_ip, exid, binary, background))
+    if response.status_code != 200:
+        raise UnexpectedStatusCodeException(response.content)
+
+    return json.loads(response.content)
+
+
+def get_save_job(exclusion_api_ip: str, job_id: str) -> dict:
+    response = requests.get(make_save_job_query(exclusion_api_ip, job_id))
+    if response.status_code != 200:
+        raise UnexpectedStatusCodeException(response.content)
+
+    return json.loads(response.content)
+
+
+def merge_exclusion_list_files(exclusion_api_ip: str, exids: List[str], binary: bool = False) -> dict:
+    """
+    Adds the intervals of the saved lists exids to the active list, skipping intervals which are already in it
+    """
+    response = requests.post(make_merge_query(exclusion_api_ip, exids, binary))
     if response.status_code != 200:
         raise UnexpectedStatusCodeException(response.content)
 
+    return json.loads(response.content)
+
 
-def save_active_exclusion_list(exclusion_api_ip: str, exid: str):
-    response = requests.post(make_save_query(exclusion_api_ip, exid))
+def upload_exclusion_list_file(exclusion_api_ip: str, exid: str, file: BinaryIO, binary: bool = False,
+                               load: bool = False) -> dict:
+    """
+    Streams file (an open binary file) to the server as the saved list exid, and loads it if load is True
+    """
+    response = requests.post(make_upload_query(exclusion_api_ip, exid, binary, load), data=file)
     if response.status_code != 200:
         raise UnexpectedStatusCodeException(response.content)
 
+    return json.loads(response.content)
+
 
 def get_active_exclusion_list_stats(exclusion_api_ip: str) -> List[str]:
     response = requests.get(make_stats_query(exclusion_api_ip))
@@ -45,6 +89,14 @@ def get_exclusion_list_files(exclusion_api_ip: str) -> List[str]:
         return json.loads(response.content)['files']
 
 
+def advance_active_exclusion_list_rt(exclusion_api_ip: str, rt: float) -> dict:
+    response = requests.post(make_advance_rt_query(exclusion_api_ip, rt))
+    if response.status_code != 200:
+        raise UnexpectedStatusCodeException(response.content)
+
+    return json.loads(response.content)
+
+
 def add_exclusion_interval_query(exclusion_api_ip: str, exclusion_interval: ExclusionInterval) -> None:
     query = make_exclusion_interval_query(exclusion_api_ip=exclusion_api_ip,
                                           exclusion_interval=exclusion_interval)
@@ -55,9 +107,42 @@ def add_exclusion_interval_query(exclusion_api_ip: str, exclusion_interval: Excl
         raise UnexpectedStatusCodeException(response.content)
 
 
-def get_excluded_points(exclusion_api_ip: str, exclusion_points: List[ExclusionPoint]):
+def _intervals_json(exclusion_intervals: List[ExclusionInterval]) -> dict:
+    # columns, so every key is sent once
+    return {col: [getattr(interval, col) for interval in exclusion_intervals] for col in EXPORT_COLUMNS}
+
+
+def add_exclusion_intervals(exclusion_api_ip: str, exclusion_intervals: List[ExclusionInterval]) -> dict:
+    """
+    Adds all exclusion_intervals with one request
+    """
+    response = requests.post(make_exclusion_intervals_query(exclusion_api_ip),
+                             json=_intervals_json(exclusion_intervals))
+    if response.status_code != 200:
+        raise UnexpectedStatusCodeException(response.content)
+
+    return json.loads(response.content)
+
+
+def remove_exclusion_intervals(exclusion_api_ip: str, exclusion_intervals: List[ExclusionInterval]) -> dict:
+    """
+    Removes the intervals matching each of exclusion_intervals with one request
+    """
+    response = requests.delete(make_exclusion_intervals_query(exclusion_api_ip),
+                               json=_intervals_json(exclusion_intervals))
+    if response.status_code != 200:
+        raise UnexpectedStatusCodeException(response.content)
+
+    return json.loads(response.content)
+
+
+def get_excluded_points(exclusion_api_ip: str, exclusion_points: List[ExclusionPoint], exids: List[str] = (),
+                        binary: bool = False):
+    """
+    Checks exclusion_points against the active list and the saved lists exids (which are not loaded)
+    """
     query = make_exclusion_points_query(exclusion_api_ip=exclusion_api_ip,
-                                        exclusion_points=exclusion_points)
+                                        exclusion_points=exclusion_points, exids=exids, binary=binary)
 
     response = requests.get(query)
 
@@ -65,3 +150,69 @@ def get_excluded_points(exclusion_api_ip: str, exclusion_points: List[ExclusionP
         raise UnexpectedStatusCodeException(response.content)
 
     return json.loads(response.content)
+
+
+def post_excluded_points(exclusion_api_ip: str, exclusion_points: List[ExclusionPoint], exids: List[str] = (),
+                         binary: bool = False) -> List[bool]:
+    """
+    get_excluded_points with the points sent as json columns in the body, so the batch size is not limited by the url
+    length
+    """
+    columns = {col: [getattr(point, col) for point in exclusion_points] for col in POINT_COLUMNS}
+    response = requests.post(make_exclusion_points_post_query(exclusion_api_ip, exids, binary), json=columns)
+
+    if response.status_code != 200:
+        raise UnexpectedStatusCodeException(response.content)
+
+    return unpack_flags(response.content, len(exclusion_points))
+
+
+def encode_points(exclusion_points: List[ExclusionPoint], header: bool = True) -> bytes:
+    """
+    Packs exclusion_points into POINT_RECORD records, optionally preceded by a POINTS_HEADER
+    """
+    records = np.zeros(len(exclusion_points), dtype=POINT_RECORD)
+    records['charge'] = [point.charge or 0 for point in exclusion_points]
+    for col in ('mass', 'rt', 'ook0', 'intensity'):
+        records[col] = [np.nan if getattr(point, col) is None else getattr(point, col) for point in exclusion_points]
+    data = records.tobytes()
+    if header:
+        data = POINTS_HEADER.pack(POINTS_MAGIC, POINTS_VERSION, 0, len(records)) + data
+    return data
+
+
+def decode_points(data: bytes) -> List[ExclusionPoint]:
+    """
+    Unpacks the records of encode_points, with or without header
+    """
+    if data[:len(POINTS_MAGIC)] == POINTS_MAGIC:
+        if len(data) < POINTS_HEADER.size:
+            raise Exception('Incomplete points header')
+        _, version, _, count = POINTS_HEADER.unpack_from(data)
+        if version != POINTS_VERSION:
+            raise Exception(f'Unsupported points version: {version}')
+        data = data[POINTS_HEADER.size:]
+        if len(data) != count * POINT_RECORD.itemsize:
+            raise Exception(f'{len(data)} bytes do not hold {count} points')
+    elif len(data) % POINT_RECORD.itemsize:
+        raise Exception(f'{len(data)} bytes are not a whole number of {POINT_RECORD.itemsize} byte points')
+
+    records = np.frombuffer(data, dtype=POINT_RECORD)
+    charges = [charge or None for charge in records['charge'].tolist()]
+    columns = [[None if value != value else value for value in records[col].tolist()]  # NaN -> None
+               for col in ('mass', 'rt', 'ook0', 'intensity')]
+    return [ExclusionPoint(*values) for values in zip(charges, *columns)]
+
+
+def post_excluded_points_binary(exclusion_api_ip: str, exclusion_points: List[ExclusionPoint], exids: List[str] = (),
+                                binary: bool = False) -> List[bool]:
+    """
+    post_excluded_points with the points sent as packed binary records (see encode_points)
+    """
+    response = requests.post(make_exclusion_points_binary_query(exclusion_api_ip, exids, binary),
+                             data=encode_points(exclusion_points))
+
+    if response.status_code != 200:
+        raise UnexpectedStatusCodeException(response.content)
+
+    return unpack_flags(response.content, len(exclusion_points))
@@ -0,0 +1,157 @@
+import mmap
+import os
+import struct
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+import numpy as np
+
+from .components import ExclusionInterval, intern_id
+
+BOUND_COLUMNS = ('min_mass', 'max_mass', 'min_rt', 'max_rt', 'min_ook0', 'max_ook0', 'min_intensity', 'max_intensity')
+NONE_CHARGE = np.iinfo(np.int32).min  # charge sentinel for intervals which apply to all charges
+
+MAGIC = b'EXMSCOLS'
+VERSION = 1
+SORTED_FLAG = 1  # rows are sorted by min_mass
+_HEADER = struct.Struct('<8sHHIQQQ')  # magic, version, flags, reserved, rows, ids, id bytes
+_ALIGNMENT = 8
+
+
+def _padding(size: int) -> bytes:
+    return b'\0' * (-size % _ALIGNMENT)
+
+
+def is_column_file(file_path: str) -> bool:
+    with open(file_path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def _file_size(rows: int, id_count: int, id_bytes: int) -> int:
+    size = _HEADER.size + 8 * (id_count + 1) + id_bytes + len(_padding(id_bytes))
+    for dtype in [np.int32, np.int32] + [np.float64] * len(BOUND_COLUMNS):
+        column_size = rows * np.dtype(dtype).itemsize
+        size += column_size + len(_padding(column_size))
+    return size
+
+
+def _check_header(header: bytes, file_size: int, file_path: str):
+    if len(header) < _HEADER.size:
+        raise Exception(f'{file_path} is not an exclusion list column file')
+    magic, version, _, _, rows, id_count, id_bytes = _HEADER.unpack_from(header, 0)
+    if magic != MAGIC:
+        raise Exception(f'{file_path} is not an exclusion list column file')
+    if version != VERSION:
+        raise Exception(f'Unsupported column file version: {version}')
+    if file_size != _file_size(rows, id_count, id_bytes):
+        raise Exception(f'{file_path} is truncated or corrupt: {file_size} bytes for {rows} rows')
+
+
+@dataclass
+class ColumnFile:
+    """
+    The columns of an exclusion list file. The file is one header followed by fixed width sections, each padded to
+    8 bytes so every column can be viewed in place:
+
+    header: magic, version, flags, reserved, row count, id count, id table bytes
+    id table: uint64 offsets (id count + 1) into the utf-8 encoded ids
+    columns: int32 charge (NONE_CHARGE for None), int32 id index, float64 BOUND_COLUMNS (NaN for None)
+
+    write() streams the sections in one sequential pass into a temporary file which then replaces file_path, so a
+    file which is still mapped by a reader is never truncated. read() maps the file and returns numpy views into
+    the mapping, only the id table is decoded.
+    """
+
+    charge: np.ndarray
+    id_index: np.ndarray
+    bounds: Dict[str, np.ndarray]
+    ids: List[str]
+    flags: int = 0
+    mapping: mmap.mmap = field(default=None, repr=False)
+
+    def __len__(self):
+        return len(self.charge)
+
+    @property
+    def sorted(self) -> bool:
+        return bool(self.flags & SORTED_FLAG)
+
+    @staticmethod
+    def from_intervals(intervals: List[ExclusionInterval]) -> 'ColumnFile':
+        id_lookup = {}
+        for interval in intervals:
+            if not isinstance(interval.id, str):
+                raise Exception(f'Column files only store string ids, got: {interval.id}')
+            id_lookup.setdefault(interval.id, len(id_lookup))
+
+        charge = np.array([NONE_CHARGE if interval.charge is None else interval.charge for interval in intervals],
+                          dtype=np.int32)
+        id_index = np.array([id_lookup[interval.id] for interval in intervals], dtype=np.int32)
+        bounds = {col: np.array([getattr(interval, col) for interval in intervals], dtype=np.float64)
+                  for col in BOUND_COLUMNS}
+        return ColumnFile(charge=charge, id_index=id_index, bounds=bounds, ids=list(id_lookup))
+
+    def intervals(self) -> List[ExclusionInterval]:
+        charges = self.charge.tolist()
+        id_indexes = self.id_index.tolist()
+        bounds = [[None if value != value else value for value in self.bounds[col].tolist()]  # NaN -> None
+                  for col in BOUND_COLUMNS]
+        return [ExclusionInterval(self.ids[id_index], None if charge == NONE_CHARGE else charge, *row_bounds)
+                for charge, id_index, *row_bounds in zip(charges, id_indexes, *bounds)]
+
+    def write(self, file_path: str):
+        encoded_ids = [id.encode('utf-8') for id in self.ids]
+        offsets = np.zeros(len(encoded_ids) + 1, dtype=np.uint64)
+        np.cumsum([len(id) for id in encoded_ids], out=offsets[1:])
+        id_bytes = b''.join(encoded_ids)
+
+        sections = [_HEADER.pack(MAGIC, VERSION, self.flags, 0, len(self), len(encoded_ids), len(id_bytes)),
+                    offsets.tobytes(), id_bytes]
+        sections.append(_padding(len(id_bytes)))
+        for array, dtype in [(self.charge, np.int32), (self.id_index, np.int32)] + \
+                            [(self.bounds[col], np.float64) for col in BOUND_COLUMNS]:
+            data = np.ascontiguousarray(array, dtype=dtype).tobytes()
+            sections.extend((data, _padding(len(data))))
+
+        tmp_path = file_path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.writelines(sections)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, file_path)
+
+    @staticmethod
+    def check(file_path: str):
+        """
+        Raises an Exception unless file_path has a column file header which matches its size, without mapping it
+        """
+        with open(file_path, 'rb') as file:
+            _check_header(file.read(_HEADER.size), os.fstat(file.fileno()).st_size, file_path)
+
+    @staticmethod
+    def read(file_path: str, writable: bool = False) -> 'ColumnFile':
+        """
+        Maps file_path. With writable = True the mapping is copy on write, so the views can be modified without
+        touching the file.
+        """
+        with open(file_path, 'rb') as file:
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY if writable else mmap.ACCESS_READ)
+
+        _check_header(mapping[:_HEADER.size], len(mapping), file_path)
+        _, _, flags, _, rows, id_count, id_bytes = _HEADER.unpack_from(mapping, 0)
+
+        position = _HEADER.size
+        offsets = np.frombuffer(mapping, dtype=np.uint64, count=id_count + 1, offset=position).tolist()
+        position += 8 * (id_count + 1)
+        id_table = mapping[position:position + id_bytes]
+        ids = [intern_id(id_table[start:stop].decode('utf-8')) for start, stop in zip(offsets[:-1], offsets[1:])]
+        position += id_bytes + len(_padding(id_bytes))
+
+        columns = []
+        for dtype in [np.int32, np.int32] + [np.float64] * len(BOUND_COLUMNS):
+            columns.append(np.frombuffer(mapping, dtype=dtype, count=rows, offset=position))
+            size = rows * np.dtype(dtype).itemsize
+            position += size + len(_padding(size))
+
+        return ColumnFile(charge=columns[0], id_index=columns[1], bounds=dict(zip(BOUND_COLUMNS, columns[2:])),
+                          ids=ids, flags=flags, mapping=mapping)
@@ -1,4 +1,5 @@
 import logging
+import math
 import random
 import sys
 from dataclasses import dataclass, asdict
@@ -9,6 +10,34 @@ from .exceptions import IncorrectToleranceException
 logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.DEBUG)
 
 
+def intern_id(interval_id: Union[str, None]) -> Union[str, None]:
+    """
+    Returns the shared copy of a string id. Equal ids from different requests (or pickles) are otherwise separate
+    strings, which costs a string per interval.
+    """
+    if type(interval_id) is str:
+        return sys.intern(interval_id)
+    return interval_id
+
+
+def default_id_prefix(id: str) -> str:
+    """
+    Id prefix of the Kafka worker's f'{uid}_{ms2_id}' interval ids
+    """
+    return id.rsplit('_', 1)[0]
+
+
+def _set_slots(obj, state):
+    """
+    Restores a slotted dataclass from pickle state. Slotted objects pickle as (None, slots), pickles written before
+    the components were slotted hold the instance __dict__.
+    """
+    if isinstance(state, tuple):
+        state = {**(state[0] or {}), **(state[1] or {})}
+    for key, value in state.items():
+        object.__setattr__(obj, key, value)
+
+
 @dataclass(eq=True)
 class ExclusionInterval():
     """
@@ -18,7 +47,12 @@ class ExclusionInterval():
     charge: The charge of the excluded interval. If None: the Interval represents all charges
     min_bounds: The lower 'inclusive' bound of the interval. If None: Will be set to sys.float_info.min
     max_bounds: The upper 'exclusive' bound of the interval. If None: Will be set to sys.float_info.max
+
+    Intervals are slotted (no per instance __dict__) and ids are interned, so intervals sharing an id share one string.
     """
+    __slots__ = ('id', 'charge', 'min_mass', 'max_mass', 'min_rt', 'max_rt', 'min_ook0', 'max_ook0', 'min_intensity',
+                 'max_intensity')
+
     id: Union[str, None]
     charge: Union[int, None]
     min_mass: Union[float, None]
@@ -30,6 +64,13 @@ class ExclusionInterval():
     min_intensity: Union[float, None]
     max_intensity: Union[float, None]
 
+    def __post_init__(self):
+        self.id = intern_id(self.id)
+
+    def __setstate__(self, state):
+        _set_slots(self, state)
+        self.id = intern_id(self.id)
+
     def convert_none(self):
         """
         If any bounds are None, set them to either min/max float
@@ -60,21 +101,21 @@ class ExclusionInterval():
             self.max_intensity = sys.float_info.max
 
     def is_enveloped_by(self, other: 'ExclusionInterval'):
+        """
+        None bounds (of either interval) are unbounded
+        """
 
         if other.charge is not None and self.charge != other.charge:  # data must have correct charge
             return False
 
-        if self.min_mass < other.min_mass or self.max_mass > other.max_mass:
-            return False
-
-        if self.min_rt < other.min_rt or self.max_rt > other.max_rt:
-            return False
-
-        if self.min_ook0 < other.min_ook0 or self.max_ook0 > other.max_ook0:
-            return False
-
-        if self.min_intensity < other.min_intensity or self.max_intensity > other.max_intensity:
-            return False
+        for min_col, max_col in (('min_mass', 'max_mass'), ('min_rt', 'max_rt'), ('min_ook0', 'max_ook0'),
+                                 ('min_intensity', 'max_intensity')):
+            low, high = getattr(self, min_col), getattr(self, max_col)
+            other_low, other_high = getattr(other, min_col), getattr(other, max_col)
+            if other_low is not None and (-math.inf if low is None else low) < other_low:
+                return False
+            if other_high is not None and (math.inf if high is None else high) > other_high:
+                return False
 
         return True
 
@@ -109,12 +150,17 @@ class ExclusionPoint:
     """
     Represents a point in the excluded space. None values will be ignored.
     """
+    __slots__ = ('charge', 'mass', 'rt', 'ook0', 'intensity')
+
     charge: Union[int, None]
     mass: Union[float, None]
     rt: Union[float, None]
     ook0: Union[float, None]
     intensity: Union[float, None]
 
+    def __setstate__(self, state):
+        _set_slots(self, state)
+
     def is_bounded_by(self, interval: ExclusionInterval) -> bool:
         """
         Check if point given by is_excluded() is within interval
@@ -1,19 +1,144 @@
+import heapq
+import itertools
 import logging
+import math
+import os
 import pickle
+import re
+import sys
+import time
 from abc import ABC, abstractmethod
-from dataclasses import dataclass, field
-from typing import Dict, Any, List
+from collections import Counter, OrderedDict
+from copy import copy
+from dataclasses import dataclass, field, replace
+from operator import itemgetter
+from threading import Thread, Lock
+from typing import Dict, Any, List, Callable, Iterator, Union, Optional, Tuple, FrozenSet
 
+import numpy as np
 from intervaltree import IntervalTree, Interval
+from intervaltree.node import Node
+from sortedcontainers import SortedDict, SortedList, SortedKeyList
+from rtree import index as rtree_index
 
-from .components import ExclusionInterval, ExclusionPoint
+from .columnfile import ColumnFile, BOUND_COLUMNS, NONE_CHARGE, SORTED_FLAG, is_column_file
+from .components import ExclusionInterval, ExclusionPoint, default_id_prefix
+from .journal import Journal, ADD, REMOVE, CLEAR, encode_record
+from .occupancy import OccupancyGrid
+from .statistics import IntervalStatistics
 
 _log = logging.getLogger(__name__)
 _log.setLevel(logging.DEBUG)
 
 
+def _build_interval_tree(intervals: List[Interval]) -> IntervalTree:
+    """
+    Builds an IntervalTree from scratch. IntervalTree(intervals) sorts with Interval.__lt__ and inserts each boundary
+    into its SortedDict one at a time, which is as slow as adding the intervals individually.
+    This sets the tree's internals (Node, boundary_table) directly, so intervaltree is pinned to 3.1.0.
+    """
+    intervals = sorted(intervals, key=lambda iv: (iv.begin, iv.end))
+    boundaries = Counter(iv.begin for iv in intervals)
+    boundaries.update(iv.end for iv in intervals)
+
+    tree = IntervalTree()
+    tree.all_intervals = set(intervals)
+    tree.top_node = Node.from_sorted_intervals(intervals)
+    tree.boundary_table = SortedDict(boundaries)
+    return tree
+
+
+def _is_open_mass(min_mass, max_mass):
+    """
+    Whether mass bounds (scalars or arrays) are None (NaN) or the bounds ExclusionInterval.convert_none sets
+    """
+    return ~(min_mass > sys.float_info.min) | ~(max_mass < sys.float_info.max)
+
+
+def _interval_key(interval: ExclusionInterval) -> Tuple:
+    return (interval.id, interval.charge) + tuple(getattr(interval, col) for col in BOUND_COLUMNS)
+
+
+def _dump_pickle(obj: Any, file_path: str):
+    """
+    Pickles obj to a temporary file which then replaces file_path, so a crash never leaves a partial save
+    """
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, "wb") as file:
+        pickle.dump(obj, file, -1)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, file_path)
+
+
+def _dump_intervals(intervals: List[ExclusionInterval], file_path: str):
+    _dump_pickle(intervals, file_path)
+
+
+def check_save_file(file_path: str, columnar: bool):
+    """
+    Raises an Exception unless file_path looks like a complete save: a column file whose header matches its size,
+    or a pickle which starts with a PROTO and ends with a STOP opcode (checked without unpickling it)
+    """
+    if columnar:
+        ColumnFile.check(file_path)
+        return
+    with open(file_path, 'rb') as file:
+        first = file.read(1)
+        file.seek(0, os.SEEK_END)
+        if file.tell() > 1:
+            file.seek(-1, os.SEEK_END)
+        if first != pickle.PROTO or file.read(1) != pickle.STOP:
+            raise Exception(f'{file_path} is not a complete pickle')
+
+
+# the globals a save may reference: intervals, the IntervalTree of older saves and the numpy arrays of columnar saves
+_PICKLE_GLOBALS = {('exclusionms.components', 'ExclusionInterval'), ('intervaltree.interval', 'Interval'),
+                   ('intervaltree.intervaltree', 'IntervalTree'), ('numpy', 'dtype'), ('numpy', 'ndarray'),
+                   ('numpy.core.multiarray', '_reconstruct'), ('numpy._core.multiarray', '_reconstruct'),
+                   ('numpy.core.multiarray', 'scalar'), ('numpy._core.multiarray', 'scalar'),
+                   ('numpy.core.numeric', '_frombuffer'), ('numpy._core.numeric', '_frombuffer')} | \
+                  {('builtins', name) for name in ('set', 'frozenset', 'complex', 'bytearray', 'slice')}
+
+
+class _SaveUnpickler(pickle.Unpickler):
+    """
+    Unpickler for saved (and uploaded) lists, which only resolves _PICKLE_GLOBALS, so a pickle cannot run code
+    """
+
+    def find_class(self, module: str, name: str):
+        if (module, name) not in _PICKLE_GLOBALS:
+            raise pickle.UnpicklingError(f'{module}.{name} is not allowed in an exclusion list save')
+        return super().find_class(module, name)
+
+
+def _load_pickle(file_path: str) -> Any:
+    with open(file_path, "rb") as file:
+        return _SaveUnpickler(file).load()
+
+
+def _load_intervals(file_path: str) -> List[ExclusionInterval]:
+    """
+    Loads the intervals of a column file (see ColumnFile), a pickled list of intervals, the pickled columns of
+    ColumnarExclusionList.save, or the pickled IntervalTree of older MassIntervalTree saves
+    """
+    if is_column_file(file_path):
+        return ColumnFile.read(file_path).intervals()
+
+    intervals = _load_pickle(file_path)
+
+    if isinstance(intervals, IntervalTree):
+        intervals = [interval.data for interval in intervals]
+    elif isinstance(intervals, dict):
+        columns = intervals['columns']
+        intervals = ColumnFile(charge=columns['charge'], id_index=columns['id_index'],
+                               bounds={col: columns[col] for col in BOUND_COLUMNS}, ids=intervals['ids']).intervals()
+    return intervals
+
+
 @dataclass
 class ExclusionList(ABC):
+    statistics = None  # running IntervalStatistics, kept by the backends storing intervals
 
     @abstractmethod
     def add(self, interval:ExclusionInterval):
@@ -24,6 +149,52 @@ class ExclusionList(ABC):
         """
         pass
 
+    def bulk_add(self, intervals: List[ExclusionInterval]):
+        """
+        adds many intervals at once. Backends override this to sort once and build their index bottom up.
+        :param intervals:
+        :return: None
+        """
+        for interval in intervals:
+            self.add(interval)
+
+    @classmethod
+    def from_intervals(cls, intervals: List[ExclusionInterval], *args, **kwargs) -> 'ExclusionList':
+        """
+        creates a list (cls(*args, **kwargs)) holding intervals
+        """
+        exclusion_list = cls(*args, **kwargs)
+        exclusion_list.bulk_add(intervals)
+        return exclusion_list
+
+    def deduplicate(self, intervals: List[ExclusionInterval]) -> List[ExclusionInterval]:
+        """
+        The intervals which are not in the list yet (equal id, charge and bounds), duplicates within intervals are
+        kept once. Looks up the stored intervals of every distinct id.
+        """
+        def value_key(interval: ExclusionInterval) -> Tuple:
+            return tuple(None if value != value else value for value in _interval_key(interval))  # NaN -> None
+
+        stored = {}
+        new = []
+        for interval in intervals:
+            if interval.id not in stored:
+                stored[interval.id] = set(map(value_key, self.query_by_id(interval.id)))
+            key = value_key(interval)
+            if key not in stored[interval.id]:
+                stored[interval.id].add(key)
+                new.append(interval)
+        return new
+
+    def merge_intervals(self, intervals: List[ExclusionInterval]) -> int:
+        """
+        Adds the intervals which are not in the list yet (see deduplicate) with one bulk_add
+        :return: number of added intervals
+        """
+        new = self.deduplicate(intervals)
+        self.bulk_add(new)
+        return len(new)
+
     @abstractmethod
     def remove(self, interval: ExclusionInterval):
         """
@@ -33,6 +204,13 @@ class ExclusionList(ABC):
         """
         pass
 
+    def bulk_remove(self, intervals: List[ExclusionInterval]) -> int:
+        """
+        removes the intervals matching each of intervals (see remove)
+        :return: number of removed intervals
+        """
+        return sum(self.remove(interval) or 0 for interval in intervals)
+
     @abstractmethod
     def query_by_interval(self, interval: ExclusionInterval) -> List[ExclusionInterval]:
         pass
@@ -49,10 +227,45 @@ class ExclusionList(ABC):
     def is_excluded(self, point: ExclusionPoint) -> bool:
         pass
 
+    def query_by_points(self, points: List[ExclusionPoint]) -> List[List[ExclusionInterval]]:
+        """
+        queries a batch of points
+        :param points:
+        :return: the intervals bounding each point, in the same order as points
+        """
+        return [self.query_by_point(point) for point in points]
+
+    def is_excluded_batch(self, points: List[ExclusionPoint]) -> List[bool]:
+        """
+        checks a batch of points
+        :param points:
+        :return: whether each point is excluded, in the same order as points
+        """
+        return [self.is_excluded(point) for point in points]
+
     @abstractmethod
     def save(self, file_path: str):
         pass
 
+    def save_columnar(self, file_path: str):
+        """
+        saves the intervals as a column file (see ColumnFile), which every load() also accepts
+        :param file_path:
+        :return: None
+        """
+        ColumnFile.from_intervals(list(self)).write(file_path)
+
+    def snapshot_save(self, file_path: str, columnar: bool = False) -> Callable[[], None]:
+        """
+        Takes a point in time copy of the list and returns a function which writes it to file_path, like save()
+        (or save_columnar()) would. The copy only holds references to the intervals, so it is cheap to take, and the
+        function can run in another thread while the list keeps changing.
+        """
+        intervals = list(self)
+        if columnar:
+            return lambda: ColumnFile.from_intervals(intervals).write(file_path)
+        return lambda: _dump_intervals(intervals, file_path)
+
     @abstractmethod
     def load(self, file_path: str):
         pass
@@ -65,107 +278,2745 @@ class ExclusionList(ABC):
     def __len__(self):
         pass
 
+    @abstractmethod
+    def __iter__(self) -> Iterator[ExclusionInterval]:
+        pass
+
+    def iter_chunks(self, chunk_size: int) -> Iterator[List[ExclusionInterval]]:
+        """
+        Yields the intervals in lists of up to chunk_size, for streaming exports. Backends override this to read
+        the list one chunk at a time instead of copying it whole, so writes between chunks may or may not be seen.
+        """
+        iterator = iter(self)
+        while True:
+            chunk = list(itertools.islice(iterator, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+
+def _handle_chunks(table: Callable[[], Tuple[Dict[int, ExclusionInterval], int]],
+                   chunk_size: int) -> Iterator[List[ExclusionInterval]]:
+    """
+    iter_chunks of a backend storing intervals by increasing integer handle. table returns the handle -> interval
+    dict and the next handle. The handles are looked up one by one, which never fails on concurrent writes, and
+    costs one dict lookup per handle ever assigned (removed intervals included).
+    """
+    handle = 0
+    while True:
+        intervals, next_handle = table()
+        if handle >= next_handle:
+            return
+        chunk = []
+        while len(chunk) < chunk_size and handle < next_handle:
+            interval = intervals.get(handle)
+            if interval is not None:
+                chunk.append(interval)
+            handle += 1
+        if chunk:
+            yield chunk
+
+
+def _locked_chunks(lock: Lock, chunks: Iterator[List[ExclusionInterval]]) -> Iterator[List[ExclusionInterval]]:
+    """
+    Reads each chunk under lock, which is released while the chunk is consumed
+    """
+    while True:
+        with lock:
+            chunk = next(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+@dataclass
+class _BoundIndex:
+    """
+    Index over one bound dimension (mass, rt or ook0) of MassIntervalTree's interval handles: an IntervalTree for
+    lookups and, once sort() is called, the (begin, end, handle) entries sorted by begin and the sorted ends. The
+    sorted lists count the intervals containing a value in O(log n) for the query planner, and the entries are swept
+    by batch queries. They are only kept up to date after their first use, so lists which are never planned or swept
+    pay for the tree alone. Intervals without a usable range in the dimension (None or empty bounds) are kept in
+    unindexed and are candidates of every lookup.
+    """
+
+    tree: IntervalTree = field(default_factory=lambda: IntervalTree())
+    unindexed: Dict[int, None] = field(default_factory=lambda: dict())
+    begins: Union[SortedKeyList, None] = None
+    ends: Union[SortedList, None] = None
+
+    @staticmethod
+    def is_indexable(low: Union[float, None], high: Union[float, None]) -> bool:
+        return low is not None and high is not None and low < high
+
+    def _split(self, entries: List[Tuple[int, float, float]]) -> Tuple[List[Interval], List[int]]:
+        intervals, unindexed = [], []
+        for handle, low, high in entries:
+            if self.is_indexable(low, high):
+                intervals.append(Interval(low, high, handle))
+            else:
+                unindexed.append(handle)
+        return intervals, unindexed
+
+    def add(self, entries: List[Tuple[int, float, float]]):
+        """
+        Adds (handle, low, high) entries, rebuilding the tree unless only a few entries are added to a large tree
+        """
+        intervals, unindexed = self._split(entries)
+        self.unindexed.update(dict.fromkeys(unindexed))
+        if len(intervals) < len(self.tree) // 4:
+            self.tree.update(intervals)
+        else:
+            self.tree = _build_interval_tree(list(self.tree) + intervals)
+        if self.begins is not None:
+            self.begins.update((interval.begin, interval.end, interval.data) for interval in intervals)
+            self.ends.update(interval.end for interval in intervals)
+
+    def insert(self, handle: int, low: Union[float, None], high: Union[float, None]):
+        """
+        Adds a single entry
+        """
+        if not self.is_indexable(low, high):
+            self.unindexed[handle] = None
+            return
+        self.tree.add(Interval(low, high, handle))
+        if self.begins is not None:
+            self.begins.add((low, high, handle))
+            self.ends.add(high)
+
+    def remove(self, entries: List[Tuple[int, float, float]]):
+        intervals, unindexed = self._split(entries)
+        for handle in unindexed:
+            del self.unindexed[handle]
+        for interval in intervals:
+            self.tree.remove(interval)
+            if self.begins is not None:
+                self.begins.remove((interval.begin, interval.end, interval.data))
+                self.ends.remove(interval.end)
+
+    def sort(self):
+        """
+        Builds the sorted begins and ends on first use
+        """
+        if self.begins is None:
+            self.begins = SortedKeyList(((interval.begin, interval.end, interval.data) for interval in self.tree),
+                                        key=itemgetter(0))
+            self.ends = SortedList(interval.end for interval in self.tree)
+
+    def count(self, value: float) -> int:
+        """
+        Number of candidates of a lookup of value
+        """
+        self.sort()
+        return self.begins.bisect_key_right(value) - self.ends.bisect_right(value) + len(self.unindexed)
+
+    def lookup(self, value: float) -> List[int]:
+        return [interval.data for interval in self.tree[value]] + list(self.unindexed)
+
+
+INDEXED_BOUNDS = {'mass': ('min_mass', 'max_mass'), 'rt': ('min_rt', 'max_rt'), 'ook0': ('min_ook0', 'max_ook0')}
+SWEEP_POINT_COST = 16  # a point query costs about as much as sweeping this many intervals
+
 
 @dataclass
 class MassIntervalTree(ExclusionList):
     """
-    ExclusionList store excluded intervals. Excluded intervals or stored in a 1D IntervalTree based on mass.
-    Therefore, only a single interval can be stored for each unique mass interval, adding another interval
-    with the same underlying mass interval will override the stored object
+    ExclusionList store excluded intervals. Excluded intervals or stored in a 1D IntervalTree based on mass. Points
+    without a mass look up secondary IntervalTrees on rt and ook0 instead (see _BoundIndex), picking the supplied
+    dimension with the fewest candidates, so they are not full scans. The secondary trees are built by the first
+    such query and kept up to date from then on, so lists only queried by mass never pay for them.
+    Every added interval gets a stable integer handle, which is the data of its IntervalTree Intervals. Intervals
+    are stored by handle and the id table maps ids to sets of handles, so duplicate intervals are stored
+    independently and removing an interval only costs its own tree removals.
     """
 
-    interval_tree: IntervalTree = field(default_factory=lambda: IntervalTree())
-    id_dict: Dict[str, list] = field(default_factory=lambda: dict())
+    indexes: Dict[str, _BoundIndex] = field(default_factory=lambda: {'mass': _BoundIndex()})  # built indexes only
+    intervals: Dict[int, ExclusionInterval] = field(default_factory=lambda: dict())
+    id_dict: Dict[str, Dict[int, None]] = field(default_factory=lambda: dict())  # id -> insertion ordered handles
+    next_handle: int = 0
+    statistics: IntervalStatistics = field(default_factory=lambda: IntervalStatistics())
+
+    @property
+    def interval_tree(self) -> IntervalTree:
+        return self.indexes['mass'].tree
+
+    @staticmethod
+    def _entries(name: str, handles: List[int], intervals: List[ExclusionInterval]) -> List[Tuple[int, float, float]]:
+        min_col, max_col = INDEXED_BOUNDS[name]
+        return [(handle, getattr(interval, min_col), getattr(interval, max_col))
+                for handle, interval in zip(handles, intervals)]
+
+    def _index(self, name: str) -> _BoundIndex:
+        """
+        The index of a dimension, built from all intervals on first use
+        """
+        index = self.indexes.get(name)
+        if index is None:
+            index = self.indexes[name] = _BoundIndex()
+            index.add(self._entries(name, list(self.intervals), list(self.intervals.values())))
+        return index
+
+    def _new_handle(self, ex_interval: ExclusionInterval) -> int:
+        handle = self.next_handle
+        self.next_handle += 1
+        self.intervals[handle] = ex_interval
+        self.id_dict.setdefault(ex_interval.id, {})[handle] = None
+        return handle
 
     def add(self, ex_interval: ExclusionInterval):
         if ex_interval.id is None:
             raise Exception('Cannot add an interval with id = None')
-        mass_interval = Interval(ex_interval.min_mass, ex_interval.max_mass, ex_interval)
-        self.interval_tree.add(mass_interval)
-        self.id_dict.setdefault(ex_interval.id, []).append(mass_interval)
+        if Interval(ex_interval.min_mass, ex_interval.max_mass).is_null():
+            raise ValueError('IntervalTree: Null Interval objects not allowed in IntervalTree')
+        handle = self._new_handle(ex_interval)
+        self.statistics.add(ex_interval)
+        for name, index in self.indexes.items():
+            min_col, max_col = INDEXED_BOUNDS[name]
+            index.insert(handle, getattr(ex_interval, min_col), getattr(ex_interval, max_col))
+
+    def bulk_add(self, intervals: List[ExclusionInterval]):
+        """
+        Builds new balanced trees from all intervals (IntervalTree sorts them once), unless only a few intervals
+        are added to a large tree. The rebuild is chosen over merging the new intervals into the existing trees:
+        inserting 200k intervals into a 50k tree one by one takes about twice as long as rebuilding it (8.3s vs
+        3.9s, of which 0.9s is the sort), as each insert rebalances the tree and updates its boundary table.
+        """
+        if any(interval.id is None for interval in intervals):
+            raise Exception('Cannot add an interval with id = None')
+        if any(Interval(interval.min_mass, interval.max_mass).is_null() for interval in intervals):
+            raise ValueError('IntervalTree: Null Interval objects not allowed in IntervalTree')
+
+        handles = [self._new_handle(interval) for interval in intervals]
+        self.statistics.add_intervals(intervals)
+        for name, index in self.indexes.items():
+            index.add(self._entries(name, handles, intervals))
 
     def remove(self, ex_interval: ExclusionInterval):
-        mass_intervals = self._get_interval(ex_interval)
-        if mass_intervals is None:
+        handles = self._get_handles(ex_interval)
+        if not handles:
             _log.warning(f'No exclusion intervals matching: {ex_interval}')
             return 0
-        for mass_interval in set(mass_intervals):
-            self.interval_tree.remove(mass_interval)
+        return self._remove_handles(handles)
 
-        for mass_interval in mass_intervals:
-            self.id_dict[mass_interval.data.id].remove(mass_interval)
+    def _remove_handles(self, handles: List[int]) -> int:
+        removed = []
+        for handle in handles:
+            ex_interval = self.intervals.pop(handle)
+            removed.append(ex_interval)
+            self.statistics.remove(ex_interval)
+            id_handles = self.id_dict[ex_interval.id]
+            del id_handles[handle]
+            if not id_handles:
+                del self.id_dict[ex_interval.id]
 
-        return len(mass_intervals)
+        if len(removed) > len(self.intervals):
+            # rebuilding the trees from the remaining intervals is cheaper than removing most of them one by one
+            self.indexes = {name: _BoundIndex() for name in self.indexes}
+            for name, index in self.indexes.items():
+                index.add(self._entries(name, list(self.intervals), list(self.intervals.values())))
+        else:
+            for name, index in self.indexes.items():
+                index.remove(self._entries(name, handles, removed))
+
+        return len(removed)
 
-    def _get_interval(self, ex_interval: ExclusionInterval) -> List[Interval]:
+    def _get_handles(self, ex_interval: ExclusionInterval) -> List[int]:
         if ex_interval.id is None:
             #retrieve intervals by bounds
             logging.debug('Interval id is none, retrieving interval by bounds.')
-            mass_intervals = self._get_intervals_by_bounds(ex_interval)
+            handles = self._get_handles_by_bounds(ex_interval)
         else:
             #retrieve intervals by id
             logging.debug('Interval id is not none, retrieving interval by id, then checking bounds.')
-            mass_intervals = self._get_intervals_by_id(ex_interval.id)
-            mass_intervals = [i for i in mass_intervals if i.data.is_enveloped_by(ex_interval)]
+            handles = [handle for handle in self._get_handles_by_id(ex_interval.id)
+                       if self.intervals[handle].is_enveloped_by(ex_interval)]
 
-        return mass_intervals
+        return handles
 
-    def _get_intervals_by_bounds(self, ex_interval: ExclusionInterval) -> List[Interval]:
-        intervals = self.interval_tree.envelop(ex_interval.min_mass, ex_interval.max_mass)
-        intervals = [i for i in intervals if i.data.is_enveloped_by(ex_interval)]
-        return intervals
+    def _get_handles_by_bounds(self, ex_interval: ExclusionInterval) -> List[int]:
+        mass_intervals = self.interval_tree.envelop(ex_interval.min_mass, ex_interval.max_mass)
+        return [i.data for i in mass_intervals if self.intervals[i.data].is_enveloped_by(ex_interval)]
 
-    def _get_intervals_by_id(self, id: Any) -> List[Interval]:
-        intervals = self.id_dict.get(id)
-        if intervals is None:
+    def _get_handles_by_id(self, id: Any) -> List[int]:
+        handles = self.id_dict.get(id)
+        if handles is None:
             logging.debug(f'exclusion interval id: {id} is not found.')
             return []
-        return intervals
+        return list(handles)
 
     def is_excluded(self, point: ExclusionPoint) -> bool:
         return len(self.query_by_point(point)) > 0
 
     def query_by_interval(self, ex_interval: ExclusionInterval) -> List[ExclusionInterval]:
-        return [mass_interval.data for mass_interval in self._get_interval(ex_interval)]
+        return [self.intervals[handle] for handle in self._get_handles(ex_interval)]
+
+    def _plan(self, point: ExclusionPoint) -> Union[Tuple[str, float], None]:
+        """
+        Returns the (dimension, value) to look the point up by: its mass, else the rt or ook0 with the fewest
+        candidate intervals, None if the point has no indexed value
+        """
+        if point.mass is not None:
+            return 'mass', point.mass
+        values = [(name, getattr(point, name)) for name in ('rt', 'ook0') if getattr(point, name) is not None]
+        if len(values) <= 1:
+            return values[0] if values else None
+        return min(values, key=lambda value: self._index(value[0]).count(value[1]))
 
     def query_by_point(self, point: ExclusionPoint) -> List[ExclusionInterval]:
-        if point.mass is None:
-            intervals = [interval for interval in self.interval_tree]
+        plan = self._plan(point)
+        if plan is None:
+            intervals = self.intervals.values()
         else:
-            intervals = self.interval_tree[point.mass]
+            name, value = plan
+            intervals = [self.intervals[handle] for handle in self._index(name).lookup(value)]
 
-        return [interval.data for interval in intervals if point.is_bounded_by(interval.data)]
+        return [interval for interval in intervals if point.is_bounded_by(interval)]
 
     def query_by_id(self, id: Any) -> List[ExclusionInterval]:
-        return [interval.data for interval in self._get_intervals_by_id(id)]
+        return [self.intervals[handle] for handle in self._get_handles_by_id(id)]
+
+    def query_by_points(self, points: List[ExclusionPoint]) -> List[List[ExclusionInterval]]:
+        return self._sweep_points(points, first_only=False)
+
+    def is_excluded_batch(self, points: List[ExclusionPoint]) -> List[bool]:
+        return [len(intervals) > 0 for intervals in self._sweep_points(points, first_only=True)]
+
+    def _sweep_points(self, points: List[ExclusionPoint], first_only: bool) -> List[List[ExclusionInterval]]:
+        """
+        Sorts the points by mass and sweeps them against the mass index entries overlapping the batch's mass span
+        (sorted by min_mass), keeping a heap of the intervals which are open at the current mass. The sweep costs one
+        step per interval in the span, so batches which are sparse relative to the list (and points without a mass)
+        are queried individually.
+        """
+        results = [[] for _ in points]
+        mass_points = sorted((i for i, point in enumerate(points) if point.mass is not None),
+                             key=lambda i: points[i].mass)
+        for i, point in enumerate(points):
+            if point.mass is None:
+                results[i] = self.query_by_point(point)
+
+        if not mass_points:
+            return results
+
+        index = self.indexes['mass']
+        index.sort()
+        min_mass, max_mass = points[mass_points[0]].mass, points[mass_points[-1]].mass
+        first, last = index.begins.bisect_key_right(min_mass), index.begins.bisect_key_right(max_mass)
+        if index.count(min_mass) + last - first > len(mass_points) * SWEEP_POINT_COST:
+            for i in mass_points:
+                results[i] = self.query_by_point(points[i])
+            return results
+
+        # the intervals open at min_mass, then the ones beginning within the span
+        open_intervals = [(interval.end, interval.data) for interval in index.tree[min_mass]]
+        heapq.heapify(open_intervals)
+        entries = list(index.begins.islice(first, last))
+        unindexed = list(index.unindexed)
+        j = 0
+        for i in mass_points:
+            point = points[i]
+            while j < len(entries) and entries[j][0] <= point.mass:
+                heapq.heappush(open_intervals, (entries[j][1], entries[j][2]))
+                j += 1
+            while open_intervals and open_intervals[0][0] <= point.mass:
+                heapq.heappop(open_intervals)
+            for handle in itertools.chain((handle for _, handle in open_intervals), unindexed):
+                interval = self.intervals[handle]
+                if point.is_bounded_by(interval):
+                    results[i].append(interval)
+                    if first_only:
+                        break
+
+        return results
 
     def save(self, file_path: str):
         """
-        Save a the interval tree as a pickled obj
+        Save the intervals as a pickled list
         """
-        with open(file_path, "wb") as file:
-            pickle.dump(self.interval_tree, file, -1)
+        _dump_intervals(list(self.intervals.values()), file_path)
 
     def load(self, file_path: str) -> None:
         """
-        Loads a pickled interval tree and then populates id_dict
+        Loads a pickled list of intervals (or a pickled IntervalTree from older saves) and builds a new tree
         """
-        with open(file_path, "rb") as file:
-            self.interval_tree = pickle.load(file)
-            self.id_dict = {}
-            for interval in self.interval_tree:
-                data = interval.data
-                self.id_dict.setdefault(data.id, []).append(interval)
+        intervals = _load_intervals(file_path)
+        self.clear()
+        self.bulk_add(intervals)
 
     def clear(self) -> None:
         """
         Clears all data
         """
-        self.interval_tree.clear()
+        self.indexes = {'mass': _BoundIndex()}
+        self.intervals = {}
         self.id_dict = {}
+        self.statistics.clear()
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def __iter__(self) -> Iterator[ExclusionInterval]:
+        yield from list(self.intervals.values())
+
+    def iter_chunks(self, chunk_size: int) -> Iterator[List[ExclusionInterval]]:
+        return _handle_chunks(lambda: (self.intervals, self.next_handle), chunk_size)
+
+    def stats(self):
+        return {'len':len(self), 'id_table_len': len(self.id_dict), **self.statistics.stats(),
+                'class':str(type(self))}
+
+
+class ColumnarExclusionList(ExclusionList):
+    """
+    ExclusionList which stores intervals as columns of contiguous numpy arrays (charge, id index and the eight
+    min/max bounds). Rows are kept sorted by min_mass, with newly added rows collected in an unsorted tail which is
+    merged into the sorted block once it grows past merge_threshold. Removed rows are flagged as dead and dropped on
+    the next merge. Point queries only check the rows whose min_mass lies within [mass - max interval width, mass],
+    and all bounds checks are vectorized. Rows with an open mass bound (None, stored as NaN, or a convert_none bound)
+    are kept in a side set which every point query checks, so they do not widen that window.
+
+    As in MassIntervalTree, duplicate intervals are kept as separate rows and remove drops every row it envelops.
+    """
+
+    def __init__(self, merge_threshold: int = 4096, initial_capacity: int = 1024):
+        self.merge_threshold = merge_threshold
+        self._initial_capacity = initial_capacity
+        self._reset()
+
+    def _reset(self, capacity: int = None):
+        capacity = max(capacity or self._initial_capacity, 1)
+        self.charge = np.full(capacity, NONE_CHARGE, dtype=np.int32)
+        self.id_index = np.zeros(capacity, dtype=np.int32)
+        self.bounds = {col: np.zeros(capacity, dtype=np.float64) for col in BOUND_COLUMNS}
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.ids: List[Any] = []
+        self.id_lookup: Dict[Any, int] = {}
+        self._size = 0  # rows in use, including dead rows
+        self._sorted_size = 0  # leading rows which are sorted by min_mass
+        self._alive_count = 0
+        self._max_mass_width = 0.0  # of the sorted rows with bounded mass
+        self._open_rows = np.empty(0, dtype=np.intp)  # sorted rows with an open mass bound
+        self.statistics = IntervalStatistics()
+
+    def _capacity(self) -> int:
+        return len(self.alive)
+
+    def _grow(self, min_capacity: int):
+        capacity = max(self._capacity() * 2, min_capacity)
+        extra = capacity - self._capacity()
+        self.charge = np.concatenate([self.charge, np.full(extra, NONE_CHARGE, dtype=np.int32)])
+        self.id_index = np.concatenate([self.id_index, np.zeros(extra, dtype=np.int32)])
+        for col in BOUND_COLUMNS:
+            self.bounds[col] = np.concatenate([self.bounds[col], np.zeros(extra, dtype=np.float64)])
+        self.alive = np.concatenate([self.alive, np.zeros(extra, dtype=bool)])
+
+    def _get_id_index(self, id: Any) -> int:
+        index = self.id_lookup.get(id)
+        if index is None:
+            index = len(self.ids)
+            self.ids.append(id)
+            self.id_lookup[id] = index
+        return index
+
+    def _merge(self):
+        """
+        Drops dead rows and sorts all rows by min_mass
+        """
+        rows = np.flatnonzero(self.alive[:self._size])
+        order = rows[np.argsort(self.bounds['min_mass'][rows], kind='stable')]
+        n = len(order)
+
+        self.charge[:n] = self.charge[order]
+        self.id_index[:n] = self.id_index[order]
+        for col in BOUND_COLUMNS:
+            self.bounds[col][:n] = self.bounds[col][order]
+        self.alive[:n] = True
+        self.alive[n:self._size] = False
+
+        self._size = self._sorted_size = self._alive_count = n
+        self._index_mass_widths()
+
+    def _index_mass_widths(self):
+        """
+        Splits the sorted rows into the open mass rows and the bounded rows, whose widest interval sets the window of
+        point queries
+        """
+        min_mass, max_mass = self.bounds['min_mass'][:self._sorted_size], self.bounds['max_mass'][:self._sorted_size]
+        is_open = _is_open_mass(min_mass, max_mass)
+        self._open_rows = np.flatnonzero(is_open)
+        widths = (max_mass - min_mass)[~is_open]
+        self._max_mass_width = float(np.max(widths)) if len(widths) else 0.0
+
+    def add(self, ex_interval: ExclusionInterval):
+        if ex_interval.id is None:
+            raise Exception('Cannot add an interval with id = None')
+
+        if self._size == self._capacity():
+            self._grow(self._size + 1)
+
+        row = self._size
+        self.charge[row] = NONE_CHARGE if ex_interval.charge is None else ex_interval.charge
+        self.id_index[row] = self._get_id_index(ex_interval.id)
+        for col in BOUND_COLUMNS:
+            self.bounds[col][row] = getattr(ex_interval, col)
+        self.alive[row] = True
+
+        # open rows in the unsorted tail are checked with the tail
+        if not _is_open_mass(self.bounds['min_mass'][row], self.bounds['max_mass'][row]):
+            self._max_mass_width = max(self._max_mass_width, ex_interval.max_mass - ex_interval.min_mass)
+        self._size += 1
+        self._alive_count += 1
+        self.statistics.add(ex_interval)
+
+        if self._size - self._sorted_size > self.merge_threshold:
+            self._merge()
+
+    def bulk_add(self, intervals: List[ExclusionInterval]):
+        """
+        Appends all rows column by column, then sorts once
+        """
+        if any(interval.id is None for interval in intervals):
+            raise Exception('Cannot add an interval with id = None')
+        if not intervals:
+            return
+
+        n = len(intervals)
+        if self._size + n > self._capacity():
+            self._grow(self._size + n)
+
+        rows = slice(self._size, self._size + n)
+        self.charge[rows] = [NONE_CHARGE if interval.charge is None else interval.charge for interval in intervals]
+        self.id_index[rows] = [self._get_id_index(interval.id) for interval in intervals]
+        for col in BOUND_COLUMNS:
+            self.bounds[col][rows] = [getattr(interval, col) for interval in intervals]
+        self.alive[rows] = True
+        self.statistics.add_columns(self.charge[rows], self.id_index[rows], self.ids,
+                                    {col: self.bounds[col][rows] for col in BOUND_COLUMNS})
+
+        self._size += n
+        self._alive_count += n
+        self._merge()
+
+    def deduplicate(self, intervals: List[ExclusionInterval]) -> List[ExclusionInterval]:
+        """
+        Sorts the stored rows together with the new rows by all columns, so each new row only has to be compared
+        with its predecessor. New rows sort after equal stored rows, the first of equal new rows is kept.
+        """
+        if not intervals:
+            return []
+        self._merge()
+        n, m = self._size, len(intervals)
+
+        new_ids = {}
+        id_index = [self.id_lookup.get(interval.id, new_ids.setdefault(interval.id, len(self.ids) + len(new_ids)))
+                    for interval in intervals]
+        keys = [np.concatenate([self.charge[:n], [NONE_CHARGE if x.charge is None else x.charge for x in intervals]]),
+                np.concatenate([self.id_index[:n], id_index])]
+        for col in BOUND_COLUMNS:
+            # compare bit patterns, so NaN (None) equals NaN, + 0.0 maps -0.0 to 0.0
+            values = np.concatenate([self.bounds[col][:n], np.array([getattr(x, col) for x in intervals],
+                                                                    dtype=np.float64)]) + 0.0
+            keys.append(values.view(np.int64))
+        origin = np.concatenate([np.zeros(n, dtype=np.int8), np.ones(m, dtype=np.int8)])
+
+        order = np.lexsort([origin] + keys[::-1])
+        duplicate = np.zeros(n + m, dtype=bool)
+        duplicate[1:] = np.logical_and.reduce([key[order][1:] == key[order][:-1] for key in keys])
+        new_rows = np.sort(order[(origin[order] == 1) & ~duplicate]) - n
+        return [intervals[row] for row in new_rows.tolist()]
+
+    def remove(self, ex_interval: ExclusionInterval):
+        rows = self._get_rows(ex_interval)
+        if len(rows) == 0:
+            _log.warning(f'No exclusion intervals matching: {ex_interval}')
+            return 0
+
+        self.statistics.remove_columns(self.charge[rows], self.id_index[rows], self.ids,
+                                       {col: self.bounds[col][rows] for col in BOUND_COLUMNS})
+        self.alive[rows] = False
+        self._alive_count -= len(rows)
+
+        if self._size - self._alive_count > self._size // 2:
+            self._merge()
+
+        return len(rows)
+
+    def _get_rows(self, ex_interval: ExclusionInterval) -> np.ndarray:
+        if ex_interval.id is None:
+            # retrieve rows by bounds, only rows with min_mass >= ex_interval.min_mass can be enveloped
+            rows = self._rows_from_min_mass(ex_interval.min_mass, ex_interval.max_mass)
+        else:
+            # retrieve rows by id, then check bounds
+            rows = self._get_rows_by_id(ex_interval.id)
+        return rows[self._envelop_mask(rows, ex_interval)]
+
+    def _get_rows_by_id(self, id: Any) -> np.ndarray:
+        index = self.id_lookup.get(id)
+        if index is None:
+            logging.debug(f'exclusion interval id: {id} is not found.')
+            return np.empty(0, dtype=np.intp)
+        return np.flatnonzero((self.id_index[:self._size] == index) & self.alive[:self._size])
+
+    def _rows_from_min_mass(self, low: Any, high: Any) -> np.ndarray:
+        """
+        Returns the alive rows with low <= min_mass <= high (None is unbounded). Rows with a None min_mass (NaN,
+        sorted after every number) are only returned for an unbounded low.
+        """
+        sorted_min_mass = self.bounds['min_mass'][:self._sorted_size]
+        nan_start = np.searchsorted(sorted_min_mass, np.nan, side='left')
+        start = 0 if low is None else np.searchsorted(sorted_min_mass, low, side='left')
+        stop = nan_start if high is None else min(np.searchsorted(sorted_min_mass, high, side='right'), nan_start)
+        nan_rows = np.arange(nan_start if low is None or low == -np.inf else self._sorted_size, self._sorted_size)
+        rows = np.concatenate([np.arange(start, stop), nan_rows, np.arange(self._sorted_size, self._size)])
+        return rows[self.alive[rows]]
+
+    def _envelop_mask(self, rows: np.ndarray, other: ExclusionInterval) -> np.ndarray:
+        """
+        Vectorized ExclusionInterval.is_enveloped_by(other) over rows. None bounds (NaN in the rows) are unbounded.
+        """
+        mask = np.ones(len(rows), dtype=bool)
+        if other.charge is not None:
+            mask &= self.charge[rows] == other.charge
+        for col in BOUND_COLUMNS:
+            value = getattr(other, col)
+            if value is None:
+                continue
+            bounds = self.bounds[col][rows]
+            if col.startswith('min'):
+                mask &= np.where(np.isnan(bounds), value == -np.inf, bounds >= value)
+            else:
+                mask &= np.where(np.isnan(bounds), value == np.inf, bounds <= value)
+        return mask
+
+    def _point_rows(self, point: ExclusionPoint) -> np.ndarray:
+        """
+        Returns the rows bounding point
+        """
+        if point.mass is None:
+            rows = np.flatnonzero(self.alive[:self._size])
+        else:
+            sorted_min_mass = self.bounds['min_mass'][:self._sorted_size]
+            start = np.searchsorted(sorted_min_mass, point.mass - self._max_mass_width, side='left')
+            stop = np.searchsorted(sorted_min_mass, point.mass, side='right')
+            rows = self._window_rows(start, stop, self._alive_open_rows())
+        return self._bounded_rows(rows, point)
+
+    def _alive_open_rows(self) -> np.ndarray:
+        return self._open_rows[self.alive[self._open_rows]]
+
+    def _window_rows(self, start: int, stop: int, open_rows: np.ndarray) -> np.ndarray:
+        """
+        The alive sorted rows in [start, stop), the unsorted tail and the open rows outside of the window
+        """
+        window = np.arange(start, stop)
+        tail = np.arange(self._sorted_size, self._size)
+        rows = np.concatenate([window[self.alive[window]], tail[self.alive[tail]],
+                               open_rows[(open_rows < start) | (open_rows >= stop)]])
+        return rows
+
+    def _bounded_rows(self, rows: np.ndarray, point: ExclusionPoint) -> np.ndarray:
+        """
+        Vectorized ExclusionPoint.is_bounded_by over the candidate rows, returns the matching rows
+        """
+        mask = np.ones(len(rows), dtype=bool)
+        if point.charge is not None:
+            charges = self.charge[rows]
+            mask &= (charges == NONE_CHARGE) | (charges == point.charge)
+        for value, min_col, max_col in ((point.mass, 'min_mass', 'max_mass'),
+                                        (point.rt, 'min_rt', 'max_rt'),
+                                        (point.ook0, 'min_ook0', 'max_ook0'),
+                                        (point.intensity, 'min_intensity', 'max_intensity')):
+            if value is None:
+                continue
+            # negated, so NaN (None) bounds are unbounded
+            mask &= ~((self.bounds[min_col][rows] > value) | (self.bounds[max_col][rows] <= value))
+        return rows[mask]
+
+    def _make_intervals(self, rows: np.ndarray) -> List[ExclusionInterval]:
+        charges = self.charge[rows].tolist()
+        id_indexes = self.id_index[rows].tolist()
+        bounds = [[None if value != value else value for value in self.bounds[col][rows].tolist()]  # NaN -> None
+                  for col in BOUND_COLUMNS]
+        return [ExclusionInterval(self.ids[id_index], None if charge == NONE_CHARGE else charge, *row_bounds)
+                for charge, id_index, *row_bounds in zip(charges, id_indexes, *bounds)]
+
+    def is_excluded(self, point: ExclusionPoint) -> bool:
+        return len(self._point_rows(point)) > 0
+
+    def query_by_interval(self, ex_interval: ExclusionInterval) -> List[ExclusionInterval]:
+        return self._make_intervals(self._get_rows(ex_interval))
+
+    def query_by_point(self, point: ExclusionPoint) -> List[ExclusionInterval]:
+        return self._make_intervals(self._point_rows(point))
+
+    def query_by_id(self, id: Any) -> List[ExclusionInterval]:
+        return self._make_intervals(self._get_rows_by_id(id))
+
+    def query_by_points(self, points: List[ExclusionPoint]) -> List[List[ExclusionInterval]]:
+        return [self._make_intervals(rows) for rows in self._sweep_points(points)]
+
+    def is_excluded_batch(self, points: List[ExclusionPoint]) -> List[bool]:
+        return [len(rows) > 0 for rows in self._sweep_points(points)]
+
+    def _sweep_points(self, points: List[ExclusionPoint]) -> List[np.ndarray]:
+        """
+        Sorts the points by mass and merges them against the min_mass sorted rows in one vectorized searchsorted,
+        giving each point its candidate slice. Points without a mass are queried individually.
+        """
+        results = [None] * len(points)
+        mass_points = [i for i, point in enumerate(points) if point.mass is not None]
+        for i, point in enumerate(points):
+            if point.mass is None:
+                results[i] = self._point_rows(point)
+
+        masses = np.array([points[i].mass for i in mass_points], dtype=np.float64)
+        order = np.argsort(masses, kind='stable')
+        sorted_min_mass = self.bounds['min_mass'][:self._sorted_size]
+        starts = np.searchsorted(sorted_min_mass, masses[order] - self._max_mass_width, side='left')
+        stops = np.searchsorted(sorted_min_mass, masses[order], side='right')
+        open_rows = self._alive_open_rows()
+
+        for k, start, stop in zip(order.tolist(), starts.tolist(), stops.tolist()):
+            i = mass_points[k]
+            results[i] = self._bounded_rows(self._window_rows(start, stop, open_rows), points[i])
+
+        return results
+
+    def _column_file(self, copy: bool = False) -> ColumnFile:
+        """
+        The alive rows (sorted by min_mass), as views of the columns or as copies
+        """
+        self._merge()
+        n = self._size
+        column = (lambda array: array[:n].copy()) if copy else (lambda array: array[:n])
+        return ColumnFile(charge=column(self.charge), id_index=column(self.id_index),
+                          bounds={col: column(self.bounds[col]) for col in BOUND_COLUMNS},
+                          ids=list(self.ids) if copy else self.ids, flags=SORTED_FLAG)
+
+    @staticmethod
+    def _dump_columns(column_file: ColumnFile, file_path: str):
+        columns = {**column_file.bounds, 'charge': column_file.charge, 'id_index': column_file.id_index}
+        _dump_pickle({'columns': columns, 'ids': column_file.ids}, file_path)
+
+    def save(self, file_path: str):
+        """
+        Save the alive rows as a pickled dict of numpy arrays
+        """
+        self._dump_columns(self._column_file(), file_path)
+
+    def save_columnar(self, file_path: str):
+        """
+        Writes the alive rows (sorted by min_mass) as a column file
+        """
+        self._column_file().write(file_path)
+
+    def snapshot_save(self, file_path: str, columnar: bool = False) -> Callable[[], None]:
+        """
+        Copies the alive rows (one memcpy per column)
+        """
+        column_file = self._column_file(copy=True)
+        if columnar:
+            return lambda: column_file.write(file_path)
+        return lambda: self._dump_columns(column_file, file_path)
+
+    def _load_column_file(self, column_file: ColumnFile):
+        """
+        Uses the (copy on write) mapped columns of column_file as the row arrays, the rows are copied once the
+        list grows
+        """
+        n = len(column_file)
+        self._reset()
+        if n == 0:
+            return
+
+        self.charge = column_file.charge
+        self.id_index = column_file.id_index
+        self.bounds = dict(column_file.bounds)
+        self.alive = np.ones(n, dtype=bool)
+        self.ids = list(column_file.ids)
+        self.id_lookup = {id: index for index, id in enumerate(self.ids)}
+        self._size = n
+        if column_file.sorted:
+            self._sorted_size = self._alive_count = n
+            self._index_mass_widths()
+        else:
+            self._merge()
+        self.statistics.add_columns(self.charge, self.id_index, self.ids, self.bounds)
+
+    def load(self, file_path: str) -> None:
+        """
+        Maps a column file, or loads a pickled dict of numpy arrays
+        """
+        if is_column_file(file_path):
+            self._load_column_file(ColumnFile.read(file_path, writable=True))
+            return
+
+        data = _load_pickle(file_path)
+
+        columns = data['columns']
+        n = len(columns['charge'])
+        self._reset(n)
+        self.charge[:n] = columns['charge']
+        self.id_index[:n] = columns['id_index']
+        for col in BOUND_COLUMNS:
+            self.bounds[col][:n] = columns[col]
+        self.alive[:n] = True
+        self.ids = list(data['ids'])
+        self.id_lookup = {id: index for index, id in enumerate(self.ids)}
+        self._size = n
+        self._merge()
+        self.statistics.add_columns(self.charge[:n], self.id_index[:n], self.ids,
+                                    {col: self.bounds[col][:n] for col in BOUND_COLUMNS})
+
+    @classmethod
+    def read_only(cls, file_path: str, **kwargs) -> 'ColumnarExclusionList':
+        """
+        A list serving the column file at file_path from a read only mapping, nothing is copied for sorted files.
+        The list must not be modified.
+        """
+        column_file = ColumnFile.read(file_path)
+        if not column_file.sorted:
+            # sorting writes to the columns, so unsorted files get a copy on write mapping
+            column_file = ColumnFile.read(file_path, writable=True)
+        exclusion_list = cls(**kwargs)
+        exclusion_list._load_column_file(column_file)
+        return exclusion_list
+
+    def clear(self) -> None:
+        """
+        Clears all data
+        """
+        self._reset()
 
     def __len__(self):
-        return len(self.interval_tree)
+        return self._alive_count
+
+    def __iter__(self) -> Iterator[ExclusionInterval]:
+        yield from self._make_intervals(np.flatnonzero(self.alive[:self._size]))
+
+    def iter_chunks(self, chunk_size: int) -> Iterator[List[ExclusionInterval]]:
+        """
+        Copies the alive rows' columns (not interval objects), then makes the intervals chunk_size rows at a time
+        """
+        rows = np.flatnonzero(self.alive[:self._size])
+        columns = ColumnFile(charge=self.charge[rows], id_index=self.id_index[rows],
+                             bounds={col: self.bounds[col][rows] for col in BOUND_COLUMNS}, ids=list(self.ids))
+        for start in range(0, len(columns), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            yield ColumnFile(charge=columns.charge[chunk], id_index=columns.id_index[chunk],
+                             bounds={col: columns.bounds[col][chunk] for col in BOUND_COLUMNS},
+                             ids=columns.ids).intervals()
+
+    def stats(self):
+        return {'len': len(self), 'id_table_len': len(self.ids), 'rows': self._size,
+                'capacity': self._capacity(), **self.statistics.stats(), 'class': str(type(self))}
+
+
+class RTreeExclusionList(ExclusionList):
+    """
+    ExclusionList which stores intervals in a 4D R-Tree over (mass, rt, ook0, intensity), so that point and
+    envelope queries prune on all dimensions at once. Every interval gets its own integer handle, therefore
+    duplicate intervals are stored and removed independently. Charge is checked on the (few) returned candidates.
+
+    The R-Tree bounds are inclusive, while the max bounds of an ExclusionInterval are exclusive, so candidates
+    are confirmed with _is_bounded (ExclusionPoint.is_bounded_by with None bounds unbounded).
+    """
+
+    def __init__(self):
+        self._reset()
+
+    @staticmethod
+    def _make_properties():
+        properties = rtree_index.Property()
+        properties.dimension = 4
+        return properties
+
+    def _reset(self):
+        self.rtree = rtree_index.Index(properties=self._make_properties(), interleaved=False)
+        self.intervals: Dict[int, ExclusionInterval] = {}
+        self.id_dict: Dict[Any, set] = {}
+        self._next_handle = 0
+        self.statistics = IntervalStatistics()
+
+    @staticmethod
+    def _interval_coordinates(ex_interval: ExclusionInterval):
+        """
+        R-Tree coordinates (min_mass, max_mass, min_rt, max_rt, ...) of an interval. None bounds are unbounded.
+        """
+        coordinates = []
+        for col in BOUND_COLUMNS:
+            value = getattr(ex_interval, col)
+            if value is None:
+                value = -sys.float_info.max if col.startswith('min') else sys.float_info.max
+            coordinates.append(value)
+        return coordinates
+
+    @staticmethod
+    def _point_coordinates(point: ExclusionPoint):
+        coordinates = []
+        for value in (point.mass, point.rt, point.ook0, point.intensity):
+            if value is None:
+                coordinates.extend((-sys.float_info.max, sys.float_info.max))
+            else:
+                coordinates.extend((value, value))
+        return coordinates
+
+    def _new_handle(self, ex_interval: ExclusionInterval) -> int:
+        handle = self._next_handle
+        self._next_handle += 1
+        self.intervals[handle] = ex_interval
+        self.id_dict.setdefault(ex_interval.id, set()).add(handle)
+        return handle
+
+    def add(self, ex_interval: ExclusionInterval):
+        if ex_interval.id is None:
+            raise Exception('Cannot add an interval with id = None')
+        handle = self._new_handle(ex_interval)
+        self.statistics.add(ex_interval)
+        self.rtree.insert(handle, self._interval_coordinates(ex_interval))
+
+    def remove(self, ex_interval: ExclusionInterval):
+        handles = self._get_handles(ex_interval)
+        if not handles:
+            _log.warning(f'No exclusion intervals matching: {ex_interval}')
+            return 0
+
+        for handle in handles:
+            interval = self.intervals.pop(handle)
+            self.rtree.delete(handle, self._interval_coordinates(interval))
+            self.statistics.remove(interval)
+            id_handles = self.id_dict[interval.id]
+            id_handles.discard(handle)
+            if not id_handles:
+                del self.id_dict[interval.id]
+
+        return len(handles)
+
+    def _get_handles(self, ex_interval: ExclusionInterval) -> List[int]:
+        if ex_interval.id is None:
+            # retrieve intervals by bounds
+            handles = self.rtree.contains(self._interval_coordinates(ex_interval))
+        else:
+            # retrieve intervals by id, then check bounds
+            handles = self.id_dict.get(ex_interval.id, ())
+            coordinates = self._interval_coordinates(ex_interval)
+            handles = [handle for handle in handles
+                       if self._is_enveloped(self.intervals[handle], coordinates)]
+
+        if ex_interval.charge is not None:
+            handles = [handle for handle in handles if self.intervals[handle].charge == ex_interval.charge]
+        return list(handles)
+
+    def _is_enveloped(self, interval: ExclusionInterval, coordinates: List[float]) -> bool:
+        for i, value in enumerate(self._interval_coordinates(interval)):
+            if (i % 2 == 0 and value < coordinates[i]) or (i % 2 == 1 and value > coordinates[i]):
+                return False
+        return True
+
+    def _is_bounded(self, point: ExclusionPoint, interval: ExclusionInterval) -> bool:
+        if point.charge is not None and interval.charge is not None and point.charge != interval.charge:
+            return False
+        coordinates = self._interval_coordinates(interval)
+        for i, value in enumerate((point.mass, point.rt, point.ook0, point.intensity)):
+            if value is not None and (value < coordinates[2 * i] or value >= coordinates[2 * i + 1]):
+                return False
+        return True
+
+    def _get_point_handles(self, point: ExclusionPoint):
+        for handle in self.rtree.intersection(self._point_coordinates(point)):
+            if self._is_bounded(point, self.intervals[handle]):
+                yield handle
+
+    def is_excluded(self, point: ExclusionPoint) -> bool:
+        return next(self._get_point_handles(point), None) is not None
+
+    def query_by_interval(self, ex_interval: ExclusionInterval) -> List[ExclusionInterval]:
+        return [self.intervals[handle] for handle in self._get_handles(ex_interval)]
+
+    def query_by_point(self, point: ExclusionPoint) -> List[ExclusionInterval]:
+        return [self.intervals[handle] for handle in self._get_point_handles(point)]
+
+    def query_by_id(self, id: Any) -> List[ExclusionInterval]:
+        return [self.intervals[handle] for handle in self.id_dict.get(id, ())]
+
+    def save(self, file_path: str):
+        """
+        Save the intervals as a pickled list
+        """
+        _dump_intervals(list(self.intervals.values()), file_path)
+
+    def bulk_add(self, intervals: List[ExclusionInterval]):
+        """
+        Bulk loads (sort-tile-recursive) a new R-Tree from all intervals, unless only a few intervals are added
+        to a large tree
+        """
+        if any(interval.id is None for interval in intervals):
+            raise Exception('Cannot add an interval with id = None')
+        if not intervals:
+            return
+
+        self.statistics.add_intervals(intervals)
+        if len(intervals) < len(self) // 4:
+            for interval in intervals:
+                self.rtree.insert(self._new_handle(interval), self._interval_coordinates(interval))
+            return
+
+        existing = list(self.intervals.items())
+
+        def stream():
+            for handle, interval in existing:
+                yield handle, self._interval_coordinates(interval), None
+            for interval in intervals:
+                yield self._new_handle(interval), self._interval_coordinates(interval), None
+
+        self.rtree = rtree_index.Index(stream(), properties=self._make_properties(), interleaved=False)
+
+    def load(self, file_path: str) -> None:
+        """
+        Loads a pickled list of intervals and bulk loads them into a new R-Tree
+        """
+        intervals = _load_intervals(file_path)
+        self._reset()
+        self.bulk_add(intervals)
+
+    def clear(self) -> None:
+        """
+        Clears all data
+        """
+        self._reset()
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def __iter__(self) -> Iterator[ExclusionInterval]:
+        yield from list(self.intervals.values())
+
+    def iter_chunks(self, chunk_size: int) -> Iterator[List[ExclusionInterval]]:
+        return _handle_chunks(lambda: (self.intervals, self._next_handle), chunk_size)
+
+    def stats(self):
+        return {'len': len(self), 'id_table_len': len(self.id_dict), **self.statistics.stats(),
+                'class': str(type(self))}
+
+
+class ChargePartitionedExclusionList(ExclusionList):
+    """
+    ExclusionList which stores intervals in one sub list per charge, plus a wildcard sub list for intervals with
+    charge = None. A point query with a charge only searches its own charge's sub list and the wildcard sub list.
+    Sub lists are created with exclusion_list_factory (any ExclusionList backend).
+    """
+
+    def __init__(self, exclusion_list_factory: Callable[[], ExclusionList] = MassIntervalTree):
+        self.exclusion_list_factory = exclusion_list_factory
+        self.partitions: Dict[Union[int, None], ExclusionList] = {}
+
+    def _get_partition(self, charge: Union[int, None]) -> ExclusionList:
+        partition = self.partitions.get(charge)
+        if partition is None:
+            partition = self.exclusion_list_factory()
+            self.partitions[charge] = partition
+        return partition
+
+    def _interval_partitions(self, ex_interval: ExclusionInterval) -> List[ExclusionList]:
+        """
+        Partitions which can hold intervals enveloped by ex_interval
+        """
+        if ex_interval.charge is None:
+            return list(self.partitions.values())
+        partition = self.partitions.get(ex_interval.charge)
+        return [] if partition is None else [partition]
+
+    def _point_partitions(self, point: ExclusionPoint) -> List[ExclusionList]:
+        """
+        Partitions which can hold intervals bounding point
+        """
+        if point.charge is None:
+            return list(self.partitions.values())
+        return [partition for partition in (self.partitions.get(point.charge), self.partitions.get(None))
+                if partition is not None]
+
+    def add(self, ex_interval: ExclusionInterval):
+        if ex_interval.id is None:
+            raise Exception('Cannot add an interval with id = None')
+        self._get_partition(ex_interval.charge).add(ex_interval)
+
+    def bulk_add(self, intervals: List[ExclusionInterval]):
+        groups = {}
+        for interval in intervals:
+            groups.setdefault(interval.charge, []).append(interval)
+        for charge, group in groups.items():
+            self._get_partition(charge).bulk_add(group)
+
+    def deduplicate(self, intervals: List[ExclusionInterval]) -> List[ExclusionInterval]:
+        groups = {}
+        for interval in intervals:
+            groups.setdefault(interval.charge, []).append(interval)
+        # charges without a partition only need the duplicates within their group removed
+        new = {id(interval) for charge, group in groups.items()
+               for interval in self.partitions.get(charge, self.exclusion_list_factory()).deduplicate(group)}
+        return [interval for interval in intervals if id(interval) in new]
+
+    def remove(self, ex_interval: ExclusionInterval):
+        partitions = self._interval_partitions(ex_interval)
+        # the sub lists warn on misses, so only query partitions which hold matching intervals
+        removed = 0
+        for partition in partitions:
+            if partition.query_by_interval(ex_interval):
+                removed += partition.remove(ex_interval)
+        if removed == 0:
+            _log.warning(f'No exclusion intervals matching: {ex_interval}')
+        return removed
+
+    def is_excluded(self, point: ExclusionPoint) -> bool:
+        return any(partition.is_excluded(point) for partition in self._point_partitions(point))
+
+    def query_by_interval(self, ex_interval: ExclusionInterval) -> List[ExclusionInterval]:
+        return [interval for partition in self._interval_partitions(ex_interval)
+                for interval in partition.query_by_interval(ex_interval)]
+
+    def query_by_point(self, point: ExclusionPoint) -> List[ExclusionInterval]:
+        return [interval for partition in self._point_partitions(point)
+                for interval in partition.query_by_point(point)]
+
+    def query_by_id(self, id: Any) -> List[ExclusionInterval]:
+        return [interval for partition in self.partitions.values() for interval in partition.query_by_id(id)]
+
+    def _group_points(self, points: List[ExclusionPoint]) -> Dict[Union[int, None], List[int]]:
+        groups = {}
+        for i, point in enumerate(points):
+            groups.setdefault(point.charge, []).append(i)
+        return groups
+
+    def query_by_points(self, points: List[ExclusionPoint]) -> List[List[ExclusionInterval]]:
+        results = [[] for _ in points]
+        for indexes in self._group_points(points).values():
+            group = [points[i] for i in indexes]
+            for partition in self._point_partitions(group[0]):
+                for i, intervals in zip(indexes, partition.query_by_points(group)):
+                    results[i].extend(intervals)
+        return results
+
+    def is_excluded_batch(self, points: List[ExclusionPoint]) -> List[bool]:
+        results = [False] * len(points)
+        for indexes in self._group_points(points).values():
+            for partition in self._point_partitions(points[indexes[0]]):
+                remaining = [i for i in indexes if not results[i]]
+                if not remaining:
+                    break
+                for i, excluded in zip(remaining, partition.is_excluded_batch([points[i] for i in remaining])):
+                    results[i] = excluded
+        return results
+
+    def save(self, file_path: str):
+        """
+        Save the intervals as a pickled list
+        """
+        _dump_intervals(list(self), file_path)
+
+    def load(self, file_path: str) -> None:
+        """
+        Loads a pickled list of intervals (or a pickled MassIntervalTree IntervalTree) into new partitions
+        """
+        intervals = _load_intervals(file_path)
+        self.clear()
+        self.bulk_add(intervals)
+
+    def clear(self) -> None:
+        """
+        Clears all data
+        """
+        self.partitions = {}
+
+    def __len__(self):
+        return sum(len(partition) for partition in self.partitions.values())
+
+    def __iter__(self) -> Iterator[ExclusionInterval]:
+        for partition in list(self.partitions.values()):
+            yield from partition
+
+    def iter_chunks(self, chunk_size: int) -> Iterator[List[ExclusionInterval]]:
+        for partition in list(self.partitions.values()):
+            yield from partition.iter_chunks(chunk_size)
+
+    @property
+    def statistics(self) -> Optional[IntervalStatistics]:
+        partition_statistics = [partition.statistics for partition in self.partitions.values()]
+        if None in partition_statistics:
+            return None
+        return IntervalStatistics.combine(partition_statistics)
+
+    def stats(self):
+        statistics = self.statistics
+        return {'len': len(self), 'partitions': {str(charge): len(partition)
+                                                  for charge, partition in self.partitions.items()},
+                **(statistics.stats() if statistics is not None else {}), 'class': str(type(self))}
+
+
+class RTWindowExclusionList(ExclusionList):
+    """
+    Wraps an ExclusionList and tracks the current retention time of the acquisition. Intervals whose (exclusive)
+    max_rt is at or behind current_rt can never match again, so they are evicted from the wrapped list, or moved to
+    archive if one is given. Intervals are kept in a min-heap on max_rt, so eviction only touches expired intervals.
+
+    current_rt is moved forward with advance(), or by every point query with an rt when auto_advance is True.
+    Point queries with rt = None will no longer match evicted intervals. The heap and current_rt are guarded by a
+    lock, as concurrent point queries advance them.
+    """
+
+    def __init__(self, exclusion_list: ExclusionList, auto_advance: bool = False,
+                 archive: Optional[ExclusionList] = None):
+        self.exclusion_list = exclusion_list
+        self.auto_advance = auto_advance
+        self.archive = archive
+        self.current_rt = -sys.float_info.max
+        self.evicted = 0
+        self._heap = []
+        self._counter = itertools.count()  # tie breaker, intervals are not orderable
+        self._lock = Lock()
+        self._rebuild_heap()  # the wrapped list may already hold intervals, e.g. recovered from a journal
+
+    def _push(self, ex_interval: ExclusionInterval):
+        heapq.heappush(self._heap, (ex_interval.max_rt, next(self._counter), ex_interval))
+
+    def _rebuild_heap(self):
+        self._heap = [(interval.max_rt, next(self._counter), interval) for interval in self.exclusion_list
+                      if interval.max_rt is not None]
+        heapq.heapify(self._heap)
+
+    def _evict(self, ex_interval: ExclusionInterval) -> int:
+        # expired intervals may already have been removed (by remove() or by an enveloping eviction)
+        intervals = self.exclusion_list.query_by_interval(ex_interval)
+        if not intervals:
+            return 0
+        self.exclusion_list.remove(ex_interval)
+        if self.archive is not None:
+            for interval in intervals:
+                self.archive.add(interval)
+        return len(intervals)
+
+    def advance(self, rt: float) -> int:
+        """
+        Moves current_rt forward to rt (never backwards) and evicts expired intervals
+        :param rt: current retention time of the acquisition
+        :return: number of evicted intervals
+        """
+        with self._lock:
+            self.current_rt = max(self.current_rt, rt)
+            evicted = 0
+            while self._heap and self._heap[0][0] <= self.current_rt:
+                evicted += self._evict(heapq.heappop(self._heap)[2])
+            self.evicted += evicted
+        return evicted
+
+    def add(self, ex_interval: ExclusionInterval):
+        if ex_interval.id is None:
+            raise Exception('Cannot add an interval with id = None')
+        if ex_interval.max_rt is None:  # never expires
+            self.exclusion_list.add(ex_interval)
+            return
+        with self._lock:
+            if ex_interval.max_rt <= self.current_rt:
+                logging.debug(f'Interval is already expired: {ex_interval}')
+                if self.archive is not None:
+                    self.archive.add(ex_interval)
+                return
+            self.exclusion_list.add(ex_interval)
+            self._push(ex_interval)
+
+    def bulk_add(self, intervals: List[ExclusionInterval]):
+        with self._lock:
+            self._bulk_add(intervals)
+
+    def _bulk_add(self, intervals: List[ExclusionInterval]):
+        live = [interval for interval in intervals
+                if interval.max_rt is None or interval.max_rt > self.current_rt]
+        if self.archive is not None and len(live) < len(intervals):
+            self.archive.bulk_add([interval for interval in intervals if interval.max_rt is not None and
+                                   interval.max_rt <= self.current_rt])
+        self.exclusion_list.bulk_add(live)
+        self._heap.extend((interval.max_rt, next(self._counter), interval) for interval in live
+                          if interval.max_rt is not None)
+        heapq.heapify(self._heap)
+
+    def merge_intervals(self, intervals: List[ExclusionInterval]) -> int:
+        """
+        Deduplicates and adds the intervals under the lock, so no add or eviction lands in between
+        """
+        with self._lock:
+            new = self.exclusion_list.deduplicate(intervals)
+            self._bulk_add(new)
+        return len(new)
+
+    def remove(self, ex_interval: ExclusionInterval):
+        # heap entries of removed intervals are skipped when they expire
+        return self.exclusion_list.remove(ex_interval)
+
+    def _on_point(self, point: ExclusionPoint):
+        if self.auto_advance and point.rt is not None:
+            self.advance(point.rt)
+
+    def is_excluded(self, point: ExclusionPoint) -> bool:
+        self._on_point(point)
+        return self.exclusion_list.is_excluded(point)
+
+    def query_by_interval(self, ex_interval: ExclusionInterval) -> List[ExclusionInterval]:
+        return self.exclusion_list.query_by_interval(ex_interval)
+
+    def query_by_point(self, point: ExclusionPoint) -> List[ExclusionInterval]:
+        self._on_point(point)
+        return self.exclusion_list.query_by_point(point)
+
+    def query_by_id(self, id: Any) -> List[ExclusionInterval]:
+        return self.exclusion_list.query_by_id(id)
+
+    def deduplicate(self, intervals: List[ExclusionInterval]) -> List[ExclusionInterval]:
+        return self.exclusion_list.deduplicate(intervals)
+
+    def _on_points(self, points: List[ExclusionPoint]):
+        # advancing to the earliest rt cannot evict an interval that another point of the batch could match
+        rts = [point.rt for point in points if point.rt is not None]
+        if self.auto_advance and rts:
+            self.advance(min(rts))
+
+    def query_by_points(self, points: List[ExclusionPoint]) -> List[List[ExclusionInterval]]:
+        self._on_points(points)
+        return self.exclusion_list.query_by_points(points)
+
+    def is_excluded_batch(self, points: List[ExclusionPoint]) -> List[bool]:
+        self._on_points(points)
+        return self.exclusion_list.is_excluded_batch(points)
+
+    def save(self, file_path: str):
+        self.exclusion_list.save(file_path)
+
+    def save_columnar(self, file_path: str):
+        self.exclusion_list.save_columnar(file_path)
+
+    def snapshot_save(self, file_path: str, columnar: bool = False) -> Callable[[], None]:
+        return self.exclusion_list.snapshot_save(file_path, columnar)
+
+    def load(self, file_path: str) -> None:
+        """
+        Loads the wrapped list and resets current_rt
+        """
+        with self._lock:
+            self.exclusion_list.load(file_path)
+            self.current_rt = -sys.float_info.max
+            self._rebuild_heap()
+
+    def clear(self) -> None:
+        """
+        Clears all data and resets current_rt
+        """
+        with self._lock:
+            self.exclusion_list.clear()
+            self.current_rt = -sys.float_info.max
+            self._heap = []
+
+    def __len__(self):
+        return len(self.exclusion_list)
+
+    def __iter__(self) -> Iterator[ExclusionInterval]:
+        return iter(self.exclusion_list)
+
+    def iter_chunks(self, chunk_size: int) -> Iterator[List[ExclusionInterval]]:
+        return _locked_chunks(self._lock, self.exclusion_list.iter_chunks(chunk_size))
+
+    def stats(self):
+        return {**self.exclusion_list.stats(), 'current_rt': self.current_rt, 'evicted': self.evicted,
+                'heap_len': len(self._heap), 'window_class': str(type(self))}
+
+
+class OccupancyFilteredExclusionList(ExclusionList):
+    """
+    Wraps an ExclusionList with an OccupancyGrid over (charge, mass bin, rt bin), which is updated on add/remove.
+    Point queries consult the grid first and answer 'not excluded' without querying the wrapped list when the
+    point's cell is empty, which is the common case for candidate precursors.
+    """
+
+    def __init__(self, exclusion_list: ExclusionList, mass_bin_width: float = 1.0, rt_bin_width: float = 60.0,
+                 max_cells: int = 4096):
+        self.exclusion_list = exclusion_list
+        self.grid = OccupancyGrid(mass_bin_width=mass_bin_width, rt_bin_width=rt_bin_width, max_cells=max_cells)
+        self.filtered = 0  # point queries answered by the grid alone
+        self._rebuild_grid()
+
+    def _rebuild_grid(self):
+        self.grid.clear()
+        for interval in self.exclusion_list:
+            self.grid.add(interval)
+
+    def add(self, ex_interval: ExclusionInterval):
+        self.exclusion_list.add(ex_interval)
+        self.grid.add(ex_interval)
+
+    def bulk_add(self, intervals: List[ExclusionInterval]):
+        self.exclusion_list.bulk_add(intervals)
+        for interval in intervals:
+            self.grid.add(interval)
+
+    def remove(self, ex_interval: ExclusionInterval):
+        # the grid needs the removed intervals, not the (enveloping) interval used to remove them
+        intervals = self.exclusion_list.query_by_interval(ex_interval)
+        removed = self.exclusion_list.remove(ex_interval)
+        for interval in intervals:
+            self.grid.remove(interval)
+        return removed
+
+    def _may_contain(self, point: ExclusionPoint) -> bool:
+        if self.grid.may_contain(point):
+            return True
+        self.filtered += 1
+        return False
+
+    def is_excluded(self, point: ExclusionPoint) -> bool:
+        return self._may_contain(point) and self.exclusion_list.is_excluded(point)
+
+    def query_by_interval(self, ex_interval: ExclusionInterval) -> List[ExclusionInterval]:
+        return self.exclusion_list.query_by_interval(ex_interval)
+
+    def query_by_point(self, point: ExclusionPoint) -> List[ExclusionInterval]:
+        if not self._may_contain(point):
+            return []
+        return self.exclusion_list.query_by_point(point)
+
+    def query_by_id(self, id: Any) -> List[ExclusionInterval]:
+        return self.exclusion_list.query_by_id(id)
+
+    def deduplicate(self, intervals: List[ExclusionInterval]) -> List[ExclusionInterval]:
+        return self.exclusion_list.deduplicate(intervals)
+
+    def query_by_points(self, points: List[ExclusionPoint]) -> List[List[ExclusionInterval]]:
+        results = [[] for _ in points]
+        indexes = [i for i, point in enumerate(points) if self._may_contain(point)]
+        for i, intervals in zip(indexes, self.exclusion_list.query_by_points([points[i] for i in indexes])):
+            results[i] = intervals
+        return results
+
+    def is_excluded_batch(self, points: List[ExclusionPoint]) -> List[bool]:
+        results = [False] * len(points)
+        indexes = [i for i, point in enumerate(points) if self._may_contain(point)]
+        for i, excluded in zip(indexes, self.exclusion_list.is_excluded_batch([points[i] for i in indexes])):
+            results[i] = excluded
+        return results
+
+    def save(self, file_path: str):
+        self.exclusion_list.save(file_path)
+
+    def save_columnar(self, file_path: str):
+        self.exclusion_list.save_columnar(file_path)
+
+    def snapshot_save(self, file_path: str, columnar: bool = False) -> Callable[[], None]:
+        return self.exclusion_list.snapshot_save(file_path, columnar)
+
+    def load(self, file_path: str) -> None:
+        self.exclusion_list.load(file_path)
+        self._rebuild_grid()
+
+    def clear(self) -> None:
+        self.exclusion_list.clear()
+        self.grid.clear()
+
+    def __len__(self):
+        return len(self.exclusion_list)
+
+    def __iter__(self) -> Iterator[ExclusionInterval]:
+        return iter(self.exclusion_list)
+
+    def iter_chunks(self, chunk_size: int) -> Iterator[List[ExclusionInterval]]:
+        return self.exclusion_list.iter_chunks(chunk_size)
+
+    def stats(self):
+        return {**self.exclusion_list.stats(), **self.grid.stats(), 'filtered': self.filtered}
+
+
+def _quantize(value: Union[float, None], width: Union[float, None]):
+    if value is None or not width:
+        return value
+    return math.floor(value / width)
+
+
+class CachedExclusionList(ExclusionList):
+    """
+    Wraps an ExclusionList with an LRU cache of point query results (query_by_point and is_excluded), keyed on the
+    quantized point. Mass is quantized in bins of mass_ppm, rt and ook0 in bins of rt_width and ook0_width; None
+    (the default) keeps the exact value. Quantized keys answer every point of a bin with the first point's result,
+    so the widths should be well below the interval tolerances.
+
+    Every add/remove/clear/load bumps generation. Cached results are stamped with the generation they were computed
+    in and are misses once it changed, so a write invalidates the cache in O(1). The LRU order is guarded by a lock,
+    queries of the wrapped list run outside of it.
+    """
+
+    def __init__(self, exclusion_list: ExclusionList, max_size: int = 4096, mass_ppm: Union[float, None] = None,
+                 rt_width: Union[float, None] = None, ook0_width: Union[float, None] = None):
+        self.exclusion_list = exclusion_list
+        self.max_size = max_size
+        self.mass_width = math.log1p(mass_ppm / 1_000_000) if mass_ppm else None
+        self.rt_width = rt_width
+        self.ook0_width = ook0_width
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._cache: OrderedDict = OrderedDict()  # (kind, point key) -> (generation, result)
+        self._lock = Lock()
+
+    def _invalidate(self):
+        with self._lock:
+            self.generation += 1
+
+    def _key(self, kind: str, point: ExclusionPoint) -> Tuple:
+        mass = point.mass
+        if self.mass_width and mass is not None and mass > 0:
+            mass = _quantize(math.log(mass), self.mass_width)
+        return (kind, point.charge, mass, _quantize(point.rt, self.rt_width), _quantize(point.ook0, self.ook0_width),
+                point.intensity)
+
+    def _get(self, key: Tuple):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None or entry[0] != self.generation:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def _put(self, key: Tuple, generation: int, result):
+        with self._lock:
+            self._cache[key] = (generation, result)
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def _cached_batch(self, kind: str, points: List[ExclusionPoint], query: Callable) -> list:
+        generation = self.generation  # read before querying, results of a concurrent write's generation are stale
+        keys = [self._key(kind, point) for point in points]
+        results = [None] * len(points)
+        missed = []
+        for i, key in enumerate(keys):
+            entry = self._get(key)
+            if entry is None:
+                missed.append(i)
+            else:
+                results[i] = entry[1]
+        if missed:
+            for i, result in zip(missed, query([points[i] for i in missed])):
+                results[i] = result
+                self._put(keys[i], generation, result)
+        return results
+
+    def add(self, ex_interval: ExclusionInterval):
+        self.exclusion_list.add(ex_interval)
+        self._invalidate()
+
+    def bulk_add(self, intervals: List[ExclusionInterval]):
+        self.exclusion_list.bulk_add(intervals)
+        self._invalidate()
+
+    def remove(self, ex_interval: ExclusionInterval):
+        removed = self.exclusion_list.remove(ex_interval)
+        self._invalidate()
+        return removed
+
+    def is_excluded(self, point: ExclusionPoint) -> bool:
+        return self.is_excluded_batch([point])[0]
+
+    def query_by_interval(self, ex_interval: ExclusionInterval) -> List[ExclusionInterval]:
+        return self.exclusion_list.query_by_interval(ex_interval)
+
+    def query_by_point(self, point: ExclusionPoint) -> List[ExclusionInterval]:
+        return self.query_by_points([point])[0]
+
+    def query_by_id(self, id: Any) -> List[ExclusionInterval]:
+        return self.exclusion_list.query_by_id(id)
+
+    def deduplicate(self, intervals: List[ExclusionInterval]) -> List[ExclusionInterval]:
+        return self.exclusion_list.deduplicate(intervals)
+
+    def query_by_points(self, points: List[ExclusionPoint]) -> List[List[ExclusionInterval]]:
+        # cached lists are shared, so callers get copies
+        return [list(intervals) for intervals in
+                self._cached_batch('point', points, self.exclusion_list.query_by_points)]
+
+    def is_excluded_batch(self, points: List[ExclusionPoint]) -> List[bool]:
+        return self._cached_batch('excluded', points, self.exclusion_list.is_excluded_batch)
+
+    def save(self, file_path: str):
+        self.exclusion_list.save(file_path)
+
+    def save_columnar(self, file_path: str):
+        self.exclusion_list.save_columnar(file_path)
+
+    def snapshot_save(self, file_path: str, columnar: bool = False) -> Callable[[], None]:
+        return self.exclusion_list.snapshot_save(file_path, columnar)
+
+    def load(self, file_path: str) -> None:
+        self.exclusion_list.load(file_path)
+        self._invalidate()
+
+    def clear(self) -> None:
+        self.exclusion_list.clear()
+        with self._lock:
+            self._cache.clear()
+        self._invalidate()
+
+    def __len__(self):
+        return len(self.exclusion_list)
+
+    def __iter__(self) -> Iterator[ExclusionInterval]:
+        return iter(self.exclusion_list)
+
+    def iter_chunks(self, chunk_size: int) -> Iterator[List[ExclusionInterval]]:
+        return self.exclusion_list.iter_chunks(chunk_size)
+
+    def stats(self):
+        return {**self.exclusion_list.stats(), 'cache_hits': self.hits, 'cache_misses': self.misses,
+                'cache_size': len(self._cache), 'generation': self.generation}
+
+
+def _bounds(interval: ExclusionInterval, min_col: str, max_col: str) -> Tuple[float, float]:
+    # None bounds are unbounded
+    low, high = getattr(interval, min_col), getattr(interval, max_col)
+    return -math.inf if low is None else low, math.inf if high is None else high
+
+
+def _bounding_value(col: str, values: List[Union[float, None]]) -> Union[float, None]:
+    # min/max of the bounds of col, a None (unbounded) bound stays None
+    if any(value is None for value in values):
+        return None
+    return min(values) if col.startswith('min') else max(values)
+
+
+def _is_mergeable(box: ExclusionInterval, interval: ExclusionInterval, max_growth: float) -> bool:
+    """
+    Intervals can be merged into their bounding box if they overlap or touch in every dimension, and the bounding box
+    is at most (1 + max_growth) times the volume of their union. Dimensions where both bounds are equal (or both
+    None) are ignored, None bounds are unbounded.
+    """
+    box_volume = interval_volume = intersection_volume = bounding_volume = 1.0
+    box_contains = interval_contains = True
+    for min_col, max_col in zip(BOUND_COLUMNS[::2], BOUND_COLUMNS[1::2]):
+        box_min, box_max = _bounds(box, min_col, max_col)
+        min_value, max_value = _bounds(interval, min_col, max_col)
+        if min_value > box_max or box_min > max_value:
+            return False
+        if box_min == min_value and box_max == max_value:
+            continue
+        box_contains &= box_min <= min_value and max_value <= box_max
+        interval_contains &= min_value <= box_min and box_max <= max_value
+        box_volume *= box_max - box_min
+        interval_volume *= max_value - min_value
+        intersection_volume *= min(box_max, max_value) - max(box_min, min_value)
+        bounding_volume *= max(box_max, max_value) - min(box_min, min_value)
+
+    if box_contains or interval_contains:
+        return True
+    if not math.isfinite(bounding_volume):
+        return False
+    return bounding_volume <= (box_volume + interval_volume - intersection_volume) * (1 + max_growth)
+
+
+class CompactingExclusionList(ExclusionList):
+    """
+    Wraps an ExclusionList and merges overlapping or adjacent intervals which share charge and id prefix into their
+    bounding box (see _is_mergeable). compact() runs a merge pass on demand, CompactionWorker runs it periodically.
+
+    Merged boxes get the id prefix as id. Their original intervals are kept as members, so removing (or querying)
+    an original id still works: the box is removed and its remaining members are added back uncompacted.
+    Members are not saved, a loaded list only knows its boxes. compact(), remove() and the member lookups hold a
+    lock, as CompactionWorker compacts concurrently with the requests.
+    """
+
+    def __init__(self, exclusion_list: ExclusionList, max_growth: float = 0.0,
+                 id_prefix: Callable[[str], str] = default_id_prefix):
+        self.exclusion_list = exclusion_list
+        self.max_growth = max_growth
+        self.id_prefix = id_prefix
+        self.boxes: Dict[Tuple, ExclusionInterval] = {}
+        self.members: Dict[Tuple, List[ExclusionInterval]] = {}
+        self.member_of: Dict[Any, set] = {}  # member ids (and box ids) -> box keys
+        self.member_count = 0
+        self.merged = 0
+        self._lock = Lock()
+
+    def _add_box(self, box: ExclusionInterval, members: List[ExclusionInterval]):
+        key = _interval_key(box)
+        self.boxes[key] = box
+        self.members[key] = members
+        self.member_count += len(members)
+        for id in {box.id} | {member.id for member in members}:
+            self.member_of.setdefault(id, set()).add(key)
+
+    def _pop_box(self, key: Tuple) -> Tuple[ExclusionInterval, List[ExclusionInterval]]:
+        box = self.boxes.pop(key)
+        members = self.members.pop(key)
+        self.member_count -= len(members)
+        for id in {box.id} | {member.id for member in members}:
+            keys = self.member_of[id]
+            keys.discard(key)
+            if not keys:
+                del self.member_of[id]
+        return box, members
+
+    def compact(self) -> int:
+        """
+        Merges the intervals of every (charge, id prefix) group in a sweep over min_mass
+        :return: number of intervals which were merged away
+        """
+        with self._lock:
+            merged = self._compact()
+        self.merged += merged
+        return merged
+
+    def _compact(self) -> int:
+        groups = {}
+        for interval in self.exclusion_list:
+            # boxes already have the prefix as id
+            prefix = interval.id if _interval_key(interval) in self.boxes else self.id_prefix(interval.id)
+            groups.setdefault((interval.charge, prefix), []).append(interval)
+
+        merged = 0
+        for (charge, prefix), intervals in groups.items():
+            intervals.sort(key=lambda interval: -math.inf if interval.min_mass is None else interval.min_mass)
+            runs = [[intervals[0]]]
+            box = intervals[0]
+            for interval in intervals[1:]:
+                if _is_mergeable(box, interval, self.max_growth):
+                    runs[-1].append(interval)
+                    box = replace(box, **{col: _bounding_value(col, [getattr(box, col), getattr(interval, col)])
+                                          for col in BOUND_COLUMNS})
+                else:
+                    runs.append([interval])
+                    box = interval
+
+            for run in runs:
+                if len(run) > 1:
+                    merged += len(run) - 1
+                    self._merge_run(prefix, charge, run)
+        return merged
+
+    def _merge_run(self, prefix: str, charge: Union[int, None], run: List[ExclusionInterval]):
+        members = []
+        for key in {_interval_key(interval) for interval in run}:  # duplicates are removed together
+            self.exclusion_list.remove(ExclusionInterval(*key))
+        for interval in run:
+            key = _interval_key(interval)
+            if key in self.boxes:
+                members.extend(self._pop_box(key)[1])
+            else:
+                members.append(interval)
+
+        box = ExclusionInterval(id=prefix, charge=charge, min_mass=None, max_mass=None, min_rt=None, max_rt=None,
+                                min_ook0=None, max_ook0=None, min_intensity=None, max_intensity=None)
+        for col in BOUND_COLUMNS:
+            setattr(box, col, _bounding_value(col, [getattr(interval, col) for interval in run]))
+
+        self.exclusion_list.add(box)
+        self._add_box(box, members)
+
+    def _box_keys(self, ex_interval: ExclusionInterval):
+        if ex_interval.id is None:
+            return list(self.boxes)
+        return list(self.member_of.get(ex_interval.id, ()))
+
+    @staticmethod
+    def _matches(interval: ExclusionInterval, ex_interval: ExclusionInterval) -> bool:
+        return (ex_interval.id is None or interval.id == ex_interval.id) and interval.is_enveloped_by(ex_interval)
+
+    def add(self, ex_interval: ExclusionInterval):
+        self.exclusion_list.add(ex_interval)
+
+    def bulk_add(self, intervals: List[ExclusionInterval]):
+        self.exclusion_list.bulk_add(intervals)
+
+    def remove(self, ex_interval: ExclusionInterval):
+        with self._lock:
+            return self._remove(ex_interval)
+
+    def _remove(self, ex_interval: ExclusionInterval) -> int:
+        removed = 0
+        for key in self._box_keys(ex_interval):
+            box, members = self.boxes[key], self.members[key]
+            if self._matches(box, ex_interval):
+                kept = []
+            else:
+                kept = [member for member in members if not self._matches(member, ex_interval)]
+                if len(kept) == len(members):
+                    continue
+            self._pop_box(key)
+            self.exclusion_list.remove(box)
+            for member in kept:
+                self.exclusion_list.add(member)
+            removed += len(members) - len(kept)
+
+        if self.exclusion_list.query_by_interval(ex_interval):
+            removed += self.exclusion_list.remove(ex_interval)
+        elif removed == 0:
+            _log.warning(f'No exclusion intervals matching: {ex_interval}')
+        return removed
+
+    def _members(self, ex_interval: ExclusionInterval) -> List[ExclusionInterval]:
+        if ex_interval.id is None:
+            return []
+        return [member for key in self._box_keys(ex_interval) for member in self.members[key]
+                if self._matches(member, ex_interval)]
+
+    def is_excluded(self, point: ExclusionPoint) -> bool:
+        return self.exclusion_list.is_excluded(point)
+
+    def _with_members(self, intervals: List[ExclusionInterval], members: List[ExclusionInterval]):
+        # an id which is both a member id and a box id (no prefix) reports its members instead of the boxes
+        if members:
+            intervals = [interval for interval in intervals if _interval_key(interval) not in self.boxes]
+        return intervals + members
+
+    def query_by_interval(self, ex_interval: ExclusionInterval) -> List[ExclusionInterval]:
+        with self._lock:
+            return self._with_members(self.exclusion_list.query_by_interval(ex_interval), self._members(ex_interval))
+
+    def query_by_point(self, point: ExclusionPoint) -> List[ExclusionInterval]:
+        return self.exclusion_list.query_by_point(point)
+
+    def query_by_id(self, id: Any) -> List[ExclusionInterval]:
+        with self._lock:
+            members = [member for key in self.member_of.get(id, ()) for member in self.members[key]
+                       if member.id == id]
+            return self._with_members(self.exclusion_list.query_by_id(id), members)
+
+    def deduplicate(self, intervals: List[ExclusionInterval]) -> List[ExclusionInterval]:
+        # the wrapped list holds the boxes and uncompacted intervals, the members are checked here
+        with self._lock:
+            new = self.exclusion_list.deduplicate(intervals)
+            member_keys = {_interval_key(member) for id in {interval.id for interval in new}
+                           for key in self.member_of.get(id, ()) for member in self.members[key] if member.id == id}
+        return [interval for interval in new if _interval_key(interval) not in member_keys]
+
+    def query_by_points(self, points: List[ExclusionPoint]) -> List[List[ExclusionInterval]]:
+        return self.exclusion_list.query_by_points(points)
+
+    def is_excluded_batch(self, points: List[ExclusionPoint]) -> List[bool]:
+        return self.exclusion_list.is_excluded_batch(points)
+
+    def _reset(self):
+        self.boxes = {}
+        self.members = {}
+        self.member_of = {}
+        self.member_count = 0
+
+    def save(self, file_path: str):
+        self.exclusion_list.save(file_path)
+
+    def save_columnar(self, file_path: str):
+        self.exclusion_list.save_columnar(file_path)
+
+    def snapshot_save(self, file_path: str, columnar: bool = False) -> Callable[[], None]:
+        return self.exclusion_list.snapshot_save(file_path, columnar)
+
+    def load(self, file_path: str) -> None:
+        with self._lock:
+            self.exclusion_list.load(file_path)
+            self._reset()
+
+    def clear(self) -> None:
+        with self._lock:
+            self.exclusion_list.clear()
+            self._reset()
+
+    def __len__(self):
+        return len(self.exclusion_list)
+
+    def __iter__(self) -> Iterator[ExclusionInterval]:
+        return iter(self.exclusion_list)
+
+    def iter_chunks(self, chunk_size: int) -> Iterator[List[ExclusionInterval]]:
+        return _locked_chunks(self._lock, self.exclusion_list.iter_chunks(chunk_size))
+
+    def stats(self):
+        return {**self.exclusion_list.stats(), 'boxes': len(self.boxes),
+                'members': self.member_count, 'merged': self.merged}
+
+
+class CompactionWorker(Thread):
+    """
+    Runs CompactingExclusionList.compact() every interval seconds
+    """
+
+    def __init__(self, exclusion_list: CompactingExclusionList, interval: float):
+        super().__init__(daemon=True)
+        self._exclusion_list = exclusion_list
+        self._interval = interval
+
+    def run(self):
+        while True:
+            time.sleep(self._interval)
+            try:
+                merged = self._exclusion_list.compact()
+                _log.debug(f'Compaction merged {merged} intervals')
+            except Exception as e:
+                _log.error(f'Error compacting exclusion list: {e}', exc_info=True)
+
+
+def _unbounded(ex_interval: ExclusionInterval) -> ExclusionInterval:
+    """
+    Copy of ex_interval with None bounds replaced by -inf/inf
+    """
+    return replace(ex_interval, **{col: (-math.inf if col.startswith('min') else math.inf)
+                                   for col in BOUND_COLUMNS if getattr(ex_interval, col) is None})
+
+
+def _is_removed_by(interval: ExclusionInterval, removal: ExclusionInterval) -> bool:
+    """
+    True if ExclusionList.remove(removal) removes interval
+    """
+    return (removal.id is None or interval.id == removal.id) and interval.is_enveloped_by(removal)
+
+
+class _PendingAdds:
+    """
+    The intervals added to a _Snapshot since its index was built, with their charge and bounds as columns (None as
+    NONE_CHARGE/NaN, like ColumnarExclusionList) so point checks are vectorized. Views are immutable, but share
+    append-only buffers: extending the newest view writes rows past the end of every other view, anything else
+    copies.
+    """
+
+    POINT_BLOCK = 1 << 20  # cells of the (points x rows) masks computed at once
+
+    def __init__(self, intervals: List[ExclusionInterval] = (), capacity: int = 64):
+        capacity = max(capacity, len(intervals))
+        self._intervals = list(intervals)
+        self._charge = np.full(capacity, NONE_CHARGE, dtype=np.int32)
+        self._bounds = {col: np.full(capacity, np.nan) for col in BOUND_COLUMNS}
+        self._written = [0]  # rows written to the shared buffers
+        self.size = 0
+        self._write(intervals)
+
+    def _write(self, intervals: List[ExclusionInterval]):
+        n = len(intervals)
+        rows = slice(self.size, self.size + n)
+        self._charge[rows] = [NONE_CHARGE if interval.charge is None else interval.charge for interval in intervals]
+        for col in BOUND_COLUMNS:
+            self._bounds[col][rows] = [getattr(interval, col) for interval in intervals]
+        self.size += n
+        self._written[0] = self.size
+
+    def extend(self, intervals: List[ExclusionInterval]) -> '_PendingAdds':
+        if self.size != self._written[0] or self.size + len(intervals) > len(self._charge):
+            return _PendingAdds(self.intervals() + list(intervals), capacity=2 * (self.size + len(intervals)))
+        view = copy(self)
+        view._intervals.extend(intervals)
+        view._write(intervals)
+        return view
+
+    def filtered(self, keep: Callable[[ExclusionInterval], bool]) -> '_PendingAdds':
+        intervals = self.intervals()
+        kept = [interval for interval in intervals if keep(interval)]
+        return self if len(kept) == len(intervals) else _PendingAdds(kept)
+
+    def intervals(self) -> List[ExclusionInterval]:
+        return self._intervals[:self.size]
+
+    def _bounded_masks(self, points: List[ExclusionPoint]) -> Iterator[np.ndarray]:
+        """
+        Vectorized ExclusionPoint.is_bounded_by of blocks of points against all rows, as (points, rows) masks
+        """
+        n = self.size
+        charge = self._charge[:n]
+        block = max(self.POINT_BLOCK // max(n, 1), 1)
+        for start in range(0, len(points), block):
+            group = points[start:start + block]
+            point_charge = np.array([NONE_CHARGE if point.charge is None else point.charge for point in group],
+                                    dtype=np.int32)[:, None]
+            mask = (point_charge == NONE_CHARGE) | (charge == NONE_CHARGE) | (charge == point_charge)
+            for attr, min_col, max_col in (('mass', 'min_mass', 'max_mass'), ('rt', 'min_rt', 'max_rt'),
+                                           ('ook0', 'min_ook0', 'max_ook0'),
+                                           ('intensity', 'min_intensity', 'max_intensity')):
+                # None values (NaN) and bounds (NaN) fail both comparisons, so they are unbounded
+                values = np.array([getattr(point, attr) for point in group], dtype=np.float64)[:, None]
+                mask &= ~((self._bounds[min_col][:n] > values) | (self._bounds[max_col][:n] <= values))
+            yield mask
+
+    def query_by_points(self, points: List[ExclusionPoint]) -> List[List[ExclusionInterval]]:
+        if not self.size:
+            return [[] for _ in points]
+        results = []
+        for mask in self._bounded_masks(points):
+            results.extend([self._intervals[row] for row in np.flatnonzero(row_mask).tolist()] for row_mask in mask)
+        return results
+
+    def is_excluded_batch(self, points: List[ExclusionPoint]) -> np.ndarray:
+        if not self.size:
+            return np.zeros(len(points), dtype=bool)
+        return np.concatenate([mask.any(axis=1) for mask in self._bounded_masks(points)] or [np.zeros(0, bool)])
+
+    def __len__(self):
+        return self.size
+
+
+@dataclass(frozen=True)
+class _Snapshot:
+    """
+    Immutable view of a SnapshotExclusionList: a query index which is never modified once published, plus the
+    operations applied since it was built. added holds the intervals added since (minus removed ones),
+    removed_keys the keys (see _interval_key) of the index intervals removed since, and removed their number.
+    Equal intervals are always removed together, so a key identifies removed index intervals.
+    """
+    index: ExclusionList
+    ops: Tuple = ()
+    added: _PendingAdds = field(default_factory=_PendingAdds)
+    removed_keys: FrozenSet[Tuple] = frozenset()
+    removed: int = 0
+
+    def is_live(self, interval: ExclusionInterval) -> bool:
+        return _interval_key(interval) not in self.removed_keys
+
+    def index_intervals(self, intervals: List[ExclusionInterval]) -> List[ExclusionInterval]:
+        if not self.removed_keys:
+            return intervals
+        return [interval for interval in intervals if self.is_live(interval)]
+
+
+class SnapshotExclusionList(ExclusionList):
+    """
+    Copy-on-write ExclusionList for concurrent readers and writers. Readers take the current _Snapshot (a single
+    attribute read) and query its immutable index plus the small delta of operations applied since the index was
+    built, without taking any lock. Writers serialize on a lock and publish a new _Snapshot with the extended delta.
+
+    merge() builds a fresh index (with index_factory) from the current snapshot outside of the writer lock, then
+    swaps it in atomically, replaying the operations which arrived during the build. It runs whenever the delta
+    (operations or added intervals) grows past max_delta, or periodically with SnapshotMergeWorker.
+    """
+
+    def __init__(self, index_factory: Callable[[], ExclusionList] = ColumnarExclusionList, max_delta: int = 1024):
+        self.index_factory = index_factory
+        self.max_delta = max_delta
+        self._snapshot = _Snapshot(index=index_factory())
+        self._write_lock = Lock()
+        self._merge_lock = Lock()
+        self.merges = 0
+
+    @property
+    def snapshot(self) -> _Snapshot:
+        return self._snapshot
+
+    def _build_index(self, intervals: List[ExclusionInterval]) -> ExclusionList:
+        index = self.index_factory()
+        index.bulk_add(intervals)
+        return index
+
+    @staticmethod
+    def _apply(snapshot: _Snapshot, op: Tuple[str, ExclusionInterval]) -> Tuple[_Snapshot, int]:
+        """
+        Returns the snapshot with op applied, and the number of intervals it removed
+        """
+        name, interval = op
+        if name == 'add':
+            return replace(snapshot, ops=snapshot.ops + (op,), added=snapshot.added.extend([interval])), 0
+        if name == 'bulk_add':
+            return replace(snapshot, ops=snapshot.ops + (op,), added=snapshot.added.extend(interval)), 0
+
+        interval = _unbounded(interval)
+        added = snapshot.added.filtered(lambda added: not _is_removed_by(added, interval))
+        removed = snapshot.index_intervals(snapshot.index.query_by_interval(interval))
+        removed_keys = snapshot.removed_keys.union(map(_interval_key, removed)) if removed else snapshot.removed_keys
+        return replace(snapshot, ops=snapshot.ops + (op,), added=added, removed_keys=removed_keys,
+                       removed=snapshot.removed + len(removed)), len(removed) + len(snapshot.added) - len(added)
+
+    def _write(self, op: Tuple[str, ExclusionInterval]) -> int:
+        with self._write_lock:
+            self._snapshot, removed = self._apply(self._snapshot, op)
+            delta = max(len(self._snapshot.ops), len(self._snapshot.added))
+
+        if delta > self.max_delta:
+            self.merge(blocking=False)
+        return removed
+
+    def merge(self, blocking: bool = True) -> bool:
+        """
+        Builds a new index from the current snapshot and swaps it in
+        :param blocking: wait for a merge which is already running, instead of returning False
+        :return: True if a merge ran
+        """
+        if not self._merge_lock.acquire(blocking=blocking):
+            return False
+        try:
+            base = self._snapshot
+            if not base.ops:
+                return False
+            self._swap_index(base, self._build_index(self._snapshot_intervals(base)))
+            self.merges += 1
+            return True
+        finally:
+            self._merge_lock.release()
+
+    def _swap_index(self, base: _Snapshot, index: ExclusionList):
+        """
+        Publishes index (built from base), replaying the operations which were applied since base
+        """
+        with self._write_lock:
+            snapshot = _Snapshot(index=index)
+            for op in self._snapshot.ops[len(base.ops):]:
+                snapshot, _ = self._apply(snapshot, op)
+            self._snapshot = snapshot
+
+    @staticmethod
+    def _snapshot_intervals(snapshot: _Snapshot) -> List[ExclusionInterval]:
+        return snapshot.index_intervals(list(snapshot.index)) + snapshot.added.intervals()
+
+    def add(self, ex_interval: ExclusionInterval):
+        if ex_interval.id is None:
+            raise Exception('Cannot add an interval with id = None')
+        self._write(('add', ex_interval))
+
+    def bulk_add(self, intervals: List[ExclusionInterval]):
+        """
+        Adds the intervals to the delta as one operation, the usual merge folds them into the index
+        """
+        if any(interval.id is None for interval in intervals):
+            raise Exception('Cannot add an interval with id = None')
+        if intervals:
+            self._write(('bulk_add', tuple(intervals)))
+
+    def remove(self, ex_interval: ExclusionInterval):
+        removed = self._write(('remove', ex_interval))
+        if removed == 0:
+            _log.warning(f'No exclusion intervals matching: {ex_interval}')
+        return removed
+
+    def is_excluded(self, point: ExclusionPoint) -> bool:
+        return self.is_excluded_batch([point])[0]
+
+    def query_by_interval(self, ex_interval: ExclusionInterval) -> List[ExclusionInterval]:
+        snapshot = self._snapshot
+        bounds = _unbounded(ex_interval)
+        return snapshot.index_intervals(snapshot.index.query_by_interval(ex_interval)) + \
+            [interval for interval in snapshot.added.intervals() if _is_removed_by(interval, bounds)]
+
+    def query_by_point(self, point: ExclusionPoint) -> List[ExclusionInterval]:
+        return self.query_by_points([point])[0]
+
+    def query_by_id(self, id: Any) -> List[ExclusionInterval]:
+        snapshot = self._snapshot
+        return snapshot.index_intervals(snapshot.index.query_by_id(id)) + \
+            [interval for interval in snapshot.added.intervals() if interval.id == id]
+
+    def query_by_points(self, points: List[ExclusionPoint]) -> List[List[ExclusionInterval]]:
+        snapshot = self._snapshot
+        return [snapshot.index_intervals(intervals) + added for intervals, added
+                in zip(snapshot.index.query_by_points(points), snapshot.added.query_by_points(points))]
+
+    def is_excluded_batch(self, points: List[ExclusionPoint]) -> List[bool]:
+        snapshot = self._snapshot
+        excluded = snapshot.added.is_excluded_batch(points)
+        rest = np.flatnonzero(~excluded).tolist()
+        index_excluded = snapshot.index.is_excluded_batch([points[i] for i in rest])
+        if snapshot.removed_keys:
+            # only the points excluded by the index can be excluded by removed intervals alone
+            rest = [i for i, hit in zip(rest, index_excluded) if hit]
+            index_excluded = [len(snapshot.index_intervals(intervals)) > 0
+                              for intervals in snapshot.index.query_by_points([points[i] for i in rest])]
+        excluded[rest] = index_excluded
+        return excluded.tolist()
+
+    def save(self, file_path: str):
+        """
+        Save the intervals of the current snapshot as a pickled list
+        """
+        _dump_intervals(self._snapshot_intervals(self._snapshot), file_path)
+
+    def load(self, file_path: str) -> None:
+        """
+        Loads a pickled list of intervals into a new index and swaps it in
+        """
+        index = self._build_index(_load_intervals(file_path))
+        with self._merge_lock, self._write_lock:
+            self._snapshot = _Snapshot(index=index)
+
+    def clear(self) -> None:
+        """
+        Clears all data
+        """
+        index = self.index_factory()
+        with self._merge_lock, self._write_lock:
+            self._snapshot = _Snapshot(index=index)
+
+    def __len__(self):
+        snapshot = self._snapshot
+        return len(snapshot.index) - snapshot.removed + len(snapshot.added)
+
+    def __iter__(self) -> Iterator[ExclusionInterval]:
+        yield from self._snapshot_intervals(self._snapshot)
+
+    def iter_chunks(self, chunk_size: int) -> Iterator[List[ExclusionInterval]]:
+        """
+        Chunks of one snapshot, whose index is never written, so no lock is needed
+        """
+        snapshot = self._snapshot
+        for chunk in snapshot.index.iter_chunks(chunk_size):
+            chunk = snapshot.index_intervals(chunk)
+            if chunk:
+                yield chunk
+        added = snapshot.added.intervals()
+        for start in range(0, len(added), chunk_size):
+            yield added[start:start + chunk_size]
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {**snapshot.index.stats(), 'len': len(self), 'delta_ops': len(snapshot.ops),
+                'merges': self.merges, 'snapshot_class': str(type(self))}
+
+
+class SnapshotMergeWorker(Thread):
+    """
+    Runs SnapshotExclusionList.merge() every interval seconds
+    """
+
+    def __init__(self, exclusion_list: SnapshotExclusionList, interval: float):
+        super().__init__(daemon=True)
+        self._exclusion_list = exclusion_list
+        self._interval = interval
+
+    def run(self):
+        while True:
+            time.sleep(self._interval)
+            try:
+                self._exclusion_list.merge()
+            except Exception as e:
+                _log.error(f'Error merging exclusion list snapshot: {e}', exc_info=True)
+
+
+def _replay_journal(exclusion_list: ExclusionList, file_path: str) -> int:
+    """
+    Applies the operations of a journal file to exclusion_list
+    :return: number of replayed operations
+    """
+    replayed = 0
+    adds = []
+    for op, interval in Journal.replay(file_path):
+        replayed += 1
+        if op == ADD:
+            adds.append(interval)
+            continue
+        if adds:  # consecutive adds are replayed in one bulk_add
+            exclusion_list.bulk_add(adds)
+            adds = []
+        if op == REMOVE:
+            exclusion_list.remove(interval)
+        elif op == CLEAR:
+            exclusion_list.clear()
+        else:
+            raise Exception(f'Unknown journal operation: {op}')
+    if adds:
+        exclusion_list.bulk_add(adds)
+    return replayed
+
+
+class JournaledExclusionList(ExclusionList):
+    """
+    Wraps an ExclusionList and records every add/remove/clear in an append-only Journal, so the list survives a
+    crash without full saves. Writes only append to the journal's buffer, JournalWorker fsyncs it in groups every
+    few milliseconds and periodically checkpoints.
+
+    journal_folder holds numbered pairs of files: snapshot_<n>.col (a column file) and journal_<n>.log (the
+    operations since that snapshot). checkpoint() switches to journal n + 1, saves snapshot n + 1 and then deletes
+    the older files, so a crash at any point leaves a snapshot followed by the journals of every later operation.
+    The constructor recovers the newest snapshot, replays the journals since and checkpoints.
+
+    Loading a file checkpoints as well, the journal does not reference other files.
+    """
+
+    _FILE_PATTERN = re.compile(r'^(snapshot|journal)_(\d+)\.(col|log)$')
+
+    def __init__(self, exclusion_list: ExclusionList, journal_folder: str):
+        self.exclusion_list = exclusion_list
+        self.journal_folder = journal_folder
+        self.sequence = 0
+        self.checkpoints = 0
+        self.replayed = 0
+        self.journal: Optional[Journal] = None
+        self._lock = Lock()  # keeps the journal in the order of the writes, and checkpoints consistent
+        self._checkpoint_lock = Lock()  # one checkpoint at a time
+        os.makedirs(journal_folder, exist_ok=True)
+        self.recover()
+
+    def _snapshot_path(self, sequence: int) -> str:
+        return os.path.join(self.journal_folder, f'snapshot_{sequence:08d}.col')
+
+    def _journal_path(self, sequence: int) -> str:
+        return os.path.join(self.journal_folder, f'journal_{sequence:08d}.log')
+
+    def _files(self) -> List[Tuple[str, int, str]]:
+        files = []
+        for file_name in os.listdir(self.journal_folder):
+            match = self._FILE_PATTERN.match(file_name)
+            if match:
+                files.append((match.group(1), int(match.group(2)), os.path.join(self.journal_folder, file_name)))
+        return files
+
+    def recover(self) -> int:
+        """
+        Loads the newest snapshot, replays the journals since and checkpoints
+        :return: number of replayed operations
+        """
+        with self._checkpoint_lock, self._lock:
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+            files = self._files()
+            self.sequence = max((sequence for kind, sequence, _ in files if kind == 'snapshot'), default=0)
+            if self.sequence > 0:
+                self.exclusion_list.load(self._snapshot_path(self.sequence))
+            else:
+                self.exclusion_list.clear()
+            self.replayed = 0
+            journals = sorted((sequence, path) for kind, sequence, path in files
+                              if kind == 'journal' and sequence >= self.sequence)
+            for _, journal_path in journals:
+                self.replayed += _replay_journal(self.exclusion_list, journal_path)
+            _log.info(f'Recovered {len(self.exclusion_list)} intervals from {self.journal_folder} '
+                      f'({self.replayed} journaled operations)')
+            self._checkpoint_now()
+        return self.replayed
+
+    def _rotate(self) -> int:
+        # with the lock held, later writes go to the journal of the next snapshot
+        if self.journal is not None:
+            self.journal.close()
+        self.sequence += 1
+        self.journal = Journal(self._journal_path(self.sequence))
+        return self.sequence
+
+    def _checkpointed(self, sequence: int):
+        self.checkpoints += 1
+        for _, file_sequence, file_path in self._files():
+            if file_sequence < sequence:
+                os.remove(file_path)
+
+    def _checkpoint_now(self):
+        # with both locks held, for states which no journal describes (recovery and loads)
+        self.exclusion_list.save_columnar(self._snapshot_path(self.sequence + 1))
+        self._checkpointed(self._rotate())
+
+    def checkpoint(self):
+        """
+        Saves a snapshot and truncates the journal (by starting a new one). Only copying the list and switching the
+        journal block writes, the snapshot is written afterwards. Until it is complete, recovery uses the previous
+        snapshot and replays both journals.
+        """
+        with self._checkpoint_lock:
+            with self._lock:
+                write = self.exclusion_list.snapshot_save(self._snapshot_path(self.sequence + 1), columnar=True)
+                sequence = self._rotate()
+            write()
+            self._checkpointed(sequence)
+
+    def sync(self):
+        """
+        Writes and fsyncs the buffered journal records
+        """
+        self.journal.sync()
+
+    def add(self, ex_interval: ExclusionInterval):
+        with self._lock:
+            self.exclusion_list.add(ex_interval)
+            self.journal.append(ADD, ex_interval)
+
+    def bulk_add(self, intervals: List[ExclusionInterval]):
+        with self._lock:
+            self.exclusion_list.bulk_add(intervals)
+            self.journal.extend(ADD, intervals)
+
+    def remove(self, ex_interval: ExclusionInterval):
+        with self._lock:
+            removed = self.exclusion_list.remove(ex_interval)
+            self.journal.append(REMOVE, ex_interval)
+        return removed
+
+    def is_excluded(self, point: ExclusionPoint) -> bool:
+        return self.exclusion_list.is_excluded(point)
+
+    def query_by_interval(self, ex_interval: ExclusionInterval) -> List[ExclusionInterval]:
+        return self.exclusion_list.query_by_interval(ex_interval)
+
+    def query_by_point(self, point: ExclusionPoint) -> List[ExclusionInterval]:
+        return self.exclusion_list.query_by_point(point)
+
+    def query_by_id(self, id: Any) -> List[ExclusionInterval]:
+        return self.exclusion_list.query_by_id(id)
+
+    def deduplicate(self, intervals: List[ExclusionInterval]) -> List[ExclusionInterval]:
+        return self.exclusion_list.deduplicate(intervals)
+
+    def query_by_points(self, points: List[ExclusionPoint]) -> List[List[ExclusionInterval]]:
+        return self.exclusion_list.query_by_points(points)
+
+    def is_excluded_batch(self, points: List[ExclusionPoint]) -> List[bool]:
+        return self.exclusion_list.is_excluded_batch(points)
+
+    def save(self, file_path: str):
+        self.exclusion_list.save(file_path)
+
+    def save_columnar(self, file_path: str):
+        self.exclusion_list.save_columnar(file_path)
+
+    def snapshot_save(self, file_path: str, columnar: bool = False) -> Callable[[], None]:
+        return self.exclusion_list.snapshot_save(file_path, columnar)
+
+    def load(self, file_path: str) -> None:
+        with self._checkpoint_lock, self._lock:
+            self.exclusion_list.load(file_path)
+            self._checkpoint_now()
+
+    def clear(self) -> None:
+        with self._lock:
+            self.exclusion_list.clear()
+            self.journal.append(CLEAR)
+
+    def close(self):
+        """
+        Syncs and closes the journal
+        """
+        with self._lock:
+            self.journal.close()
+
+    def __len__(self):
+        return len(self.exclusion_list)
+
+    def __iter__(self) -> Iterator[ExclusionInterval]:
+        return iter(self.exclusion_list)
+
+    def iter_chunks(self, chunk_size: int) -> Iterator[List[ExclusionInterval]]:
+        return _locked_chunks(self._lock, self.exclusion_list.iter_chunks(chunk_size))
+
+    def stats(self):
+        return {**self.exclusion_list.stats(), 'journal_sequence': self.sequence,
+                'journal_records': self.journal.records, 'journal_syncs': self.journal.syncs,
+                'checkpoints': self.checkpoints}
+
+
+class JournalWorker(Thread):
+    """
+    Runs JournaledExclusionList.sync() every sync_interval seconds (group commit), and checkpoint() every
+    checkpoint_interval seconds unless it is None
+    """
+
+    def __init__(self, exclusion_list: JournaledExclusionList, sync_interval: float,
+                 checkpoint_interval: Optional[float] = None):
+        super().__init__(daemon=True)
+        self._exclusion_list = exclusion_list
+        self._sync_interval = sync_interval
+        self._checkpoint_interval = checkpoint_interval
+
+    def run(self):
+        last_checkpoint = time.time()
+        while True:
+            time.sleep(self._sync_interval)
+            try:
+                self._exclusion_list.sync()
+                if self._checkpoint_interval is not None and \
+                        time.time() - last_checkpoint >= self._checkpoint_interval:
+                    self._exclusion_list.checkpoint()
+                    last_checkpoint = time.time()
+            except Exception as e:
+                _log.error(f'Error syncing exclusion list journal: {e}', exc_info=True)
+
+
+def delta_paths(file_path: str) -> List[str]:
+    """
+    The delta files (<file_path>.<n>.delta) of the chain saved at file_path, in order
+    """
+    folder, name = os.path.split(file_path)
+    pattern = re.compile(re.escape(name) + r'\.(\d+)\.delta$')
+    numbered = []
+    for file_name in os.listdir(folder or '.'):
+        match = pattern.match(file_name)
+        if match:
+            numbered.append((int(match.group(1)), os.path.join(folder, file_name)))
+    return [path for _, path in sorted(numbered)]
+
+
+class DeltaExclusionList(ExclusionList):
+    """
+    Wraps an ExclusionList and makes repeated saves to the same file incremental. The first save (or a load) of a
+    file makes it the base of a chain, later saves to that file only write the operations since the previous save
+    into a <file>.<n>.delta journal, and load() replays the deltas on top of the base. consolidate() rewrites the
+    base from the current list and deletes the deltas.
+
+    A save rewrites the base when the deltas would outgrow max_delta_ratio times the base file, or when the chain
+    was changed by someone else (another save, or deleted files), so loads never replay more than about
+    max_delta_ratio of the list.
+    """
+
+    _WRITING = (None, math.inf, None)  # chain state while its base is written, operations are kept meanwhile
+
+    def __init__(self, exclusion_list: ExclusionList, max_delta_ratio: Optional[float] = 0.5):
+        self.exclusion_list = exclusion_list
+        self.max_delta_ratio = max_delta_ratio
+        self.chain_path: Optional[str] = None
+        self.chain_columnar = False
+        self.deltas = 0
+        self.consolidations = 0
+        self._chain_state = None
+        self._pending = bytearray()  # encoded operations since the last save
+        self._lock = Lock()
+
+    def _file_state(self, file_path: str) -> Tuple:
+        stat = os.stat(file_path)
+        return stat.st_mtime_ns, stat.st_size, len(delta_paths(file_path))
+
+    def _attach(self, file_path: str, columnar: bool, state: Optional[Tuple]):
+        self.chain_path = file_path
+        self.chain_columnar = columnar
+        self._chain_state = state
+        self._pending = bytearray()
+
+    def _written(self, file_path: str):
+        # the chain state is only known once a writer is done, unless the chain was dropped meanwhile
+        with self._lock:
+            if file_path == self.chain_path and self._chain_state is not None:
+                self._chain_state = self._file_state(file_path)
+
+    def _is_chain(self, file_path: str, columnar: bool) -> bool:
+        return self._chain_state is not None and file_path == self.chain_path and columnar == self.chain_columnar \
+            and os.path.exists(file_path) and self._file_state(file_path) == self._chain_state
+
+    def _fits_delta(self, file_path: str) -> bool:
+        delta_bytes = sum(os.path.getsize(path) for path in delta_paths(file_path)) + len(self._pending)
+        return self.max_delta_ratio is None or delta_bytes <= self.max_delta_ratio * os.path.getsize(file_path)
+
+    def _delta_writer(self, file_path: str) -> Callable[[], None]:
+        records, self._pending = bytes(self._pending), bytearray()
+        if not records:
+            return lambda: None
+        self.deltas += 1
+        delta_path = f'{file_path}.{self.deltas:06d}.delta'
+
+        def write():
+            Journal.write(delta_path, records)
+            self._written(file_path)
+        return write
+
+    def _base_writer(self, file_path: str, columnar: bool) -> Callable[[], None]:
+        write_base = self.exclusion_list.snapshot_save(file_path, columnar)
+        self._attach(file_path, columnar, self._WRITING)
+        self.deltas = 0
+
+        def write():
+            # stale deltas are deleted first, a crash before the new base replaced it leaves the older base intact
+            for path in delta_paths(file_path):
+                os.remove(path)
+            write_base()
+            self.consolidations += 1
+            self._written(file_path)
+        return write
+
+    def snapshot_save(self, file_path: str, columnar: bool = False) -> Callable[[], None]:
+        """
+        The returned writers of one list must run in the order they were taken
+        """
+        with self._lock:
+            if self._is_chain(file_path, columnar) and self._fits_delta(file_path):
+                return self._delta_writer(file_path)
+            return self._base_writer(file_path, columnar)
+
+    def consolidate(self):
+        """
+        Rewrites the base of the current chain and deletes its deltas
+        """
+        if self.chain_path is None:
+            raise Exception('No saved or loaded file to consolidate')
+        with self._lock:
+            write = self._base_writer(self.chain_path, self.chain_columnar)
+        write()
+
+    @staticmethod
+    def consolidate_file(file_path: str, exclusion_list: ExclusionList):
+        """
+        Consolidates the chain saved at file_path, using exclusion_list (which is cleared) to load it
+        """
+        if not delta_paths(file_path):
+            return
+        delta_list = DeltaExclusionList(exclusion_list)
+        delta_list.load(file_path)
+        delta_list.consolidate()
+
+    def _record(self, op: bytes, intervals: List[Optional[ExclusionInterval]]):
+        # operations are only kept while a chain is attached, and only until they outgrow the base
+        if self._chain_state is None:
+            return
+        self._pending += b''.join(encode_record(op, interval) for interval in intervals)
+        if self.max_delta_ratio is not None and len(self._pending) > self.max_delta_ratio * self._chain_state[1]:
+            self._chain_state = None
+            self._pending = bytearray()
+
+    def add(self, ex_interval: ExclusionInterval):
+        with self._lock:
+            self.exclusion_list.add(ex_interval)
+            self._record(ADD, [ex_interval])
+
+    def bulk_add(self, intervals: List[ExclusionInterval]):
+        with self._lock:
+            self.exclusion_list.bulk_add(intervals)
+            self._record(ADD, intervals)
+
+    def remove(self, ex_interval: ExclusionInterval):
+        with self._lock:
+            removed = self.exclusion_list.remove(ex_interval)
+            self._record(REMOVE, [ex_interval])
+        return removed
+
+    def is_excluded(self, point: ExclusionPoint) -> bool:
+        return self.exclusion_list.is_excluded(point)
+
+    def query_by_interval(self, ex_interval: ExclusionInterval) -> List[ExclusionInterval]:
+        return self.exclusion_list.query_by_interval(ex_interval)
+
+    def query_by_point(self, point: ExclusionPoint) -> List[ExclusionInterval]:
+        return self.exclusion_list.query_by_point(point)
+
+    def query_by_id(self, id: Any) -> List[ExclusionInterval]:
+        return self.exclusion_list.query_by_id(id)
+
+    def deduplicate(self, intervals: List[ExclusionInterval]) -> List[ExclusionInterval]:
+        return self.exclusion_list.deduplicate(intervals)
+
+    def query_by_points(self, points: List[ExclusionPoint]) -> List[List[ExclusionInterval]]:
+        return self.exclusion_list.query_by_points(points)
+
+    def is_excluded_batch(self, points: List[ExclusionPoint]) -> List[bool]:
+        return self.exclusion_list.is_excluded_batch(points)
+
+    def save(self, file_path: str):
+        self.snapshot_save(file_path)()
+
+    def save_columnar(self, file_path: str):
+        self.snapshot_save(file_path, columnar=True)()
+
+    def load(self, file_path: str) -> None:
+        """
+        Loads the base saved at file_path and replays its deltas
+        """
+        with self._lock:
+            self.exclusion_list.load(file_path)
+            paths = delta_paths(file_path)
+            for path in paths:
+                _replay_journal(self.exclusion_list, path)
+            self._attach(file_path, is_column_file(file_path), self._file_state(file_path))
+            self.deltas = len(paths)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.exclusion_list.clear()
+            self._record(CLEAR, [None])
+
+    def __len__(self):
+        return len(self.exclusion_list)
+
+    def __iter__(self) -> Iterator[ExclusionInterval]:
+        return iter(self.exclusion_list)
+
+    def iter_chunks(self, chunk_size: int) -> Iterator[List[ExclusionInterval]]:
+        return _locked_chunks(self._lock, self.exclusion_list.iter_chunks(chunk_size))
+
+    def stats(self):
+        return {**self.exclusion_list.stats(), 'delta_chain': self.chain_path, 'deltas': self.deltas,
+                'pending_delta_bytes': len(self._pending), 'consolidations': self.consolidations}
+
+
+def load_saved_intervals(file_path: str) -> List[ExclusionInterval]:
+    """
+    The intervals saved at file_path, including the changes of its delta files (see DeltaExclusionList)
+    """
+    paths = delta_paths(file_path)
+    if not paths:
+        return _load_intervals(file_path)
+    exclusion_list = ChargePartitionedExclusionList(ColumnarExclusionList)
+    exclusion_list.bulk_add(_load_intervals(file_path))
+    for path in paths:
+        _replay_journal(exclusion_list, path)
+    return list(exclusion_list)
+
+
+class SavedListCache:
+    """
+    Opens saved lists for queries without loading them into the active list. Column files are mapped read only (see
+    ColumnarExclusionList.read_only), pickles and delta chains are loaded into a ColumnarExclusionList. The
+    max_size most recently used lists stay open, a list is reopened once its file or delta files change.
+
+    Lookups only stat the file and its folder (adding or removing a delta file changes the folder's mtime), the
+    delta files are only listed once the folder changed. Lists are opened outside of the lock.
+    """
+
+    def __init__(self, max_size: int = 8):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lists: OrderedDict = OrderedDict()  # file path -> (quick state, file state, exclusion list)
+        self._lock = Lock()
+
+    @staticmethod
+    def _quick_state(file_path: str) -> Optional[Tuple]:
+        """
+        Stat of the file and its folder, None while the folder changed too recently for its (coarse) mtime to show
+        the next change
+        """
+        stat, folder_stat = os.stat(file_path), os.stat(os.path.dirname(file_path) or '.')
+        if time.time_ns() - folder_stat.st_mtime_ns < 1_000_000_000:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size, folder_stat.st_mtime_ns
+
+    @staticmethod
+    def _file_state(file_path: str) -> Tuple:
+        stat = os.stat(file_path)
+        return stat.st_mtime_ns, stat.st_size, tuple(delta_paths(file_path))
+
+    @staticmethod
+    def _open(file_path: str) -> ExclusionList:
+        if is_column_file(file_path) and not delta_paths(file_path):
+            return ColumnarExclusionList.read_only(file_path)
+        return ColumnarExclusionList.from_intervals(load_saved_intervals(file_path))
+
+    def cached(self, file_path: str) -> Optional[ExclusionList]:
+        """
+        The open list of file_path, None if it is not open or has changed since
+        """
+        with self._lock:
+            entry = self._lists.get(file_path)
+            if entry is None:
+                return None
+            _, state, exclusion_list = entry
+            quick_state = self._quick_state(file_path)
+            if quick_state is None or quick_state != entry[0]:
+                # the folder also changes with other files, the list is only stale if its own files changed
+                if self._file_state(file_path) != state:
+                    return None
+                self._lists[file_path] = (quick_state, state, exclusion_list)
+            self._lists.move_to_end(file_path)
+            self.hits += 1
+            return exclusion_list
+
+    def get(self, file_path: str) -> ExclusionList:
+        """
+        The open list of file_path, opened (which can take long for pickles) if it is not open or has changed
+        """
+        exclusion_list = self.cached(file_path)
+        if exclusion_list is not None:
+            return exclusion_list
+
+        # taken before opening, so a change during the open reopens the list on the next lookup
+        quick_state, state = self._quick_state(file_path), self._file_state(file_path)
+        exclusion_list = self._open(file_path)
+        with self._lock:
+            self.misses += 1
+            self._lists[file_path] = (quick_state, state, exclusion_list)
+            self._lists.move_to_end(file_path)
+            if len(self._lists) > self.max_size:
+                self._lists.popitem(last=False)
+        return exclusion_list
+
+    def clear(self):
+        with self._lock:
+            self._lists.clear()
 
     def stats(self):
-        return {'len':len(self), 'id_table_len': len(self.id_dict), 'class':str(type(self))}
\ No newline at end of file
+        return {'open_lists': list(self._lists), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,145 @@
+import csv
+import io
+import json
+import lzma
+import zlib
+from typing import Any, Iterable, Iterator, List, Tuple, Union
+
+import numpy as np
+
+from .columnfile import BOUND_COLUMNS
+from .components import ExclusionInterval, ExclusionPoint
+
+EXPORT_COLUMNS = ('id', 'charge') + BOUND_COLUMNS
+POINT_COLUMNS = ('charge', 'mass', 'rt', 'ook0', 'intensity')
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+COMPRESSIONS = {'none': ('', None), 'gzip': ('.gz', 'application/gzip'), 'lzma': ('.xz', 'application/x-xz')}
+
+
+def _chunked(intervals: Iterable[ExclusionInterval], chunk_size: int) -> Iterator[list]:
+    chunk = []
+    for interval in intervals:
+        chunk.append(interval)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_ndjson(intervals: Iterable[ExclusionInterval], chunk_size: int = 1024) -> Iterator[bytes]:
+    """
+    Yields one json object per interval and line, chunk_size intervals at a time
+    """
+    for chunk in _chunked(intervals, chunk_size):
+        yield ''.join(json.dumps({col: getattr(interval, col) for col in EXPORT_COLUMNS}) + '\n'
+                      for interval in chunk).encode('utf-8')
+
+
+def iter_csv(intervals: Iterable[ExclusionInterval], chunk_size: int = 1024) -> Iterator[bytes]:
+    """
+    Yields a header line followed by one line per interval (None is an empty field), chunk_size intervals at a time
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(EXPORT_COLUMNS)
+    for chunk in _chunked(intervals, chunk_size):
+        writer.writerows([getattr(interval, col) for col in EXPORT_COLUMNS] for interval in chunk)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():  # header of an empty export
+        yield buffer.getvalue().encode('utf-8')
+
+
+def _is_column_value(col: str, value: Any) -> bool:
+    # None, or a string id, an integer charge or a numeric bound (json booleans are not numbers)
+    if value is None:
+        return True
+    if col == 'id':
+        return isinstance(value, str)
+    if isinstance(value, bool):
+        return False
+    return isinstance(value, int) if col == 'charge' else isinstance(value, (int, float))
+
+
+def _read_columns(data: dict, columns: Tuple[str, ...]) -> List[list]:
+    """
+    The equally long column arrays of data in the order of columns, missing columns are None. Raises an Exception
+    for unknown columns and values of the wrong type.
+    """
+    unknown = set(data) - set(columns)
+    if unknown:
+        raise Exception(f'Unknown columns: {sorted(unknown)}')
+    for col, values in data.items():
+        if not isinstance(values, list):
+            raise Exception(f'Column {col} is not an array')
+        invalid = [value for value in values if not _is_column_value(col, value)]
+        if invalid:
+            raise Exception(f'Column {col} holds invalid values, e.g. {invalid[0]!r}')
+    lengths = {len(values) for values in data.values()}
+    if len(lengths) > 1:
+        raise Exception('Columns are not the same length')
+    n = lengths.pop() if lengths else 0
+    return [data.get(col, [None] * n) for col in columns]
+
+
+def parse_intervals(data: Union[list, dict]) -> List[ExclusionInterval]:
+    """
+    Intervals from decoded json, either a list of objects (as exported by iter_ndjson) or an object of equally long
+    column arrays. Missing keys are None.
+    """
+    if isinstance(data, list):
+        if not all(isinstance(item, dict) for item in data):
+            raise Exception('Expected a list of interval objects')
+        data = {col: [item.get(col) for item in data] for col in EXPORT_COLUMNS}
+
+    if not isinstance(data, dict):
+        raise Exception('Expected a list of intervals or an object of columns')
+    return [ExclusionInterval(*values) for values in zip(*_read_columns(data, EXPORT_COLUMNS))]
+
+
+def parse_points(data: dict) -> List[ExclusionPoint]:
+    """
+    Points from decoded json, an object of equally long charge, mass, rt, ook0 and intensity arrays. Missing keys are
+    None.
+    """
+    if not isinstance(data, dict):
+        raise Exception('Expected an object of columns')
+    return [ExclusionPoint(*values) for values in zip(*_read_columns(data, POINT_COLUMNS))]
+
+
+def pack_flags(flags: List[bool]) -> bytes:
+    """
+    One bit per flag, least significant bit first (flag i is bit i % 8 of byte i // 8)
+    """
+    return np.packbits(np.asarray(flags, dtype=bool), bitorder='little').tobytes()
+
+
+def unpack_flags(packed: bytes, n: int) -> List[bool]:
+    """
+    The first n flags of pack_flags
+    """
+    if len(packed) < (n + 7) // 8:
+        raise Exception(f'{len(packed)} bytes hold less than {n} flags')
+    return np.unpackbits(np.frombuffer(packed, dtype=np.uint8), count=n, bitorder='little').astype(bool).tolist()
+
+
+def iter_compressed(chunks: Iterable[bytes], compression: str) -> Iterator[bytes]:
+    """
+    Compresses a stream of chunks with gzip or lzma (xz), or passes it through for 'none'
+    """
+    if compression == 'none':
+        yield from chunks
+        return
+    if compression == 'gzip':
+        compressor = zlib.compressobj(wbits=31)  # 31: gzip header and trailer
+    elif compression == 'lzma':
+        compressor = lzma.LZMACompressor()
+    else:
+        raise Exception(f'Unknown compression: {compression}')
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,99 @@
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Any, Callable, Dict, Optional
+
+_log = logging.getLogger(__name__)
+
+
+@dataclass
+class SaveJob:
+    """
+    A file write submitted to a SaveQueue. status is one of pending, running, done or failed.
+    """
+
+    id: str
+    file_path: str
+    status: str = 'pending'
+    error: Optional[str] = None
+    submitted: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    future: Optional[Future] = field(default=None, repr=False)
+
+    def stats(self):
+        return {'job_id': self.id, 'file_path': self.file_path, 'status': self.status, 'error': self.error,
+                'submitted': self.submitted, 'started': self.started, 'finished': self.finished}
+
+
+class SaveQueue:
+    """
+    Runs writers (see ExclusionList.snapshot_save) one at a time in a worker thread, in the order they were
+    submitted, which the delta saves of DeltaExclusionList rely on. The last max_jobs jobs are kept for status
+    queries.
+
+    Readers of saved files (submit_read) run in a separate pool of max_readers threads. A read only waits for the
+    writes of its own file which were submitted before it, not for the whole queue.
+    """
+
+    def __init__(self, max_jobs: int = 100, max_readers: int = 4):
+        self.max_jobs = max_jobs
+        self.jobs: OrderedDict[str, SaveJob] = OrderedDict()
+        self._lock = Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='save')
+        self._readers = ThreadPoolExecutor(max_workers=max_readers, thread_name_prefix='read')
+        self._last_writes: Dict[str, Future] = {}  # file path -> future of its last pending write
+
+    def _forget(self, file_path: str, future: Future):
+        with self._lock:
+            if self._last_writes.get(file_path) is future:
+                del self._last_writes[file_path]
+
+    def _run(self, job: SaveJob, write: Callable[[], Any]):
+        job.status, job.started = 'running', time.time()
+        try:
+            result = write()
+        except Exception as e:
+            job.status, job.error = 'failed', str(e)
+            _log.error(f'Error writing {job.file_path}: {e}', exc_info=True)
+            raise
+        finally:
+            job.finished = time.time()
+        job.status = 'done'
+        return result
+
+    def submit(self, file_path: str, write: Callable[[], Any]) -> SaveJob:
+        """
+        Queues write, job.future resolves to its result
+        """
+        job = SaveJob(id=uuid.uuid4().hex, file_path=file_path)
+        with self._lock:
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.max_jobs:
+                self.jobs.popitem(last=False)
+            job.future = self._executor.submit(self._run, job, write)
+            self._last_writes[file_path] = job.future
+        job.future.add_done_callback(lambda future: self._forget(file_path, future))
+        return job
+
+    @staticmethod
+    def _read_after(write: Optional[Future], read: Callable[[], Any]):
+        if write is not None:
+            wait([write])  # a failed write leaves the previous file, which can still be read
+        return read()
+
+    def submit_read(self, file_path: str, read: Callable[[], Any]) -> Future:
+        """
+        Runs read in the reader pool once the writes of file_path submitted so far are done, the future resolves to
+        its result
+        """
+        with self._lock:
+            write = self._last_writes.get(file_path)
+        return self._readers.submit(self._read_after, write, read)
+
+    def get(self, job_id: str) -> Optional[SaveJob]:
+        return self.jobs.get(job_id)
@@ -0,0 +1,119 @@
+import logging
+import math
+import os
+import struct
+import zlib
+from threading import Lock
+from typing import Iterator, List, Optional, Tuple
+
+from .columnfile import BOUND_COLUMNS, NONE_CHARGE
+from .components import ExclusionInterval
+
+_log = logging.getLogger(__name__)
+
+ADD = b'A'
+REMOVE = b'R'
+CLEAR = b'C'
+
+_RECORD_HEADER = struct.Struct('<II')  # payload length, crc32 of the payload
+_INTERVAL = struct.Struct('<ci8dH')  # op, charge, bounds, id length (NONE_ID for None), followed by the utf-8 id
+NONE_ID = 0xFFFF
+
+
+def encode_record(op: bytes, interval: Optional[ExclusionInterval] = None) -> bytes:
+    if interval is None:
+        payload = op
+    else:
+        id = None if interval.id is None else str(interval.id).encode('utf-8')
+        bounds = [math.nan if value is None else value for value in (getattr(interval, col) for col in BOUND_COLUMNS)]
+        payload = _INTERVAL.pack(op, NONE_CHARGE if interval.charge is None else interval.charge, *bounds,
+                                 NONE_ID if id is None else len(id)) + (id or b'')
+    return _RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _decode(payload: bytes) -> Tuple[bytes, Optional[ExclusionInterval]]:
+    if len(payload) == 1:
+        return payload, None
+    op, charge, *bounds, id_length = _INTERVAL.unpack_from(payload)
+    id = None if id_length == NONE_ID else payload[_INTERVAL.size:_INTERVAL.size + id_length].decode('utf-8')
+    bounds = [None if value != value else value for value in bounds]  # NaN -> None
+    return op, ExclusionInterval(id, None if charge == NONE_CHARGE else charge, *bounds)
+
+
+class Journal:
+    """
+    Append-only log of ExclusionList operations (add, remove and clear). Every record is length prefixed and
+    checksummed, so replay() stops at a torn record left by a crash.
+
+    append() only encodes the record into an in memory buffer. sync() writes the buffered records and fsyncs them
+    (group commit), a worker calls it every few milliseconds, which bounds the operations a crash can lose.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self._file = open(file_path, 'ab')
+        self._buffer = bytearray()
+        self._lock = Lock()  # guards the buffer
+        self._sync_lock = Lock()  # orders the writes of concurrent syncs
+        self.records = 0
+        self.syncs = 0
+
+    def append(self, op: bytes, interval: Optional[ExclusionInterval] = None):
+        record = encode_record(op, interval)
+        with self._lock:
+            self._buffer += record
+            self.records += 1
+
+    def extend(self, op: bytes, intervals: List[ExclusionInterval]):
+        records = b''.join(encode_record(op, interval) for interval in intervals)
+        with self._lock:
+            self._buffer += records
+            self.records += len(intervals)
+
+    def sync(self):
+        with self._sync_lock:
+            with self._lock:
+                data, self._buffer = bytes(self._buffer), bytearray()
+            if not data:
+                return
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.syncs += 1
+
+    def close(self):
+        self.sync()
+        self._file.close()
+
+    @staticmethod
+    def replay(file_path: str) -> Iterator[Tuple[bytes, Optional[ExclusionInterval]]]:
+        """
+        Yields the (op, interval) records of a journal file, up to the first incomplete or corrupt record
+        """
+        with open(file_path, 'rb') as file:
+            data = file.read()
+
+        position = 0
+        while position + _RECORD_HEADER.size <= len(data):
+            length, crc = _RECORD_HEADER.unpack_from(data, position)
+            payload = data[position + _RECORD_HEADER.size:position + _RECORD_HEADER.size + length]
+            if len(payload) != length or zlib.crc32(payload) != crc:
+                break
+            yield _decode(payload)
+            position += _RECORD_HEADER.size + length
+
+        if position != len(data):
+            _log.warning(f'Ignoring {len(data) - position} bytes of incomplete records at the end of {file_path}')
+
+    @staticmethod
+    def write(file_path: str, records: bytes):
+        """
+        Writes encoded records (see encode_record) as a complete journal file, through a temporary file which then
+        replaces file_path
+        """
+        tmp_path = file_path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(records)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, file_path)
@@ -0,0 +1,93 @@
+import math
+from dataclasses import dataclass, field
+from typing import Dict, Tuple, Union
+
+from .components import ExclusionInterval, ExclusionPoint
+
+
+@dataclass
+class OccupancyGrid:
+    """
+    Coarse counting grid over (charge, mass bin, rt bin). Every interval increments the cells it overlaps, so a
+    point whose cell is empty cannot be excluded. Intervals which would cover more than max_cells cells (for example
+    intervals with unbounded mass or rt) are only counted per charge in overflow, and disable the grid for that charge.
+
+    may_contain() can return false positives, but never false negatives.
+    """
+
+    mass_bin_width: float = 1.0
+    rt_bin_width: float = 60.0
+    max_cells: int = 4096
+    cells: Dict[Tuple[Union[int, None], int, int], int] = field(default_factory=lambda: dict())
+    overflow: Dict[Union[int, None], int] = field(default_factory=lambda: dict())
+    charges: Dict[Union[int, None], int] = field(default_factory=lambda: dict())
+
+    def _bin_range(self, low: Union[float, None], high: Union[float, None], width: float) -> Union[range, None]:
+        if low is None or high is None or not (math.isfinite(low / width) and math.isfinite(high / width)):
+            return None
+        return range(math.floor(low / width), math.floor(high / width) + 1)
+
+    def _interval_cells(self, interval: ExclusionInterval):
+        """
+        Returns the cells overlapped by the interval, or None if the interval is too wide to grid
+        """
+        mass_bins = self._bin_range(interval.min_mass, interval.max_mass, self.mass_bin_width)
+        rt_bins = self._bin_range(interval.min_rt, interval.max_rt, self.rt_bin_width)
+        # range lengths past sys.maxsize (convert_none bounds) make len() raise, so they are computed from the ends
+        if mass_bins is None or rt_bins is None or \
+                (mass_bins.stop - mass_bins.start) * (rt_bins.stop - rt_bins.start) > self.max_cells:
+            return None
+        return [(interval.charge, mass_bin, rt_bin) for mass_bin in mass_bins for rt_bin in rt_bins]
+
+    @staticmethod
+    def _increment(counts: dict, key, value: int):
+        count = counts.get(key, 0) + value
+        if count <= 0:
+            counts.pop(key, None)
+        else:
+            counts[key] = count
+
+    def _update(self, interval: ExclusionInterval, value: int):
+        self._increment(self.charges, interval.charge, value)
+        cells = self._interval_cells(interval)
+        if cells is None:
+            self._increment(self.overflow, interval.charge, value)
+            return
+        for cell in cells:
+            self._increment(self.cells, cell, value)
+
+    def add(self, interval: ExclusionInterval):
+        self._update(interval, 1)
+
+    def remove(self, interval: ExclusionInterval):
+        self._update(interval, -1)
+
+    def clear(self):
+        self.cells = {}
+        self.overflow = {}
+        self.charges = {}
+
+    def may_contain(self, point: ExclusionPoint) -> bool:
+        """
+        False if no interval can bound the point
+        """
+        if point.charge is None:
+            charges = list(self.charges)
+        else:
+            charges = [charge for charge in (point.charge, None) if charge in self.charges]
+
+        if not charges:
+            return False
+
+        if any(charge in self.overflow for charge in charges):
+            return True
+
+        if point.mass is None or point.rt is None:
+            return True
+
+        mass_bin = math.floor(point.mass / self.mass_bin_width)
+        rt_bin = math.floor(point.rt / self.rt_bin_width)
+        return any((charge, mass_bin, rt_bin) in self.cells for charge in charges)
+
+    def stats(self):
+        return {'cells': len(self.cells), 'overflow': sum(self.overflow.values())}
@@ -7,18 +7,36 @@ def make_clear_query(exclusion_api_ip: str):
     return f'{exclusion_api_ip}/exclusionms'
 
 
-def make_save_query(exclusion_api_ip: str, exid: str):
-    return f'{exclusion_api_ip}/exclusionms?save=True&exclusion_list_name={exid}'
+def make_save_query(exclusion_api_ip: str, exid: str, binary: bool = False, background: bool = False):
+    return f'{exclusion_api_ip}/exclusionms?save=True&exclusion_list_name={exid}&binary={binary}' \
+           f'&background={background}'
 
 
-def make_load_query(exclusion_api_ip: str, exid: str):
-    return f'{exclusion_api_ip}/exclusionms?save=False&exclusion_list_name={exid}'
+def make_save_job_query(exclusion_api_ip: str, job_id: str):
+    return f'{exclusion_api_ip}/exclusionms/job?job_id={job_id}'
+
+
+def make_load_query(exclusion_api_ip: str, exid: str, binary: bool = False):
+    return f'{exclusion_api_ip}/exclusionms?save=False&exclusion_list_name={exid}&binary={binary}'
+
+
+def make_merge_query(exclusion_api_ip: str, exids: List[str], binary: bool = False):
+    names = '&'.join(f'exclusion_list_name={exid}' for exid in exids)
+    return f'{exclusion_api_ip}/exclusionms/merge?{names}&binary={binary}'
+
+
+def make_upload_query(exclusion_api_ip: str, exid: str, binary: bool = False, load: bool = False):
+    return f'{exclusion_api_ip}/exclusionms/file?exclusion_list_name={exid}&binary={binary}&load={load}'
 
 
 def make_stats_query(exclusion_api_ip: str):
     return f'{exclusion_api_ip}/exclusionms'
 
 
+def make_advance_rt_query(exclusion_api_ip: str, rt: float):
+    return f'{exclusion_api_ip}/exclusionms/rt?rt={rt}'
+
+
 def make_exclusion_interval_query(exclusion_api_ip: str, exclusion_interval: ExclusionInterval) -> str:
     interval_query = ''
     if exclusion_interval.id:
@@ -50,16 +68,36 @@ def make_exclusion_interval_query(exclusion_api_ip: str, exclusion_interval: Exc
     return add_interval_api_str
 
 
-def make_exclusion_points_query(exclusion_api_ip: str, exclusion_points: List[ExclusionPoint]):
+def make_exclusion_intervals_query(exclusion_api_ip: str):
+    return f'{exclusion_api_ip}/exclusionms/intervals'
+
+
+def make_exclusion_points_query(exclusion_api_ip: str, exclusion_points: List[ExclusionPoint], exids: List[str] = (),
+                                binary: bool = False):
     charges_sub_query = ''.join([f'&charge={point.charge}' for point in exclusion_points])
     masses_sub_query = ''.join([f'&mass={point.mass}' for point in exclusion_points])
     rts_sub_query = ''.join([f'&rt={point.rt}' for point in exclusion_points])
     ook0s_sub_query = ''.join([f'&ook0={point.ook0}' for point in exclusion_points])
     intensities_sub_query = ''.join([f'&intensity={point.intensity}' for point in exclusion_points])
 
+    saved_lists_sub_query = ''.join([f'&exclusion_list_name={exid}' for exid in exids])
+    if exids:
+        saved_lists_sub_query += f'&binary={binary}'
+
     exclusion_points_query = charges_sub_query + masses_sub_query + rts_sub_query + ook0s_sub_query + intensities_sub_query
+    exclusion_points_query += saved_lists_sub_query
     exclusion_points_query = '?' + exclusion_points_query[1:]
 
     query_points_api_str = f'{exclusion_api_ip}/exclusionms/points{exclusion_points_query}'
 
     return query_points_api_str
+
+
+def make_exclusion_points_post_query(exclusion_api_ip: str, exids: List[str] = (), binary: bool = False):
+    saved_lists_query = ''.join([f'&exclusion_list_name={exid}' for exid in exids])
+    return f'{exclusion_api_ip}/exclusionms/points?binary={binary}{saved_lists_query}'
+
+
+def make_exclusion_points_binary_query(exclusion_api_ip: str, exids: List[str] = (), binary: bool = False):
+    saved_lists_query = ''.join([f'&exclusion_list_name={exid}' for exid in exids])
+    return f'{exclusion_api_ip}/exclusionms/points/binary?binary={binary}{saved_lists_query}'
@@ -0,0 +1,178 @@
+import math
+import sys
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Union
+
+import numpy as np
+
+from .columnfile import NONE_CHARGE
+from .components import ExclusionInterval, default_id_prefix
+
+WIDTH_BOUNDS = {'mass': ('min_mass', 'max_mass'), 'rt': ('min_rt', 'max_rt'), 'ook0': ('min_ook0', 'max_ook0'),
+                'intensity': ('min_intensity', 'max_intensity')}
+
+
+def _is_bounded(low: Union[float, None], high: Union[float, None]) -> bool:
+    """
+    False for None bounds and the float max placeholders of ExclusionInterval.convert_none (and the R-Tree)
+    """
+    return low is not None and high is not None and -sys.float_info.max < low and high < sys.float_info.max
+
+
+# estimated bytes of an interval object and its (float) bounds
+INTERVAL_BYTES = sys.getsizeof(ExclusionInterval(*[None] * 10)) + 2 * len(WIDTH_BOUNDS) * sys.getsizeof(0.0)
+
+
+@dataclass
+class IntervalStatistics:
+    """
+    Running statistics of the intervals stored in an ExclusionList. Every add/remove updates the counters, so
+    stats() costs O(charges + id prefixes + histogram bins) instead of a scan of the list.
+
+    Tracks the counts per charge and per id prefix (acquisition), fixed-width histograms of the mass and rt centers
+    of bounded intervals, the summed widths of every bounded dimension and the estimated bytes of the interval
+    objects (ids are interned and not counted).
+    """
+
+    mass_bin_width: float = 100.0
+    rt_bin_width: float = 60.0
+    id_prefix: Callable[[str], str] = default_id_prefix
+    count: int = 0
+    charges: Dict[Union[int, None], int] = field(default_factory=lambda: dict())
+    prefixes: Dict[str, int] = field(default_factory=lambda: dict())
+    mass_histogram: Dict[int, int] = field(default_factory=lambda: dict())
+    rt_histogram: Dict[int, int] = field(default_factory=lambda: dict())
+    width_sums: Dict[str, float] = field(default_factory=lambda: {dim: 0.0 for dim in WIDTH_BOUNDS})
+    bounded: Dict[str, int] = field(default_factory=lambda: {dim: 0 for dim in WIDTH_BOUNDS})
+    memory_bytes: int = 0
+
+    @staticmethod
+    def _increment(counts: dict, key, value: int):
+        count = counts.get(key, 0) + value
+        if count <= 0:
+            counts.pop(key, None)
+        else:
+            counts[key] = count
+
+    def _update(self, interval: ExclusionInterval, value: int):
+        self.count += value
+        self.memory_bytes += value * INTERVAL_BYTES
+        self._increment(self.charges, interval.charge, value)
+        prefix = self.id_prefix(interval.id) if isinstance(interval.id, str) else interval.id
+        self._increment(self.prefixes, prefix, value)
+
+        for dim, (min_col, max_col) in WIDTH_BOUNDS.items():
+            low, high = getattr(interval, min_col), getattr(interval, max_col)
+            if not _is_bounded(low, high):
+                continue
+            self.bounded[dim] += value
+            # reset the sum once empty, so float round off does not accumulate
+            self.width_sums[dim] = self.width_sums[dim] + value * (high - low) if self.bounded[dim] else 0.0
+            if dim == 'mass':
+                self._increment(self.mass_histogram, math.floor((low + high) / 2 / self.mass_bin_width), value)
+            elif dim == 'rt':
+                self._increment(self.rt_histogram, math.floor((low + high) / 2 / self.rt_bin_width), value)
+
+    def _update_columns(self, charge: np.ndarray, id_index: np.ndarray, ids: List[Any], bounds: Dict[str, np.ndarray],
+                        value: int):
+        """
+        Vectorized _update over the rows of a columnar list (NONE_CHARGE and NaN bounds stand for None)
+        """
+        n = len(charge)
+        self.count += value * n
+        self.memory_bytes += value * n * INTERVAL_BYTES
+        for charge_value, count in zip(*np.unique(charge, return_counts=True)):
+            self._increment(self.charges, None if charge_value == NONE_CHARGE else int(charge_value),
+                            value * int(count))
+        id_counts = np.bincount(id_index, minlength=len(ids)) if n else np.zeros(0, dtype=np.int64)
+        for index in np.flatnonzero(id_counts).tolist():
+            id = ids[index]
+            prefix = self.id_prefix(id) if isinstance(id, str) else id
+            self._increment(self.prefixes, prefix, value * int(id_counts[index]))
+
+        for dim, (min_col, max_col) in WIDTH_BOUNDS.items():
+            low, high = bounds[min_col], bounds[max_col]
+            mask = (low > -sys.float_info.max) & (high < sys.float_info.max)  # False for NaN
+            low, high = low[mask], high[mask]
+            self.bounded[dim] += value * len(low)
+            self.width_sums[dim] = self.width_sums[dim] + value * float(np.sum(high - low)) if self.bounded[dim] else 0.0
+            if dim == 'mass':
+                self._increment_bins(self.mass_histogram, (low + high) / 2 / self.mass_bin_width, value)
+            elif dim == 'rt':
+                self._increment_bins(self.rt_histogram, (low + high) / 2 / self.rt_bin_width, value)
+
+    def _increment_bins(self, histogram: Dict[int, int], positions: np.ndarray, value: int):
+        bins, counts = np.unique(np.floor(positions).astype(np.int64), return_counts=True)
+        for bin, count in zip(bins.tolist(), counts.tolist()):
+            self._increment(histogram, bin, value * count)
+
+    def _update_intervals(self, intervals: List[ExclusionInterval], value: int):
+        """
+        _update over many intervals, as columns (None bounds become NaN)
+        """
+        id_lookup = {}
+        id_index = np.array([id_lookup.setdefault(interval.id, len(id_lookup)) for interval in intervals],
+                            dtype=np.int64)
+        charge = np.array([NONE_CHARGE if interval.charge is None else interval.charge for interval in intervals],
+                          dtype=np.int64)
+        bounds = {col: np.array([getattr(interval, col) for interval in intervals], dtype=np.float64)
+                  for cols in WIDTH_BOUNDS.values() for col in cols}
+        self._update_columns(charge, id_index, list(id_lookup), bounds, value)
+
+    def add(self, interval: ExclusionInterval):
+        self._update(interval, 1)
+
+    def add_intervals(self, intervals: List[ExclusionInterval]):
+        self._update_intervals(intervals, 1)
+
+    def remove(self, interval: ExclusionInterval):
+        self._update(interval, -1)
+
+    def add_columns(self, charge: np.ndarray, id_index: np.ndarray, ids: List[Any], bounds: Dict[str, np.ndarray]):
+        self._update_columns(charge, id_index, ids, bounds, 1)
+
+    def remove_columns(self, charge: np.ndarray, id_index: np.ndarray, ids: List[Any], bounds: Dict[str, np.ndarray]):
+        self._update_columns(charge, id_index, ids, bounds, -1)
+
+    def clear(self):
+        self.count = 0
+        self.charges = {}
+        self.prefixes = {}
+        self.mass_histogram = {}
+        self.rt_histogram = {}
+        self.width_sums = {dim: 0.0 for dim in WIDTH_BOUNDS}
+        self.bounded = {dim: 0 for dim in WIDTH_BOUNDS}
+        self.memory_bytes = 0
+
+    @classmethod
+    def combine(cls, statistics: Iterable['IntervalStatistics']) -> 'IntervalStatistics':
+        """
+        Sums the statistics of several lists (for example the partitions of ChargePartitionedExclusionList)
+        """
+        combined = None
+        for other in statistics:
+            if combined is None:
+                combined = cls(mass_bin_width=other.mass_bin_width, rt_bin_width=other.rt_bin_width,
+                               id_prefix=other.id_prefix)
+            combined.count += other.count
+            combined.memory_bytes += other.memory_bytes
+            for counts, other_counts in ((combined.charges, other.charges), (combined.prefixes, other.prefixes),
+                                         (combined.mass_histogram, other.mass_histogram),
+                                         (combined.rt_histogram, other.rt_histogram)):
+                for key, count in other_counts.items():
+                    counts[key] = counts.get(key, 0) + count
+            for dim in WIDTH_BOUNDS:
+                combined.width_sums[dim] += other.width_sums[dim]
+                combined.bounded[dim] += other.bounded[dim]
+        return combined if combined is not None else cls()
+
+    def stats(self):
+        return {'charges': {str(charge): count for charge, count in self.charges.items()},
+                'id_prefixes': {str(prefix): count for prefix, count in self.prefixes.items()},
+                'mass_histogram': {bin * self.mass_bin_width: count
+                                   for bin, count in sorted(self.mass_histogram.items())},
+                'rt_histogram': {bin * self.rt_bin_width: count for bin, count in sorted(self.rt_histogram.items())},
+                'avg_widths': {dim: self.width_sums[dim] / self.bounded[dim] if self.bounded[dim] else None
+                               for dim in WIDTH_BOUNDS},
+                'unbounded': {dim: self.count - self.bounded[dim] for dim in WIDTH_BOUNDS},
+                'memory_bytes': self.memory_bytes}
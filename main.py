@@ -1,14 +1,27 @@
+import asyncio
+import itertools
 import logging
 import os
+import uuid
 from typing import List
 
-from fastapi import FastAPI, HTTPException, Query, UploadFile
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Query, Request, UploadFile
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi import BackgroundTasks, FastAPI
 
-from constants import DATA_FOLDER, PROCESS_CANDIDATES_FILE
+from constants import DATA_FOLDER, PROCESS_CANDIDATES_FILE, RT_WINDOW_AUTO_ADVANCE, COMPACTION_INTERVAL, \
+    COMPACTION_MAX_GROWTH, SNAPSHOT_MODE, SNAPSHOT_MERGE_INTERVAL, QUERY_CACHE_SIZE, QUERY_CACHE_MASS_PPM, \
+    QUERY_CACHE_RT_WIDTH, QUERY_CACHE_OOK0_WIDTH, JOURNAL_FOLDER, JOURNAL_SYNC_INTERVAL, JOURNAL_CHECKPOINT_INTERVAL, \
+    DELTA_SAVE_RATIO, SAVED_LIST_CACHE_SIZE
 from exclusionms.components import ExclusionInterval, ExclusionPoint, DynamicExclusionTolerance
-from exclusionms.db import MassIntervalTree as ExclusionList
+from exclusionms.export import EXPORT_FORMATS, COMPRESSIONS, iter_ndjson, iter_csv, iter_compressed, parse_intervals, \
+    parse_points, pack_flags
+from exclusionms.apihandler import decode_points
+from exclusionms.jobs import SaveQueue
+from exclusionms.db import MassIntervalTree, ColumnarExclusionList, ChargePartitionedExclusionList, \
+    RTWindowExclusionList, OccupancyFilteredExclusionList, CompactingExclusionList, CompactionWorker, \
+    SnapshotExclusionList, SnapshotMergeWorker, CachedExclusionList, JournaledExclusionList, JournalWorker, \
+    DeltaExclusionList, delta_paths, check_save_file, load_saved_intervals, SavedListCache, ExclusionList
 from utils import convert_int, convert_float
 
 _log = logging.getLogger(__name__)
@@ -16,13 +29,92 @@ _log.setLevel(logging.INFO)
 
 app = FastAPI()
 
-active_exclusion_list = ExclusionList()
+if SNAPSHOT_MODE:
+    snapshot_exclusion_list = SnapshotExclusionList(
+        lambda: OccupancyFilteredExclusionList(ChargePartitionedExclusionList(ColumnarExclusionList)))
+    index_exclusion_list = snapshot_exclusion_list
+else:
+    index_exclusion_list = OccupancyFilteredExclusionList(ChargePartitionedExclusionList(MassIntervalTree))
+if QUERY_CACHE_SIZE:
+    # below compaction and the rt window, so their removals invalidate the cache
+    index_exclusion_list = CachedExclusionList(index_exclusion_list, max_size=QUERY_CACHE_SIZE,
+                                               mass_ppm=QUERY_CACHE_MASS_PPM, rt_width=QUERY_CACHE_RT_WIDTH,
+                                               ook0_width=QUERY_CACHE_OOK0_WIDTH)
+if JOURNAL_FOLDER is not None:
+    # below compaction and the rt window, so merges and evictions replay exactly as applied, recovers on creation
+    journaled_exclusion_list = JournaledExclusionList(index_exclusion_list, JOURNAL_FOLDER)
+    index_exclusion_list = journaled_exclusion_list
+if DELTA_SAVE_RATIO is not None:
+    # above the journal, whose checkpoints are full snapshots and must not start delta chains
+    index_exclusion_list = DeltaExclusionList(index_exclusion_list, max_delta_ratio=DELTA_SAVE_RATIO)
+compacting_exclusion_list = CompactingExclusionList(index_exclusion_list, max_growth=COMPACTION_MAX_GROWTH)
+active_exclusion_list = RTWindowExclusionList(compacting_exclusion_list, auto_advance=RT_WINDOW_AUTO_ADVANCE)
+# writes saved files off the event loop, one at a time, and reads them in a separate pool
+save_queue = SaveQueue()
+# read only saved lists, which point queries can check alongside the active list
+saved_lists = SavedListCache(max_size=SAVED_LIST_CACHE_SIZE)
+
+
+@app.on_event("startup")
+def start_workers():
+    if COMPACTION_INTERVAL is not None:
+        CompactionWorker(compacting_exclusion_list, COMPACTION_INTERVAL).start()
+    if SNAPSHOT_MODE:
+        SnapshotMergeWorker(snapshot_exclusion_list, SNAPSHOT_MERGE_INTERVAL).start()
+    if JOURNAL_FOLDER is not None:
+        JournalWorker(journaled_exclusion_list, JOURNAL_SYNC_INTERVAL, JOURNAL_CHECKPOINT_INTERVAL).start()
+
+
+@app.on_event("shutdown")
+def sync_journal():
+    if JOURNAL_FOLDER is not None:
+        journaled_exclusion_list.sync()
 
 
 def get_pickle_path(exclusion_list_name: str) -> str:
     return os.path.join(DATA_FOLDER, exclusion_list_name + '.pkl')
 
 
+def get_columnar_path(exclusion_list_name: str) -> str:
+    return os.path.join(DATA_FOLDER, exclusion_list_name + '.col')
+
+
+def get_save_path(exclusion_list_name: str, binary: bool) -> str:
+    if binary:
+        return get_columnar_path(exclusion_list_name)
+    return get_pickle_path(exclusion_list_name)
+
+
+async def get_saved_lists(exclusion_list_names: List[str], binary: bool) -> List[ExclusionList]:
+    exclusion_lists = []
+    for name in exclusion_list_names:
+        pickle_path = get_save_path(name, binary)
+        if not os.path.exists(pickle_path):
+            raise HTTPException(status_code=404, detail=f"exclusion list with name: {name} not found.")
+        exclusion_list = saved_lists.cached(pickle_path)
+        if exclusion_list is None:
+            # opened in the save queue's reader pool, off the event loop and after the saves of this file which
+            # are already queued (saves of other files do not hold it up)
+            try:
+                future = save_queue.submit_read(pickle_path, lambda path=pickle_path: saved_lists.get(path))
+                exclusion_list = await asyncio.wrap_future(future)
+            except Exception as e:
+                _log.error(f'Exception when opening exclusion list: {e}', exc_info=True)
+                raise HTTPException(status_code=500, detail='Error opening exclusion list.')
+        exclusion_lists.append(exclusion_list)
+    return exclusion_lists
+
+
+async def consolidate_save(file_path: str) -> int:
+    # queued behind pending saves of the file, returns the number of consolidated deltas
+    def consolidate():
+        deltas = len(delta_paths(file_path))
+        DeltaExclusionList.consolidate_file(file_path, MassIntervalTree())
+        return deltas
+
+    return await asyncio.wrap_future(save_queue.submit(file_path, consolidate).future)
+
+
 @app.get("/", status_code=200)
 async def get_process_candidates_file():
     return FileResponse(path=PROCESS_CANDIDATES_FILE, filename=PROCESS_CANDIDATES_FILE, media_type='text')
@@ -33,14 +125,16 @@ async def get_process_candidates_file():
 async def get_exclusion_list_statistics():
     _log.info(f'Exclusion List Statistics')
     saved_files = os.listdir(DATA_FOLDER)
-    saved_files_names = [''.join(f.split('.')[:-1]) for f in saved_files]
+    saved_files_names = [''.join(f.split('.')[:-1]) for f in saved_files
+                         if not f.endswith('.delta') and not f.endswith('.upload') and not f.endswith('.tmp')]
     return {'files': saved_files_names, 'active_exclusion_list':active_exclusion_list.stats()}
 
 
-# TODO: Add in merge command
 @app.post("/exclusionms", status_code=200)
-async def save_load_active_exclusion_list(save: bool, exclusion_list_name: str):
-    pickle_path = get_pickle_path(exclusion_list_name)
+async def save_load_active_exclusion_list(save: bool, exclusion_list_name: str, binary: bool = False,
+                                          background: bool = False):
+    # binary saves are column files, which load() detects and memory maps
+    pickle_path = get_save_path(exclusion_list_name, binary)
     _log.info(f'pickle_path: {pickle_path}')
 
     if save:
@@ -48,8 +142,19 @@ async def save_load_active_exclusion_list(save: bool, exclusion_list_name: str):
         if os.path.exists(pickle_path):
             _log.warning(f'{pickle_path} already exists. Overriding.')
 
+        # only the point in time copy of the list is taken here, the save queue writes it while queries go on
         try:
-            active_exclusion_list.save(pickle_path)
+            job = save_queue.submit(pickle_path, active_exclusion_list.snapshot_save(pickle_path, columnar=binary))
+        except Exception as e:
+            _log.error(f'Error when saving exclusion list: {e}')
+            raise HTTPException(status_code=500, detail='Error saving active exclusion list.')
+
+        # background saves return the job, see /exclusionms/job for its status
+        if background:
+            return job.stats()
+
+        try:
+            await asyncio.wrap_future(job.future)
         except Exception as e:
             _log.error(f'Error when saving exclusion list: {e}')
             raise HTTPException(status_code=500, detail='Error saving active exclusion list.')
@@ -66,6 +171,43 @@ async def save_load_active_exclusion_list(save: bool, exclusion_list_name: str):
             raise HTTPException(status_code=500, detail='Error loading active exclusion list.')
 
 
+@app.post("/exclusionms/merge", status_code=200)
+async def merge_exclusion_list_saves(exclusion_list_name: List[str] = Query(), binary: bool = False):
+    _log.info(f'Merge Exclusion Lists')
+    pickle_paths = [get_save_path(name, binary) for name in exclusion_list_name]
+    for name, pickle_path in zip(exclusion_list_name, pickle_paths):
+        if not os.path.exists(pickle_path):
+            raise HTTPException(status_code=404, detail=f"exclusion list with name: {name} not found.")
+
+    # read in the save queue's reader pool, after the queued saves of each file and off the event loop
+    try:
+        intervals = []
+        for pickle_path in pickle_paths:
+            future = save_queue.submit_read(pickle_path, lambda path=pickle_path: load_saved_intervals(path))
+            intervals.extend(await asyncio.wrap_future(future))
+    except Exception as e:
+        _log.error(f'Exception when reading exclusion list: {e}', exc_info=True)
+        raise HTTPException(status_code=500, detail='Error reading exclusion list.')
+
+    # intervals already in the active list (or repeated across the files) are added once. Deduplicating and
+    # rebuilding the index takes seconds for large lists, so it runs in a worker thread (under the list's lock)
+    # while the event loop keeps answering queries
+    try:
+        added = await asyncio.to_thread(active_exclusion_list.merge_intervals, intervals)
+    except Exception as e:
+        _log.error(f'Exception when merging exclusion lists: {e}', exc_info=True)
+        raise HTTPException(status_code=500, detail='Error merging exclusion lists.')
+    return {'added': added, 'duplicates': len(intervals) - added, 'len': len(active_exclusion_list)}
+
+
+@app.get("/exclusionms/job", status_code=200)
+async def get_save_job(job_id: str):
+    job = save_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"save job with id: {job_id} not found.")
+    return job.stats()
+
+
 @app.delete("/exclusionms", status_code=200)
 async def clear_active_exclusion_list():
     _log.info(f'Delete Active Exclusion List')
@@ -73,35 +215,119 @@ async def clear_active_exclusion_list():
 
 
 @app.delete("/exclusionms/file", status_code=200)
-async def delete_exclusion_list_save(exclusion_list_name: str):
+async def delete_exclusion_list_save(exclusion_list_name: str, binary: bool = False):
     _log.info(f'Delete Exclusion List Save')
-    pickle_path = get_pickle_path(exclusion_list_name)
+    pickle_path = get_save_path(exclusion_list_name, binary)
 
     if not os.path.exists(pickle_path):
         raise HTTPException(status_code=404, detail=f"exclusion list with name: {exclusion_list_name} not found.")
 
     try:
-        os.remove(pickle_path)
+        for path in delta_paths(pickle_path) + [pickle_path]:
+            os.remove(path)
     except Exception as e:
         _log.error(f'Error when deleting exclusion list: {e}')
         raise HTTPException(status_code=500, detail='Error deleting exclusion list.')
 
 
 @app.get("/exclusionms/file", status_code=200)
-async def download_exclusion_list_save(exclusion_list_name: str):
+async def download_exclusion_list_save(exclusion_list_name: str, binary: bool = False):
     _log.info(f'Download Exclusion List')
-    pickle_path = get_pickle_path(exclusion_list_name)
+    pickle_path = get_save_path(exclusion_list_name, binary)
 
     if not os.path.exists(pickle_path):
         raise HTTPException(status_code=404, detail=f"exclusion list with name: {exclusion_list_name} not found.")
 
+    # a download is a single file, so delta saves are folded into their base first (after any queued saves)
+    await consolidate_save(pickle_path)
     return FileResponse(path=pickle_path)
 
 
+@app.post("/exclusionms/consolidate", status_code=200)
+async def consolidate_exclusion_list_save(exclusion_list_name: str, binary: bool = False):
+    _log.info(f'Consolidate Exclusion List Save')
+    pickle_path = get_save_path(exclusion_list_name, binary)
+
+    if not os.path.exists(pickle_path):
+        raise HTTPException(status_code=404, detail=f"exclusion list with name: {exclusion_list_name} not found.")
+
+    try:
+        deltas = await consolidate_save(pickle_path)
+    except Exception as e:
+        _log.error(f'Error when consolidating exclusion list: {e}', exc_info=True)
+        raise HTTPException(status_code=500, detail='Error consolidating exclusion list.')
+    return {'consolidated_deltas': deltas}
+
+
 @app.post("/exclusionms/file", status_code=200)
-async def upload_exclusion_list_save(file):
+async def upload_exclusion_list_save(request: Request, exclusion_list_name: str, binary: bool = False,
+                                     load: bool = False):
     _log.info(f'Upload Exclusion List')
-    return
+    pickle_path = get_save_path(exclusion_list_name, binary)
+    # unique per upload, so concurrent uploads to one name do not write the same file
+    upload_path = f'{pickle_path}.{uuid.uuid4().hex}.upload'
+
+    # the raw body is written chunk by chunk as it arrives (in a worker thread), so memory use does not depend on
+    # the file size and the event loop does not wait on the disk. Pickles are only ever read with a restricted
+    # unpickler, which cannot run code from an uploaded file
+    size = 0
+    try:
+        file = await asyncio.to_thread(open, upload_path, 'wb')
+        try:
+            async for chunk in request.stream():
+                await asyncio.to_thread(file.write, chunk)
+                size += len(chunk)
+        finally:
+            await asyncio.to_thread(file.close)
+        await asyncio.to_thread(check_save_file, upload_path, binary)
+    except Exception as e:
+        _log.error(f'Error when uploading exclusion list: {e}')
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
+        raise HTTPException(status_code=400, detail=f'Invalid exclusion list file: {e}')
+
+    def replace_save():
+        # deltas of a previous save under this name do not apply to the uploaded file
+        for path in delta_paths(pickle_path):
+            os.remove(path)
+        os.replace(upload_path, pickle_path)
+
+    # queued behind pending saves of the file, which would otherwise overwrite the upload or add deltas to it
+    try:
+        await asyncio.wrap_future(save_queue.submit(pickle_path, replace_save).future)
+    except Exception as e:
+        _log.error(f'Error when replacing exclusion list: {e}', exc_info=True)
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
+        raise HTTPException(status_code=500, detail='Error replacing exclusion list file.')
+
+    if load:
+        try:
+            active_exclusion_list.load(pickle_path)
+        except Exception as e:
+            _log.error(f'Exception when loading exclusion list: {e}', exc_info=True)
+            raise HTTPException(status_code=500, detail='Error loading active exclusion list.')
+    return {'bytes': size}
+
+
+@app.get("/exclusionms/export", status_code=200)
+async def export_active_exclusion_list(format: str = 'ndjson', compression: str = 'none', chunk_size: int = 1024):
+    _log.info(f'Export Exclusion List')
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    if compression not in COMPRESSIONS:
+        raise HTTPException(status_code=400, detail=f"compression must be one of: {', '.join(COMPRESSIONS)}")
+    if chunk_size < 1:
+        raise HTTPException(status_code=400, detail="chunk_size must be at least 1")
+
+    # read lazily (in a worker thread) chunk_size intervals at a time, each under the list's locks, so writes are only
+    # blocked per chunk. Not a point in time copy: writes made during the export may or may not be included
+    intervals = itertools.chain.from_iterable(active_exclusion_list.iter_chunks(chunk_size))
+    chunks = iter_ndjson(intervals, chunk_size) if format == 'ndjson' else iter_csv(intervals, chunk_size)
+    extension, media_type = COMPRESSIONS[compression]
+    file_name = f'exclusion_list.{format}{extension}'
+    return StreamingResponse(iter_compressed(chunks, compression), media_type=media_type or EXPORT_FORMATS[format],
+                             headers={'Content-Disposition': f'attachment; filename={file_name}'})
 
 
 @app.get("/exclusionms/interval", response_model=List[ExclusionInterval], status_code=200)
@@ -183,11 +409,47 @@ async def remove_interval(background_tasks: BackgroundTasks,
     background_tasks.add_task(active_exclusion_list.remove, ex_interval=exclusion_interval)
 
 
+async def read_intervals(request: Request) -> List[ExclusionInterval]:
+    # a json list of intervals or an object of columns (see parse_intervals), bounds default like the query params
+    try:
+        intervals = parse_intervals(await request.json())
+        for interval in intervals:
+            interval.convert_none()
+        invalid = [interval for interval in intervals if not interval.is_valid()]
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f'Invalid intervals: {e}')
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"exclusion interval invalid. Check min/max bounds: {invalid[0]}")
+    return intervals
+
+
+@app.post("/exclusionms/intervals", status_code=200)
+async def add_intervals(request: Request):
+    intervals = await read_intervals(request)
+    if any(interval.id is None for interval in intervals):
+        raise HTTPException(status_code=400, detail=f"exclusion interval invalid. id is required.")
+
+    active_exclusion_list.bulk_add(intervals)
+    return {'inserted': len(intervals), 'len': len(active_exclusion_list)}
+
+
+@app.delete("/exclusionms/intervals", status_code=200)
+async def remove_intervals(request: Request):
+    intervals = await read_intervals(request)
+    removed = active_exclusion_list.bulk_remove(intervals)
+    return {'removed': removed, 'len': len(active_exclusion_list)}
+
+
+# exclusion_list_name: saved lists which are checked in addition to the active list
 @app.get("/exclusionms/point", response_model=List[ExclusionInterval], status_code=200)
 async def get_point(charge: int | None = None, mass: float | None = None,
-                    rt: float | None = None, ook0: float | None = None, intensity: float | None = None):
+                    rt: float | None = None, ook0: float | None = None, intensity: float | None = None,
+                    exclusion_list_name: List[str] = Query(default=[]), binary: bool = False):
+    exclusion_lists = await get_saved_lists(exclusion_list_name, binary)
     exclusion_point = ExclusionPoint(charge=charge, mass=mass, rt=rt, ook0=ook0, intensity=intensity)
     intervals = active_exclusion_list.query_by_point(exclusion_point)
+    for exclusion_list in exclusion_lists:
+        intervals += exclusion_list.query_by_point(exclusion_point)
 
     if not intervals:
         raise HTTPException(status_code=404, detail=f"No intervals found")
@@ -197,19 +459,32 @@ async def get_point(charge: int | None = None, mass: float | None = None,
 
 @app.head("/exclusionms/point", status_code=200)
 async def head_point(charge: int | None = None, mass: float | None = None,
-                     rt: float | None = None, ook0: float | None = None, intensity: float | None = None):
+                     rt: float | None = None, ook0: float | None = None, intensity: float | None = None,
+                     exclusion_list_name: List[str] = Query(default=[]), binary: bool = False):
+    exclusion_lists = await get_saved_lists(exclusion_list_name, binary)
     exclusion_point = ExclusionPoint(charge=charge, mass=mass, rt=rt, ook0=ook0, intensity=intensity)
-    intervals = active_exclusion_list.query_by_point(exclusion_point)
+    excluded = active_exclusion_list.is_excluded(exclusion_point) or \
+        any(exclusion_list.is_excluded(exclusion_point) for exclusion_list in exclusion_lists)
 
-    if not intervals:
+    if not excluded:
         raise HTTPException(status_code=404, detail=f"No intervals found")
 
 
+def is_excluded_batch(points: List[ExclusionPoint], exclusion_lists: List[ExclusionList]) -> List[bool]:
+    # points excluded by the active list or any of the saved lists
+    excluded = active_exclusion_list.is_excluded_batch(points)
+    for exclusion_list in exclusion_lists:
+        excluded = [a or b for a, b in zip(excluded, exclusion_list.is_excluded_batch(points))]
+    return excluded
+
+
 @app.get("/exclusionms/points", response_model=List[bool], status_code=200)
 async def get_points(charge: List[int | str] = Query(), mass: List[int | str] = Query(), rt: List[int | str] = Query(),
-                     ook0: List[int | str] = Query(), intensity: List[int | str] = Query()):
+                     ook0: List[int | str] = Query(), intensity: List[int | str] = Query(),
+                     exclusion_list_name: List[str] = Query(default=[]), binary: bool = False):
     if len({len(i) for i in [charge, mass, rt, ook0, intensity]}) != 1:
         raise HTTPException(status_code=400, detail=f"lists are not the same size")
+    exclusion_lists = await get_saved_lists(exclusion_list_name, binary)
 
     points = []
     for point_values in zip(charge, mass, rt, ook0, intensity):
@@ -218,10 +493,47 @@ async def get_points(charge: List[int | str] = Query(), mass: List[int | str] =
                                intensity=convert_float(point_values[4]))
         points.append(point)
 
-    exclusions = []
-    for point in points:
-        exclusions.append(active_exclusion_list.is_excluded(point))
-    return exclusions
+    return is_excluded_batch(points, exclusion_lists)
+
+
+# columnar json body (see parse_points) instead of query params, so batches are not limited by the url length.
+# returns the flags packed into bits (see pack_flags)
+@app.post("/exclusionms/points", status_code=200)
+async def post_points(request: Request, exclusion_list_name: List[str] = Query(default=[]), binary: bool = False):
+    try:
+        points = parse_points(await request.json())
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f'Invalid points: {e}')
+    exclusion_lists = await get_saved_lists(exclusion_list_name, binary)
+
+    return Response(content=pack_flags(is_excluded_batch(points, exclusion_lists)),
+                    media_type='application/octet-stream')
+
+
+# packed little endian records (see apihandler.encode_points), optionally with a header, returns the packed flags
+@app.post("/exclusionms/points/binary", status_code=200)
+async def post_points_binary(request: Request, exclusion_list_name: List[str] = Query(default=[]),
+                             binary: bool = False):
+    try:
+        points = decode_points(await request.body())
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f'Invalid points: {e}')
+    exclusion_lists = await get_saved_lists(exclusion_list_name, binary)
+
+    return Response(content=pack_flags(is_excluded_batch(points, exclusion_lists)),
+                    media_type='application/octet-stream')
+
+
+@app.post("/exclusionms/rt", status_code=200)
+async def advance_rt(rt: float):
+    evicted = active_exclusion_list.advance(rt)
+    return {'current_rt': active_exclusion_list.current_rt, 'evicted': evicted}
+
+
+@app.post("/exclusionms/compact", status_code=200)
+async def compact_active_exclusion_list():
+    _log.info(f'Compact Active Exclusion List')
+    return {'merged': compacting_exclusion_list.compact(), 'len': len(active_exclusion_list)}
 
 
 @app.get("/exclusionms/stats", status_code=200)
@@ -242,6 +554,7 @@ async def add_random_intervals(n: int, min_charge: int, max_charge: int, min_mas
 
 
 
+    random_intervals = []
     for i in range(n):
         random_exclusion_point = ExclusionPoint.generate_random(min_charge=min_charge, max_charge=max_charge,
                                                                 min_mass=min_mass, max_mass=max_mass,
@@ -250,4 +563,6 @@ async def add_random_intervals(n: int, min_charge: int, max_charge: int, min_mas
                                                                 min_intensity=min_intensity, max_intensity=max_intensity)
         random_interval = tolerance.construct_interval(interval_id='testing', exclusion_point=random_exclusion_point)
         random_interval.convert_none()
-        active_exclusion_list.add(random_interval)
+        random_intervals.append(random_interval)
+
+    active_exclusion_list.bulk_add(random_intervals)
@@ -4,7 +4,7 @@ import time
 import pandas as pd
 import streamlit as st
 
-from exclusionms.apihandler import add_exclusion_interval_query
+from exclusionms.apihandler import add_exclusion_intervals
 from exclusionms.components import ExclusionInterval, DynamicExclusionTolerance, ExclusionPoint
 from constants import EXCLUSION_API_IP
 st.header('Populate Active Exclusion List with Random intervals')
@@ -34,6 +34,8 @@ if st.button('Add'):
 
     times = []
     sizes = []
+    batch = []
+    batch_size = max(int(num_intervals/100), 1)
     start_time = time.time()
     for i in range(num_intervals):
         random_exclusion_point = ExclusionPoint.generate_random(min_charge=min_charge, max_charge=max_charge,
@@ -42,10 +44,13 @@ if st.button('Add'):
                                                                 min_ook0=min_ook0, max_ook0=max_ook0,
                                                                 min_intensity=min_intensity, max_intensity=max_intensity)
         random_interval = tolerance.construct_interval(interval_id='testing', exclusion_point=random_exclusion_point)
-        add_exclusion_interval_query(exclusion_api_ip=EXCLUSION_API_IP, exclusion_interval=random_interval)
+        batch.append(random_interval)
 
-        if i % int(num_intervals/100) == 0:
-            sizes.append(i)
+        # one request per batch instead of one per interval
+        if len(batch) == batch_size or i == num_intervals - 1:
+            add_exclusion_intervals(exclusion_api_ip=EXCLUSION_API_IP, exclusion_intervals=batch)
+            batch = []
+            sizes.append(i + 1)
             times.append(time.time() - start_time)
 
     df = pd.DataFrame({'size':sizes, 'time':times})
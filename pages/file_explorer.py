@@ -3,6 +3,8 @@ import requests
 import streamlit as st
 
 from constants import EXCLUSION_API_IP
+from exclusionms.apihandler import upload_exclusion_list_file
+from exclusionms.exceptions import UnexpectedStatusCodeException
 
 saved_files = json.loads(requests.get(f'{EXCLUSION_API_IP}/exclusionms').content)['files']
 
@@ -46,7 +48,12 @@ if col3.button("Download"):
     st.download_button('Download', download_file(name), file_name=f'{file_option}.pkl')
 
 st.subheader('Upload Exclusion List')
-file_upload = st.file_uploader(label='Upload exclusion file')
-if st.button("Upload"):
-    st.write('Not implemented...')
-    pass
\ No newline at end of file
+file_upload = st.file_uploader(label='Upload exclusion file', type=['pkl', 'col'])
+load_upload = st.checkbox('Load into the active exclusion list')
+if st.button("Upload") and file_upload is not None:
+    upload_name, upload_extension = file_upload.name.rsplit('.', 1)
+    try:
+        st.write(upload_exclusion_list_file(EXCLUSION_API_IP, upload_name, file_upload,
+                                            binary=upload_extension == 'col', load=load_upload))
+    except UnexpectedStatusCodeException as e:
+        st.write(e)
\ No newline at end of file
@@ -11,7 +11,10 @@ setup(
     packages=['exclusionms'],
     package_dir={'exclusionms': 'exclusionms'},
     install_requires=['intervaltree==3.1.0',
+                      'numpy==1.23.4',
                       'requests==2.28.1',
+                      'rtree==1.0.1',
+                      'sortedcontainers==2.4.0',
                       ],
     classifiers=[
         'Development Status :: 1 - Planning',
@@ -1,7 +1,16 @@
+import csv
+import gzip
+import io
+import json
+import lzma
+import os
+import pickle
 import time
 
 from fastapi.testclient import TestClient
 
+from exclusionms.apihandler import encode_points
+from exclusionms.components import ExclusionPoint
 from main import app
 
 client = TestClient(app)
@@ -57,6 +66,182 @@ def test_post_exclusion_load():
     assert response.status_code == 200
 
 
+def test_save_load_binary():
+    client.delete("/exclusionms")
+    client.post(f"/exclusionms/interval{example_interval}")
+
+    response = client.post("/exclusionms?save=True&exclusion_list_name=testing&binary=True")
+    assert response.status_code == 200
+
+    client.delete("/exclusionms")
+    response = client.post("/exclusionms?save=False&exclusion_list_name=testing&binary=True")
+    assert response.status_code == 200
+
+    response = client.get(f"/exclusionms/interval{example_interval}")
+    assert response.json() == [example_interval_dict]
+
+    response = client.delete("/exclusionms/file?exclusion_list_name=testing&binary=True")
+    assert response.status_code == 200
+
+
+def test_save_background():
+    client.delete("/exclusionms")
+    client.post(f"/exclusionms/interval{example_interval}")
+
+    response = client.post("/exclusionms?save=True&exclusion_list_name=testing&background=True")
+    assert response.status_code == 200
+    job_id = response.json()['job_id']
+    client.delete("/exclusionms")
+
+    for _ in range(100):
+        response = client.get(f"/exclusionms/job?job_id={job_id}")
+        assert response.status_code == 200
+        if response.json()['status'] == 'done':
+            break
+        time.sleep(0.01)
+    assert response.json()['status'] == 'done'
+
+    client.post("/exclusionms?save=False&exclusion_list_name=testing")
+    response = client.get(f"/exclusionms/interval{example_interval}")
+    assert response.json() == [example_interval_dict]
+    client.delete("/exclusionms/file?exclusion_list_name=testing")
+
+
+def test_save_job_not_found():
+    response = client.get("/exclusionms/job?job_id=missing")
+    assert response.status_code == 404
+
+
+def test_save_delta_consolidate():
+    client.delete("/exclusionms")
+    client.get("/exclusionms/random/interval?n=100&min_charge=1&max_charge=3&min_mass=500&max_mass=600"
+               "&min_rt=0&max_rt=100&min_ook0=0.5&max_ook0=1.5&min_intensity=0&max_intensity=100"
+               "&use_exact_charge=True&mass_tolerance=50&rt_tolerance=10&ook0_tolerance=0.05")
+    client.post("/exclusionms?save=True&exclusion_list_name=testing&binary=True")
+    client.post(f"/exclusionms/interval{example_interval}")
+    client.post("/exclusionms?save=True&exclusion_list_name=testing&binary=True")
+
+    response = client.post("/exclusionms/consolidate?exclusion_list_name=testing&binary=True")
+    assert response.status_code == 200
+    assert response.json() == {'consolidated_deltas': 1}
+
+    client.delete("/exclusionms")
+    client.post("/exclusionms?save=False&exclusion_list_name=testing&binary=True")
+    response = client.get(f"/exclusionms/interval{example_interval}")
+    assert response.json() == [example_interval_dict]
+
+    response = client.delete("/exclusionms/file?exclusion_list_name=testing&binary=True")
+    assert response.status_code == 200
+
+
+def test_merge():
+    client.delete("/exclusionms")
+    client.get("/exclusionms/random/interval?n=100&min_charge=1&max_charge=3&min_mass=500&max_mass=600"
+               "&min_rt=0&max_rt=100&min_ook0=0.5&max_ook0=1.5&min_intensity=0&max_intensity=100"
+               "&use_exact_charge=True&mass_tolerance=50&rt_tolerance=10&ook0_tolerance=0.05")
+    client.post("/exclusionms?save=True&exclusion_list_name=testing&binary=True")
+    client.delete("/exclusionms")
+    client.post(f"/exclusionms/interval{example_interval}")
+    client.post("/exclusionms?save=True&exclusion_list_name=testing2&binary=True")
+
+    response = client.post("/exclusionms/merge?exclusion_list_name=testing&exclusion_list_name=testing2&binary=True")
+    assert response.status_code == 200
+    assert response.json() == {'added': 100, 'duplicates': 1, 'len': 101}
+
+    response = client.post("/exclusionms/merge?exclusion_list_name=testing&exclusion_list_name=missing&binary=True")
+    assert response.status_code == 404
+
+    client.delete("/exclusionms/file?exclusion_list_name=testing&binary=True")
+    client.delete("/exclusionms/file?exclusion_list_name=testing2&binary=True")
+
+
+def test_upload_file():
+    client.delete("/exclusionms")
+    client.post(f"/exclusionms/interval{example_interval}")
+    client.post("/exclusionms?save=True&exclusion_list_name=testing&binary=True")
+    data = client.get("/exclusionms/file?exclusion_list_name=testing&binary=True").content
+    client.delete("/exclusionms/file?exclusion_list_name=testing&binary=True")
+    client.delete("/exclusionms")
+
+    response = client.post("/exclusionms/file?exclusion_list_name=uploaded&binary=True&load=True", data=data)
+    assert response.status_code == 200
+    assert response.json() == {'bytes': len(data)}
+    response = client.get(f"/exclusionms/interval{example_interval}")
+    assert response.json() == [example_interval_dict]
+
+    response = client.delete("/exclusionms/file?exclusion_list_name=uploaded&binary=True")
+    assert response.status_code == 200
+
+
+def test_upload_file_after_pending_save():
+    client.delete("/exclusionms")
+    client.post(f"/exclusionms/interval{example_interval}")
+    client.post("/exclusionms?save=True&exclusion_list_name=testing&binary=True")
+    data = client.get("/exclusionms/file?exclusion_list_name=testing&binary=True").content
+    client.delete("/exclusionms/file?exclusion_list_name=testing&binary=True")
+    client.delete("/exclusionms")
+
+    # the upload replaces the file after the queued save, not before it
+    client.post("/exclusionms?save=True&exclusion_list_name=uploaded&binary=True&background=True")
+    response = client.post("/exclusionms/file?exclusion_list_name=uploaded&binary=True", data=data)
+    assert response.status_code == 200
+    assert client.get("/exclusionms/file?exclusion_list_name=uploaded&binary=True").content == data
+
+    client.delete("/exclusionms/file?exclusion_list_name=uploaded&binary=True")
+
+
+def test_upload_file_invalid():
+    response = client.post("/exclusionms/file?exclusion_list_name=uploaded&binary=True", data=b'EXMSCOLS' * 10)
+    assert response.status_code == 400
+    response = client.post("/exclusionms/file?exclusion_list_name=uploaded", data=b'not a pickle')
+    assert response.status_code == 400
+    assert 'uploaded' not in client.get("/exclusionms").json()['files']
+
+
+class RemoveFile:
+    def __init__(self, path):
+        self.path = path
+
+    def __reduce__(self):
+        return os.remove, (self.path,)
+
+
+def test_upload_file_pickle_cannot_run_code(tmp_path):
+    sentinel = tmp_path / 'sentinel'
+    sentinel.write_text('')
+    response = client.post("/exclusionms/file?exclusion_list_name=uploaded&load=True",
+                           data=pickle.dumps([RemoveFile(str(sentinel))], protocol=4))
+    assert response.status_code == 500
+    assert sentinel.exists()
+
+    client.delete("/exclusionms/file?exclusion_list_name=uploaded")
+
+
+def test_export():
+    client.delete("/exclusionms")
+    client.post(f"/exclusionms/interval{example_interval}")
+
+    response = client.get("/exclusionms/export?format=ndjson&compression=gzip")
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/gzip'
+    assert [json.loads(line) for line in gzip.decompress(response.content).splitlines()] == [example_interval_dict]
+
+    response = client.get("/exclusionms/export?format=csv&compression=lzma")
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(lzma.decompress(response.content).decode('utf-8'))))
+    assert [{key: value if key == 'id' else float(value) for key, value in row.items()} for row in rows] == \
+           [example_interval_dict]
+
+
+def test_export_invalid():
+    response = client.get("/exclusionms/export?format=xml")
+    assert response.status_code == 400
+    response = client.get("/exclusionms/export?compression=zip")
+    assert response.status_code == 400
+    response = client.get("/exclusionms/export?chunk_size=0")
+    assert response.status_code == 400
+
+
 def test_post_exclusion_load_fail():
     client.delete("/exclusionms")
 
@@ -97,6 +282,9 @@ def test_save_load():
     assert response.status_code == 200
     assert response.json() == [example_interval_dict]
 
+    response = client.delete("/exclusionms/file?exclusion_list_name=testing")  # delete save
+    assert response.status_code == 200
+
 
 def test_post_exclusion_interval():
     client.delete("/exclusionms")
@@ -263,6 +451,142 @@ def test_get_points():
     assert response.json() == [True, True]
 
 
+def test_add_remove_intervals():
+    client.delete("/exclusionms")
+    intervals = [{**example_interval_dict, 'id': f'PEPTIDE_{i}', 'min_mass': 1000 - i} for i in range(10)]
+    response = client.post("/exclusionms/intervals", json=intervals)
+    assert response.status_code == 200
+    assert response.json() == {'inserted': 10, 'len': 10}
+
+    columns = {'id': ['COLUMNS', 'COLUMNS'], 'charge': [2, None], 'min_mass': [500, 600], 'max_mass': [501, 601]}
+    response = client.post("/exclusionms/intervals", json=columns)
+    assert response.status_code == 200
+    assert response.json() == {'inserted': 2, 'len': 12}
+
+    response = client.delete("/exclusionms/intervals", json=intervals[:5] + [{'id': 'COLUMNS'}])
+    assert response.status_code == 200
+    assert response.json() == {'removed': 7, 'len': 5}
+
+    response = client.post("/exclusionms/intervals", json=[{'charge': 1}])
+    assert response.status_code == 400
+    response = client.post("/exclusionms/intervals", json={'id': ['A'], 'min_mass': [2], 'max_mass': [1]})
+    assert response.status_code == 400
+    response = client.post("/exclusionms/intervals", json={'id': ['A', 'B'], 'charge': [1]})
+    assert response.status_code == 400
+    response = client.post("/exclusionms/intervals", json={'min_mass': ['x']})
+    assert response.status_code == 400
+    response = client.delete("/exclusionms/intervals", json=[{'id': 'A', 'max_mass': 'x'}])
+    assert response.status_code == 400
+
+
+def test_get_points_saved_list():
+    client.delete("/exclusionms")
+    client.post(f"/exclusionms/interval{example_interval}")
+    client.post("/exclusionms?save=True&exclusion_list_name=testing&binary=True")
+    client.delete("/exclusionms")
+
+    response = client.get(f"/exclusionms/points{example_points}")
+    assert response.json() == [False, False]
+    response = client.get(f"/exclusionms/points{example_points}&exclusion_list_name=testing&binary=True")
+    assert response.status_code == 200
+    assert response.json() == [True, True]
+    response = client.get(f"/exclusionms/point{example_point}&exclusion_list_name=testing&binary=True")
+    assert response.status_code == 200
+    assert response.json() == [example_interval_dict]
+    response = client.head(f"/exclusionms/point{example_point}&exclusion_list_name=testing&binary=True")
+    assert response.status_code == 200
+    response = client.get(f"/exclusionms/points{example_points}&exclusion_list_name=missing")
+    assert response.status_code == 404
+
+    client.delete("/exclusionms/file?exclusion_list_name=testing&binary=True")
+
+
+def test_post_points():
+    client.delete("/exclusionms")
+    client.post(f"/exclusionms/interval{example_interval}")
+
+    columns = {'charge': [1, 1, None], 'mass': [1000.5, 1001.5, 1000.5], 'rt': [1000.5] * 3, 'ook0': [1000.5] * 3,
+               'intensity': [None] * 3}
+    response = client.post("/exclusionms/points", json=columns)
+    assert response.status_code == 200
+    assert response.content == bytes([0b101])
+
+    response = client.post("/exclusionms/points", json={'charge': [], 'mass': []})
+    assert response.status_code == 200
+    assert response.content == b''
+
+    response = client.post("/exclusionms/points", json={'charge': [1], 'mass': [1.0, 2.0]})
+    assert response.status_code == 400
+    response = client.post("/exclusionms/points", json={'mass': ['x']})
+    assert response.status_code == 400
+    response = client.post("/exclusionms/points", json={'charge': [1.5]})
+    assert response.status_code == 400
+
+
+def test_post_points_binary():
+    client.delete("/exclusionms")
+    client.post(f"/exclusionms/interval{example_interval}")
+
+    points = [ExclusionPoint(charge=1, mass=1000.5, rt=1000.5, ook0=1000.5, intensity=None),
+              ExclusionPoint(charge=1, mass=1001.5, rt=1000.5, ook0=1000.5, intensity=None),
+              ExclusionPoint(charge=None, mass=1000.5, rt=None, ook0=None, intensity=None)]
+    for header in [True, False]:
+        response = client.post("/exclusionms/points/binary", data=encode_points(points, header=header))
+        assert response.status_code == 200
+        assert response.content == bytes([0b101])
+
+    response = client.post("/exclusionms/points/binary", data=encode_points(points)[:-1])
+    assert response.status_code == 400
+
+
+def test_advance_rt():
+    client.delete("/exclusionms")
+    response = client.post(f"/exclusionms/interval{example_interval}")
+    assert response.status_code == 200
+
+    response = client.post("/exclusionms/rt?rt=1000.5")
+    assert response.status_code == 200
+    assert response.json() == {'current_rt': 1000.5, 'evicted': 0}
+
+    response = client.post("/exclusionms/rt?rt=1001")
+    assert response.status_code == 200
+    assert response.json() == {'current_rt': 1001, 'evicted': 1}
+
+    response = client.get(f"/exclusionms/point{example_point}")
+    assert response.status_code == 404
+
+
+def test_compact():
+    client.delete("/exclusionms")
+    response = client.post(f"/exclusionms/interval{example_interval}")
+    assert response.status_code == 200
+    response = client.post(f"/exclusionms/interval{example_interval.replace('min_rt=1000&', 'min_rt=1000.5&')}")
+    assert response.status_code == 200
+
+    response = client.post("/exclusionms/compact")
+    assert response.status_code == 200
+    assert response.json() == {'merged': 1, 'len': 1}
+
+    response = client.get(f"/exclusionms/interval?interval_id=PEPTIDE")
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+
+
+def test_add_random_intervals():
+    client.delete("/exclusionms")
+    response = client.get("/exclusionms/random/interval?n=1000&min_charge=1&max_charge=3&min_mass=500&max_mass=600"
+                          "&min_rt=0&max_rt=100&min_ook0=0.5&max_ook0=1.5&min_intensity=0&max_intensity=100"
+                          "&use_exact_charge=True&mass_tolerance=50&rt_tolerance=10&ook0_tolerance=0.05")
+    assert response.status_code == 200
+
+    response = client.get("/exclusionms/stats")
+    assert response.status_code == 200
+    assert response.json()['len'] == 1000
+    assert sum(response.json()['charges'].values()) == 1000
+    assert response.json()['id_prefixes'] == {'testing': 1000}
+    assert sum(response.json()['mass_histogram'].values()) == 1000
+
+
 def test_add_interval_performance():
     client.delete("/exclusionms")
     response = client.post(f"/exclusionms/interval{example_interval}")
@@ -1,11 +1,28 @@
+import gzip
+import json
+import lzma
+import math
+import os
 import random
+import tempfile
 import time
 import unittest
 import pickle
+from threading import Event, Thread
 from copy import copy, deepcopy
+from dataclasses import replace
 
 from exclusionms.components import ExclusionInterval, ExclusionPoint
-from exclusionms.db import MassIntervalTree as ExclusionList
+from exclusionms.db import MassIntervalTree as ExclusionList, ColumnarExclusionList, \
+    RTreeExclusionList, ChargePartitionedExclusionList, RTWindowExclusionList, OccupancyFilteredExclusionList, \
+    CompactingExclusionList, SnapshotExclusionList, CachedExclusionList, JournaledExclusionList, DeltaExclusionList, \
+    SavedListCache, delta_paths
+from exclusionms.apihandler import encode_points, decode_points, POINT_RECORD
+from exclusionms.columnfile import ColumnFile
+from exclusionms.export import iter_ndjson, iter_csv, iter_compressed, parse_intervals, parse_points, pack_flags, \
+    unpack_flags
+from exclusionms.jobs import SaveQueue
+from exclusionms.statistics import IntervalStatistics
 
 
 
@@ -33,6 +50,43 @@ messages = [
 ]
 
 
+def random_intervals(n, seed=0):
+    rng = random.Random(seed)
+    intervals = []
+    for i in range(n):
+        mass = rng.uniform(500, 600)
+        rt = rng.uniform(0, 100)
+        ook0 = rng.uniform(0.5, 1.5)
+        intervals.append(ExclusionInterval(id=f'ID_{i % 10}',
+                                           charge=rng.choice([None, 1, 2, 3]),
+                                           min_mass=mass - rng.uniform(0.01, 1),
+                                           max_mass=mass + rng.uniform(0.01, 1),
+                                           min_rt=rt - 5,
+                                           max_rt=rt + 5,
+                                           min_ook0=ook0 - 0.05,
+                                           max_ook0=ook0 + 0.05,
+                                           min_intensity=0,
+                                           max_intensity=1_000_000))
+    return intervals
+
+
+def random_points(n, seed=1):
+    rng = random.Random(seed)
+    return [ExclusionPoint(charge=rng.choice([None, 1, 2, 3]), mass=rng.uniform(500, 600), rt=rng.uniform(0, 100),
+                           ook0=rng.choice([None, rng.uniform(0.5, 1.5)]), intensity=1000) for _ in range(n)]
+
+
+def interval_key(interval):
+    return (interval.id, -1 if interval.charge is None else interval.charge, interval.min_mass, interval.max_mass,
+            interval.min_rt, interval.max_rt, interval.min_ook0, interval.max_ook0)
+
+
+def temporary_path(test_case, name):
+    folder = tempfile.TemporaryDirectory()
+    test_case.addCleanup(folder.cleanup)
+    return os.path.join(folder.name, name)
+
+
 class TestExclusionList(unittest.TestCase):
 
     def setUp(self) -> None:
@@ -46,7 +100,11 @@ class TestExclusionList(unittest.TestCase):
         self.exlist.add(messages[0])
         self.assertEqual(1, len(self.exlist))
         self.exlist.add(messages[0])
-        self.assertEqual(1, len(self.exlist))
+        self.assertEqual(2, len(self.exlist))
+        self.assertEqual(2, len(self.exlist.query_by_id('PEPTIDE')))
+        self.exlist.remove(messages[0])
+        self.assertEqual(0, len(self.exlist))
+        self.assertEqual([], self.exlist.query_by_id('PEPTIDE'))
 
     def test_remove(self):
         self.exlist.remove(messages[0])
@@ -265,20 +323,208 @@ class TestExclusionList(unittest.TestCase):
 
 
     def test_save_load(self):
+        pkl_path = temporary_path(self, 'tmp.pkl')
         self.exlist.add(messages[0])
         self.assertEqual(1, len(self.exlist))
-        self.exlist.save("tmp.pkl")
+        self.exlist.save(pkl_path)
         self.exlist.clear()
-        self.exlist.load("tmp.pkl")
+        self.exlist.load(pkl_path)
         self.assertEqual(1, len(self.exlist))
         self.assertTrue(
             self.exlist.is_excluded(ExclusionPoint(charge=1, mass=1000.5, rt=1000.5, ook0=None, intensity=1000.5)))
 
+    def test_save_load_shares_ids(self):
+        pkl_path = temporary_path(self, 'tmp.pkl')
+        self.exlist.bulk_add(random_intervals(100))
+        self.exlist.save(pkl_path)
+        self.exlist.clear()
+        self.exlist.load(pkl_path)
+        ids = {}
+        for interval in self.exlist:
+            self.assertIs(ids.setdefault(interval.id, interval.id), interval.id)
+        self.assertEqual(10, len(ids))
+
+    def test_save_load_columnar(self):
+        col_path = temporary_path(self, 'tmp.col')
+        intervals = random_intervals(100)
+        self.exlist.bulk_add(intervals)
+        self.exlist.save_columnar(col_path)
+        stats = self.exlist.stats()
+        self.exlist.clear()
+        self.exlist.load(col_path)
+        self.assertEqual(sorted(map(interval_key, intervals)), sorted(map(interval_key, self.exlist)))
+        self.assertEqual(stats['charges'], self.exlist.stats()['charges'])
+        self.assertEqual(stats['mass_histogram'], self.exlist.stats()['mass_histogram'])
+
+        self.exlist.add(messages[0])
+        self.assertEqual(101, len(self.exlist))
+        self.assertEqual([messages[0]], self.exlist.query_by_id('PEPTIDE'))
+
+        exlist = ColumnarExclusionList()
+        exlist.load(col_path)
+        self.assertEqual(sorted(map(interval_key, intervals)), sorted(map(interval_key, exlist)))
+
+    def test_snapshot_save(self):
+        pkl_path = temporary_path(self, 'tmp.pkl')
+        col_path = temporary_path(self, 'tmp.col')
+        intervals = random_intervals(100)
+        self.exlist.bulk_add(intervals)
+        for file_path, columnar in [(pkl_path, False), (col_path, True)]:
+            write = self.exlist.snapshot_save(file_path, columnar=columnar)
+            self.exlist.add(messages[0])
+            self.exlist.remove(ExclusionInterval('ID_3', None, *[-1e9, 1e9] * 4))
+            write()
+            self.exlist.load(file_path)
+            self.assertEqual(sorted(map(interval_key, intervals)), sorted(map(interval_key, self.exlist)))
+
+    def test_merge_intervals(self):
+        intervals = random_intervals(100)
+        unbounded = replace(intervals[99], id='UNBOUNDED', min_ook0=None, max_ook0=None)
+        self.exlist.bulk_add(intervals[:60])
+        merged = intervals[40:] + [copy(interval) for interval in intervals[80:90]] + [unbounded, copy(unbounded)]
+        self.assertEqual(intervals[60:] + [unbounded], self.exlist.deduplicate(merged))
+        self.assertEqual(41, self.exlist.merge_intervals(merged))
+        self.assertEqual(101, len(self.exlist))
+        self.assertEqual(sorted(map(interval_key, intervals)),
+                         sorted(interval_key(interval) for interval in self.exlist if interval.id != 'UNBOUNDED'))
+        self.assertEqual(0, self.exlist.merge_intervals(merged))
+        self.assertEqual(0, self.exlist.merge_intervals([]))
+
     def test_query_by_id(self):
         self.exlist.add(messages[0])
         self.assertEqual(1, len(self.exlist))
         self.assertEqual(messages[0], self.exlist.query_by_id('PEPTIDE')[0])
 
+    def test_query_by_points(self):
+        for interval in random_intervals(300):
+            self.exlist.add(interval)
+        points = random_points(100) + [ExclusionPoint(charge=1, mass=None, rt=50, ook0=None, intensity=None)]
+
+        batch = self.exlist.query_by_points(points)
+        self.assertEqual(len(points), len(batch))
+        for point, intervals in zip(points, batch):
+            self.assertEqual(sorted(map(interval_key, self.exlist.query_by_point(point))),
+                             sorted(map(interval_key, intervals)))
+        self.assertEqual([self.exlist.is_excluded(point) for point in points], self.exlist.is_excluded_batch(points))
+        self.assertEqual([], self.exlist.is_excluded_batch([]))
+
+    def test_query_by_sparse_points(self):
+        intervals = random_intervals(300)
+        for interval in intervals:
+            self.exlist.add(interval)
+        for interval in intervals[::3]:
+            self.exlist.remove(interval)
+        for points in (random_points(3), random_points(3)[:1]):  # sparse batches are queried point by point
+            batch = self.exlist.query_by_points(points)
+            for point, intervals in zip(points, batch):
+                self.assertEqual(sorted(map(interval_key, self.exlist.query_by_point(point))),
+                                 sorted(map(interval_key, intervals)))
+            self.assertEqual([self.exlist.is_excluded(point) for point in points],
+                             self.exlist.is_excluded_batch(points))
+
+    def test_query_partial_points(self):
+        intervals = random_intervals(300)
+        self.exlist.bulk_add(intervals)
+        self.exlist.remove(intervals[0])
+        points = [replace(point, mass=None) for point in random_points(50)] + \
+                 [replace(point, mass=None, rt=None) for point in random_points(50, seed=2)]
+        for point in points:
+            self.assertEqual(sorted(interval_key(interval) for interval in intervals[1:] if point.is_bounded_by(interval)),
+                             sorted(map(interval_key, self.exlist.query_by_point(point))))
+
+    def test_statistics(self):
+        intervals = random_intervals(200)
+        self.exlist.bulk_add(intervals)
+        self.exlist.remove(ExclusionInterval('ID_3', None, *[-1e9, 1e9] * 4))
+        if isinstance(self.exlist, SnapshotExclusionList):
+            self.exlist.merge()
+
+        expected = IntervalStatistics()
+        for interval in self.exlist:
+            expected.add(interval)
+        stats = self.exlist.stats()
+        self.assertEqual(180, sum(stats['charges'].values()))
+        for key, value in expected.stats().items():
+            if key == 'avg_widths':
+                for dim, width in value.items():
+                    self.assertAlmostEqual(width, stats[key][dim])
+            else:
+                self.assertEqual(value, stats[key])
+
+    def test_remove_duplicate_by_bounds(self):
+        self.exlist.add(messages[0])
+        self.exlist.add(deepcopy(messages[0]))
+        self.exlist.add(messages[1])
+        self.assertEqual(3, len(self.exlist))
+        self.assertEqual(2, len(self.exlist.query_by_interval(messages[0])))
+
+        tmp_msg = deepcopy(messages[0])
+        tmp_msg.id = None
+        self.assertEqual(2, self.exlist.remove(tmp_msg))
+        self.assertEqual(1, len(self.exlist))
+        self.assertEqual([messages[1]], self.exlist.query_by_id('PEPTIDE'))
+
+    def test_bulk_remove(self):
+        intervals = random_intervals(100)
+        self.exlist.bulk_add(intervals)
+        self.assertEqual(10, self.exlist.bulk_remove(intervals[:10]))
+        self.assertEqual(90, len(self.exlist))
+        self.assertEqual(0, self.exlist.bulk_remove([]))
+
+    def test_remove_many_by_id(self):
+        intervals = random_intervals(200)
+        for interval in intervals:
+            self.exlist.add(interval)
+        self.assertEqual(20, len(self.exlist.query_by_id('ID_3')))
+        self.assertEqual(20, self.exlist.remove(ExclusionInterval('ID_3', None, *[-1e9, 1e9] * 4)))
+        self.assertEqual(180, len(self.exlist))
+        self.assertEqual([], self.exlist.query_by_id('ID_3'))
+
+        keep = [interval for interval in intervals if interval.id == 'ID_4']
+        for id in {interval.id for interval in intervals} - {'ID_4', 'ID_3'}:
+            self.exlist.remove(ExclusionInterval(id, None, *[-1e9, 1e9] * 4))
+        self.assertEqual(sorted(map(interval_key, keep)), sorted(map(interval_key, self.exlist)))
+        self.assertTrue(all(self.exlist.is_excluded(ExclusionPoint(interval.charge, interval.min_mass,
+                                                                   interval.min_rt, interval.min_ook0, 100))
+                            for interval in keep))
+
+    def test_bulk_add(self):
+        intervals = random_intervals(300)
+        self.exlist.add(intervals[0])
+        self.exlist.bulk_add(intervals[1:200])
+        self.exlist.bulk_add(intervals[200:210])
+        self.exlist.bulk_add(intervals[210:])
+        self.exlist.bulk_add([])
+        self.assertEqual(300, len(self.exlist))
+
+        reference = ColumnarExclusionList.from_intervals(intervals)
+        points = random_points(100)
+        self.assertEqual(reference.is_excluded_batch(points), self.exlist.is_excluded_batch(points))
+        self.assertEqual(30, len(self.exlist.query_by_id('ID_3')))
+        self.assertEqual(30, self.exlist.remove(ExclusionInterval('ID_3', None, *[-1e9, 1e9] * 4)))
+        self.assertEqual(270, len(self.exlist))
+
+    def test_iter_chunks(self):
+        intervals = random_intervals(50)
+        self.exlist.bulk_add(intervals)
+        self.exlist.remove(ExclusionInterval('ID_3', None, *[-1e9, 1e9] * 4))
+        chunks = list(self.exlist.iter_chunks(8))
+        self.assertTrue(all(1 <= len(chunk) <= 8 for chunk in chunks))
+        self.assertEqual(sorted(map(interval_key, self.exlist)),
+                         sorted(interval_key(interval) for chunk in chunks for interval in chunk))
+        self.assertEqual(45, sum(map(len, chunks)))
+
+    def test_iter_chunks_with_writes(self):
+        intervals = random_intervals(50)
+        self.exlist.bulk_add(intervals[:40])
+        exported = []
+        for chunk in self.exlist.iter_chunks(8):  # writes between chunks must not break the iteration
+            exported.extend(chunk)
+            self.exlist.add(intervals[40 + len(exported) // 8])
+            self.exlist.remove(ExclusionInterval('ID_9', None, *[-1e9, 1e9] * 4))
+        kept = [interval_key(interval) for interval in intervals[:40] if interval.id != 'ID_9']
+        self.assertTrue(set(kept) <= set(map(interval_key, exported)))
+
     def test_exclusion_interval_equality(self):
         self.assertEqual(messages[0], messages[0])
         self.assertNotEqual(messages[0], messages[1])
@@ -290,5 +536,952 @@ class TestExclusionList(unittest.TestCase):
                          ExclusionPoint(charge=2, mass=1000.5, rt=1000.5, ook0=None, intensity=1000.5))
 
 
+class RemoveFile:
+    def __init__(self, path):
+        self.path = path
+
+    def __reduce__(self):
+        return os.remove, (self.path,)
+
+
+class TestSaveUnpickler(unittest.TestCase):
+
+    def test_rejects_code(self):
+        sentinel = temporary_path(self, 'sentinel')
+        open(sentinel, 'w').close()
+        pkl_path = temporary_path(self, 'tmp.pkl')
+        with open(pkl_path, 'wb') as file:
+            pickle.dump([RemoveFile(sentinel)], file)
+        for exlist in [ExclusionList(), ColumnarExclusionList(), RTreeExclusionList()]:
+            with self.assertRaises(pickle.UnpicklingError):
+                exlist.load(pkl_path)
+        self.assertTrue(os.path.exists(sentinel))
+
+
+class TestColumnFile(unittest.TestCase):
+
+    def test_write_read(self):
+        col_path = temporary_path(self, 'tmp.col')
+        interval = replace(messages[0], charge=None, min_rt=None)
+        ColumnFile.from_intervals([interval, messages[1]]).write(col_path)
+        column_file = ColumnFile.read(col_path)
+        self.assertEqual([interval, messages[1]], column_file.intervals())
+        self.assertEqual(['PEPTIDE'], column_file.ids)
+        self.assertFalse(column_file.sorted)
+        self.assertFalse(column_file.charge.flags.writeable)
+
+    def test_check_truncated(self):
+        col_path = temporary_path(self, 'tmp.col')
+        ColumnFile.from_intervals(messages).write(col_path)
+        ColumnFile.check(col_path)
+        with open(col_path, "r+b") as file:
+            file.truncate(os.path.getsize(col_path) - 8)
+        with self.assertRaises(Exception):
+            ColumnFile.check(col_path)
+        with self.assertRaises(Exception):
+            ColumnFile.read(col_path)
+
+    def test_read_pickle(self):
+        col_path = temporary_path(self, 'tmp.col')
+        with open(col_path, "wb") as file:
+            pickle.dump(messages, file)
+        with self.assertRaises(Exception):
+            ColumnFile.read(col_path)
+
+
+class TestExport(unittest.TestCase):
+
+    def test_ndjson(self):
+        interval = replace(messages[0], charge=None, min_rt=None)
+        chunks = list(iter_ndjson([interval] * 5, chunk_size=2))
+        self.assertEqual(3, len(chunks))
+        rows = [json.loads(line) for line in b''.join(chunks).splitlines()]
+        self.assertEqual([ExclusionInterval(**row) for row in rows], [interval] * 5)
+
+    def test_csv(self):
+        self.assertEqual(1, len(list(iter_csv([]))))
+        lines = b''.join(iter_csv(messages, chunk_size=1)).decode('utf-8').splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertEqual('PEPTIDE,1,1000,1001,1000,1002,1000,1001,1000,1001', lines[2])
+
+    def test_parse_intervals(self):
+        interval = replace(messages[0], charge=None, min_rt=None)
+        rows = [json.loads(line) for line in b''.join(iter_ndjson([interval, messages[1]])).splitlines()]
+        self.assertEqual([interval, messages[1]], parse_intervals(rows))
+        columns = {'id': ['A', 'B'], 'charge': [1, None], 'min_mass': [1.0, 2.0], 'max_mass': [3.0, 4.0]}
+        self.assertEqual([ExclusionInterval('A', 1, 1.0, 3.0, *[None] * 6), ExclusionInterval('B', None, 2.0, 4.0,
+                                                                                               *[None] * 6)],
+                         parse_intervals(columns))
+        self.assertEqual([], parse_intervals({}))
+        for invalid in [{'id': ['A'], 'charge': [1, 2]}, {'mass': [1.0]}, [1, 2], 'A', {'min_mass': ['x']},
+                        {'id': [1]}, [{'id': 'A', 'max_rt': 'x'}], {'charge': [True]}]:
+            with self.assertRaises(Exception):
+                parse_intervals(invalid)
+
+    def test_parse_points(self):
+        points = random_points(10)
+        columns = {col: [getattr(point, col) for point in points] for col in ('charge', 'mass', 'rt', 'ook0')}
+        self.assertEqual([replace(point, intensity=None) for point in points], parse_points(columns))
+        for invalid in [{'mass': [1.0], 'rt': [1.0, 2.0]}, {'min_mass': [1.0]}, [1.0], {'mass': ['x']},
+                        {'mass': 1.0}, {'charge': [1.5]}, {'rt': [True]}, {'ook0': [[1.0]]}]:
+            with self.assertRaises(Exception):
+                parse_points(invalid)
+
+    def test_pack_flags(self):
+        flags = [i % 3 == 0 for i in range(21)]
+        self.assertEqual(3, len(pack_flags(flags)))
+        self.assertEqual(b'\x09', pack_flags([True, False, False, True]))
+        self.assertEqual(flags, unpack_flags(pack_flags(flags), 21))
+        with self.assertRaises(Exception):
+            unpack_flags(pack_flags(flags), 25)
+
+    def test_compressed(self):
+        chunks = list(iter_ndjson(random_intervals(1000)))
+        self.assertEqual(b''.join(chunks), gzip.decompress(b''.join(iter_compressed(chunks, 'gzip'))))
+        self.assertEqual(b''.join(chunks), lzma.decompress(b''.join(iter_compressed(chunks, 'lzma'))))
+        self.assertEqual(chunks, list(iter_compressed(chunks, 'none')))
+
+
+class TestPointsEncoding(unittest.TestCase):
+
+    def test_encode_decode(self):
+        points = [ExclusionPoint(charge=2, mass=1000.123456789, rt=12.5, ook0=None, intensity=1024.0),
+                  ExclusionPoint(charge=None, mass=None, rt=None, ook0=0.75, intensity=None)]
+        self.assertEqual(21, POINT_RECORD.itemsize)
+        self.assertEqual(points, decode_points(encode_points(points)))
+        self.assertEqual(points, decode_points(encode_points(points, header=False)))
+        self.assertEqual([], decode_points(encode_points([])))
+
+    def test_float32(self):
+        point = ExclusionPoint(charge=1, mass=1000.1, rt=0.1, ook0=0.1, intensity=0.1)
+        decoded = decode_points(encode_points([point]))[0]
+        self.assertEqual(1000.1, decoded.mass)
+        self.assertAlmostEqual(0.1, decoded.rt, places=6)
+
+    def test_invalid(self):
+        data = encode_points(random_points(3))
+        for invalid in [data[:-1], data[:10], encode_points(random_points(3), header=False)[:-1]]:
+            with self.assertRaises(Exception):
+                decode_points(invalid)
+
+
+class TestSaveQueue(unittest.TestCase):
+
+    def test_submit(self):
+        queue = SaveQueue(max_jobs=2)
+        order = []
+        jobs = [queue.submit(f'file_{i}', lambda i=i: order.append(i)) for i in range(3)]
+        jobs[-1].future.result()
+        self.assertEqual([0, 1, 2], order)
+        self.assertEqual(['done'] * 3, [job.status for job in jobs])
+        self.assertIsNone(queue.get(jobs[0].id))
+        self.assertEqual('file_2', queue.get(jobs[2].id).stats()['file_path'])
+
+    def test_submit_read(self):
+        queue = SaveQueue()
+        release = Event()
+        order = []
+        queue.submit('file_a', lambda: release.wait(10) and order.append('write a'))
+        # a read of another file does not wait for the blocked write
+        self.assertEqual('b', queue.submit_read('file_b', lambda: 'b').result(timeout=10))
+        read = queue.submit_read('file_a', lambda: order.append('read a'))
+        time.sleep(0.05)
+        self.assertEqual([], order)
+        release.set()
+        read.result(timeout=10)
+        self.assertEqual(['write a', 'read a'], order)
+
+    def test_failed(self):
+        queue = SaveQueue()
+        job = queue.submit('file', lambda: 1 / 0)
+        with self.assertRaises(ZeroDivisionError):
+            job.future.result()
+        self.assertEqual('failed', job.status)
+        self.assertEqual('division by zero', job.error)
+
+
+class TestSavedListCache(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.intervals = random_intervals(100)
+        self.reference = ColumnarExclusionList.from_intervals(self.intervals)
+
+    def assert_same_points(self, exclusion_list):
+        points = random_points(100)
+        self.assertEqual(self.reference.is_excluded_batch(points), exclusion_list.is_excluded_batch(points))
+
+    def test_read_only(self):
+        col_path = temporary_path(self, 'tmp.col')
+        self.reference.save_columnar(col_path)
+        exclusion_list = ColumnarExclusionList.read_only(col_path)
+        self.assertFalse(exclusion_list.charge.flags.writeable)
+        self.assert_same_points(exclusion_list)
+
+    def test_get(self):
+        pkl_path = temporary_path(self, 'tmp.pkl')
+        col_path = temporary_path(self, 'tmp.col')
+        cache = SavedListCache(max_size=1)
+        self.reference.save_columnar(col_path)
+        self.reference.save(pkl_path)
+        exclusion_list = cache.get(col_path)
+        self.assertIs(exclusion_list, cache.get(col_path))
+        self.assert_same_points(cache.get(pkl_path))
+        self.assertEqual([pkl_path], cache.stats()['open_lists'])
+        self.assertIsNot(exclusion_list, cache.get(col_path))
+        self.assertEqual((1, 3), (cache.hits, cache.misses))
+
+    def test_reopen_changed(self):
+        col_path = temporary_path(self, 'tmp.col')
+        cache = SavedListCache()
+        exclusion_list = DeltaExclusionList(ColumnarExclusionList())
+        exclusion_list.bulk_add(self.intervals[:90])
+        exclusion_list.save_columnar(col_path)
+        self.assertEqual(90, len(cache.get(col_path)))
+        exclusion_list.bulk_add(self.intervals[90:])
+        exclusion_list.save_columnar(col_path)
+        self.assertEqual(1, len(delta_paths(col_path)))
+        self.assert_same_points(cache.get(col_path))
+        self.assertEqual(2, cache.misses)
+
+    def test_cached(self):
+        cache = SavedListCache()
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'list.col')
+            self.reference.save_columnar(path)
+            past = time.time_ns() - 10_000_000_000
+            os.utime(folder, ns=(past, past))  # recent folder changes are not trusted, see _quick_state
+            self.assertIsNone(cache.cached(path))
+            exclusion_list = cache.get(path)
+            self.assertIs(exclusion_list, cache.cached(path))
+
+            self.reference.save_columnar(os.path.join(folder, 'other.col'))  # changes the folder, not the list
+            self.assertIs(exclusion_list, cache.cached(path))
+            with open(f'{path}.000001.delta', 'wb'):
+                pass
+            self.assertIsNone(cache.cached(path))
+            self.assertEqual((2, 1), (cache.hits, cache.misses))
+
+
+class TestIntervalStatistics(unittest.TestCase):
+
+    def test_add_remove(self):
+        statistics = IntervalStatistics()
+        interval = replace(messages[0], id='UID_1')
+        unbounded = replace(messages[1], id='UID_2', charge=None)
+        unbounded.min_rt, unbounded.max_rt = None, None
+        unbounded.convert_none()
+        statistics.add(interval)
+        statistics.add(unbounded)
+
+        stats = statistics.stats()
+        self.assertEqual({'1': 1, 'None': 1}, stats['charges'])
+        self.assertEqual({'UID': 2}, stats['id_prefixes'])
+        self.assertEqual({1000.0: 2}, stats['mass_histogram'])
+        self.assertEqual({960.0: 1}, stats['rt_histogram'])
+        self.assertEqual({'mass': 1.0, 'rt': 1.0, 'ook0': 1.0, 'intensity': 1.0}, stats['avg_widths'])
+        self.assertEqual({'mass': 0, 'rt': 1, 'ook0': 0, 'intensity': 0}, stats['unbounded'])
+
+        combined = IntervalStatistics.combine([statistics, statistics])
+        self.assertEqual({'UID': 4}, combined.stats()['id_prefixes'])
+        self.assertEqual(2 * statistics.memory_bytes, combined.memory_bytes)
+
+        statistics.remove(interval)
+        statistics.remove(unbounded)
+        self.assertEqual(IntervalStatistics().stats(), statistics.stats())
+
+    def test_add_intervals(self):
+        intervals = random_intervals(200) + [replace(messages[0], charge=None, min_rt=None, max_intensity=None)]
+        statistics, reference = IntervalStatistics(), IntervalStatistics()
+        statistics.add_intervals(intervals)
+        for interval in intervals:
+            reference.add(interval)
+        self.assertEqual(reference.stats().keys(), statistics.stats().keys())
+        for key, value in reference.stats().items():
+            if key == 'avg_widths':
+                for dim, width in value.items():
+                    self.assertAlmostEqual(width, statistics.stats()[key][dim])
+            else:
+                self.assertEqual(value, statistics.stats()[key])
+
+
+class TestMassIntervalTreeIndexes(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.exlist = ExclusionList()
+
+    def test_plan(self):
+        # wide ook0 ranges and narrow rt ranges, so rt is the more selective dimension
+        self.exlist.bulk_add([replace(interval, min_ook0=0, max_ook0=10) for interval in random_intervals(100)])
+        point = ExclusionPoint(charge=None, mass=550, rt=50, ook0=1, intensity=None)
+        self.assertEqual(('mass', 550), self.exlist._plan(point))
+        self.assertEqual({'mass'}, set(self.exlist.indexes))
+        self.assertEqual(('rt', 50), self.exlist._plan(replace(point, mass=None)))
+        self.assertEqual(('ook0', 1), self.exlist._plan(replace(point, mass=None, rt=None)))
+        self.assertIsNone(self.exlist._plan(replace(point, mass=None, rt=None, ook0=None)))
+
+    def test_lazy_indexes(self):
+        intervals = random_intervals(100)
+        self.exlist.bulk_add(intervals[:50])
+        self.assertEqual({'mass'}, set(self.exlist.indexes))
+        self.assertIsNone(self.exlist.indexes['mass'].begins)
+        for point in random_points(20):
+            point = replace(point, mass=None)
+            self.assertEqual(sorted(map(interval_key, filter(point.is_bounded_by, self.exlist))),
+                             sorted(map(interval_key, self.exlist.query_by_point(point))))
+        self.assertEqual({'mass', 'rt', 'ook0'}, set(self.exlist.indexes))
+
+        # built indexes are kept up to date
+        self.exlist.bulk_add(intervals[50:])
+        for interval in intervals[::3]:
+            self.exlist.add(interval)
+        self.exlist.remove(ExclusionInterval('ID_3', None, *[-1e9, 1e9] * 4))
+        self.exlist.is_excluded_batch(random_points(100))
+        self.assertEqual(len(self.exlist), len(self.exlist.indexes['mass'].begins))
+        for point in random_points(50):
+            point = replace(point, mass=None)
+            self.assertEqual(sorted(map(interval_key, filter(point.is_bounded_by, self.exlist))),
+                             sorted(map(interval_key, self.exlist.query_by_point(point))))
+
+    def test_unindexed_bounds(self):
+        interval = replace(messages[0], min_rt=1000, max_rt=1000)
+        self.exlist.add(interval)
+        self.assertEqual([interval], self.exlist.query_by_point(ExclusionPoint(charge=1, mass=None, rt=None,
+                                                                               ook0=1000.5, intensity=None)))
+        self.assertEqual({0: None}, self.exlist._index('rt').unindexed)
+        self.exlist.remove(interval)
+        self.assertEqual({}, self.exlist.indexes['rt'].unindexed)
+        self.assertEqual(0, self.exlist.indexes['ook0'].count(1000.5))
+
+
+class TestColumnarExclusionList(TestExclusionList):
+
+    def setUp(self) -> None:
+        self.exlist = ColumnarExclusionList(merge_threshold=8)
+
+    def test_matches_interval_tree(self):
+        reference = ExclusionList()
+        intervals = random_intervals(500)
+        for interval in intervals:
+            reference.add(interval)
+            self.exlist.add(interval)
+
+        for interval in intervals[::7]:
+            self.assertEqual(reference.remove(interval), self.exlist.remove(interval))
+        self.assertEqual(len(reference), len(self.exlist))
+
+        for point in random_points(200):
+            self.assertEqual(sorted(map(interval_key, reference.query_by_point(point))),
+                             sorted(map(interval_key, self.exlist.query_by_point(point))))
+            self.assertEqual(reference.is_excluded(point), self.exlist.is_excluded(point))
+
+        self.assertEqual(sorted(map(interval_key, reference.query_by_id('ID_3'))),
+                         sorted(map(interval_key, self.exlist.query_by_id('ID_3'))))
+
+    def test_none_bounds_round_trip(self):
+        # None bounds are stored as NaN
+        exlist = ColumnarExclusionList(merge_threshold=8)
+        interval = replace(messages[0], min_intensity=None, max_intensity=None)
+        exlist.add(interval)
+        self.assertEqual([interval], exlist.query_by_point(ExclusionPoint(charge=1, mass=1000.5, rt=1000.5,
+                                                                          ook0=1000.5, intensity=5000)))
+        self.assertEqual([interval], exlist.query_by_id('PEPTIDE'))
+        unbounded = replace(interval, min_intensity=-math.inf, max_intensity=math.inf)
+        self.assertEqual([interval], exlist.query_by_interval(unbounded))
+        self.assertEqual([], exlist.query_by_interval(replace(interval, min_intensity=0, max_intensity=math.inf)))
+        self.assertEqual(1, exlist.remove(unbounded))
+
+    def test_open_mass(self):
+        exlist = ColumnarExclusionList(merge_threshold=8)
+        exlist.add(replace(messages[0], id='BOUNDED'))
+        open_intervals = [replace(messages[0], id='OPEN_MIN', min_mass=None),
+                          replace(messages[0], id='OPEN_BOTH', min_mass=None, max_mass=None)]
+        open_intervals[1].convert_none()
+        for interval in open_intervals:
+            exlist.add(interval)
+        for i in range(10):  # past merge_threshold
+            exlist.add(replace(messages[0], id=f'OTHER_{i}', min_mass=2000 + i, max_mass=2001 + i))
+
+        self.assertEqual(1.0, exlist._max_mass_width)
+        point = ExclusionPoint(charge=1, mass=500, rt=1000.5, ook0=1000.5, intensity=1000.5)
+        self.assertEqual({'OPEN_MIN', 'OPEN_BOTH'}, {interval.id for interval in exlist.query_by_point(point)})
+        point = ExclusionPoint(charge=1, mass=1000.5, rt=1000.5, ook0=1000.5, intensity=1000.5)
+        self.assertEqual({'BOUNDED', 'OPEN_MIN', 'OPEN_BOTH'},
+                         {interval.id for interval in exlist.query_by_point(point)})
+        self.assertEqual([open_intervals[0]], exlist.query_by_id('OPEN_MIN'))
+
+    def test_none_min_mass_by_bounds(self):
+        exlist = ColumnarExclusionList(merge_threshold=8)
+        interval = replace(messages[0], id='OPEN_MIN', min_mass=None)
+        exlist.add(interval)
+        exlist.add(replace(messages[0], id='BOUNDED'))
+        for low in [None, -math.inf]:
+            query = ExclusionInterval(None, None, low, 2000, *[-math.inf, math.inf] * 3)
+            for merged in [False, True]:
+                if merged:
+                    exlist._merge()
+                self.assertEqual({'OPEN_MIN', 'BOUNDED'}, {i.id for i in exlist.query_by_interval(query)})
+                self.assertEqual({'BOUNDED'}, {i.id for i in exlist.query_by_interval(replace(query, min_mass=0))})
+        exlist._merge()
+        self.assertEqual(2, exlist.remove(ExclusionInterval(None, None, -math.inf, 2000, *[-math.inf, math.inf] * 3)))
+        self.assertEqual(0, len(exlist))
+
+
+class TestRTreeExclusionList(TestColumnarExclusionList):
+
+    def setUp(self) -> None:
+        self.exlist = RTreeExclusionList()
+
+    def test_none_bounds(self):
+        interval = replace(messages[0], min_rt=None, max_intensity=None)
+        self.exlist.add(interval)
+        self.assertEqual([interval], self.exlist.query_by_point(ExclusionPoint(charge=1, mass=1000.5, rt=-5,
+                                                                               ook0=1000.5, intensity=1e12)))
+        self.assertTrue(self.exlist.is_excluded(ExclusionPoint(charge=None, mass=1000.5, rt=1000.5, ook0=None,
+                                                               intensity=1000.5)))
+        self.assertFalse(self.exlist.is_excluded(ExclusionPoint(charge=1, mass=1000.5, rt=1001, ook0=1000.5,
+                                                                intensity=1000.5)))
+        self.assertEqual(1, self.exlist.remove(replace(interval, id=None)))
+
+
+class TestChargePartitionedExclusionList(TestColumnarExclusionList):
+
+    def setUp(self) -> None:
+        self.exlist = ChargePartitionedExclusionList(lambda: ColumnarExclusionList(merge_threshold=8))
+
+    def test_partitions(self):
+        wildcard = deepcopy(messages[0])
+        wildcard.charge = None
+        self.exlist.add(messages[0])
+        self.exlist.add(wildcard)
+        self.assertEqual({1, None}, set(self.exlist.partitions))
+        self.assertEqual(2, len(self.exlist.query_by_point(ExclusionPoint(1, 1000.5, 1000.5, 1000.5, 1000.5))))
+        self.assertEqual([wildcard], self.exlist.query_by_point(ExclusionPoint(2, 1000.5, 1000.5, 1000.5, 1000.5)))
+
+    def test_load_interval_tree(self):
+        pkl_path = temporary_path(self, 'tmp.pkl')
+        exlist = ExclusionList()
+        exlist.add(messages[0])
+        exlist.save(pkl_path)
+        self.exlist.load(pkl_path)
+        self.assertEqual([messages[0]], self.exlist.query_by_id('PEPTIDE'))
+
+
+class TestRTWindowExclusionList(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.exlist = RTWindowExclusionList(ColumnarExclusionList())
+
+    def test_advance(self):
+        self.exlist.add(messages[0])
+        self.exlist.add(messages[1])
+        self.assertEqual(0, self.exlist.advance(1000.5))
+        self.assertEqual(1, self.exlist.advance(1001))
+        self.assertEqual([messages[1]], self.exlist.query_by_id('PEPTIDE'))
+        self.assertEqual(0, self.exlist.advance(1000))
+        self.assertEqual(1001, self.exlist.current_rt)
+        self.assertEqual(1, self.exlist.advance(1002))
+        self.assertEqual(0, len(self.exlist))
+
+    def test_add_expired(self):
+        self.exlist.advance(1001)
+        self.exlist.add(messages[0])
+        self.assertEqual(0, len(self.exlist))
+        self.exlist.add(messages[1])
+        self.assertEqual(1, len(self.exlist))
+
+    def test_archive(self):
+        self.exlist = RTWindowExclusionList(ColumnarExclusionList(), archive=ColumnarExclusionList())
+        self.exlist.add(messages[0])
+        self.exlist.add(messages[0])
+        self.assertEqual(2, self.exlist.advance(1001))
+        self.assertEqual(2, len(self.exlist.archive))
+
+    def test_merge_intervals(self):
+        self.exlist.add(messages[0])
+        self.assertEqual(1, self.exlist.merge_intervals([messages[0], messages[1], messages[1]]))
+        self.assertEqual(2, len(self.exlist))
+        self.assertEqual(1, self.exlist.advance(1001))  # merged intervals expire as well
+
+    def test_iter_chunks_releases_lock(self):
+        self.exlist.bulk_add(random_intervals(20))
+        chunks = self.exlist.iter_chunks(8)
+        next(chunks)
+        self.assertFalse(self.exlist._lock.locked())
+        self.assertEqual(12, sum(map(len, chunks)))
+
+    def test_auto_advance(self):
+        self.exlist.auto_advance = True
+        self.exlist.add(messages[0])
+        self.assertTrue(self.exlist.is_excluded(ExclusionPoint(charge=1, mass=1000.5, rt=1000.5, ook0=1000.5,
+                                                               intensity=1000.5)))
+        self.assertFalse(self.exlist.is_excluded(ExclusionPoint(charge=1, mass=1000.5, rt=1001, ook0=1000.5,
+                                                                intensity=1000.5)))
+        self.assertEqual(0, len(self.exlist))
+
+    def test_removed_interval_expires(self):
+        self.exlist.add(messages[0])
+        self.exlist.remove(messages[0])
+        self.assertEqual(0, self.exlist.advance(1001))
+
+
+class TestOccupancyFilteredExclusionList(TestColumnarExclusionList):
+
+    def setUp(self) -> None:
+        self.exlist = OccupancyFilteredExclusionList(ColumnarExclusionList(merge_threshold=8), mass_bin_width=0.5,
+                                                     rt_bin_width=10)
+
+    def test_filtered(self):
+        self.exlist.add(messages[0])
+        self.assertFalse(self.exlist.is_excluded(ExclusionPoint(charge=1, mass=1500, rt=1000.5, ook0=1000.5,
+                                                                intensity=1000.5)))
+        self.assertFalse(self.exlist.is_excluded(ExclusionPoint(charge=2, mass=1000.5, rt=1000.5, ook0=1000.5,
+                                                                intensity=1000.5)))
+        self.assertEqual(2, self.exlist.filtered)
+        self.assertTrue(self.exlist.is_excluded(ExclusionPoint(charge=1, mass=1000.5, rt=1000.5, ook0=1000.5,
+                                                               intensity=1000.5)))
+        self.assertEqual(2, self.exlist.filtered)
+
+        self.exlist.remove(messages[0])
+        self.assertEqual({}, self.exlist.grid.cells)
+        self.assertFalse(self.exlist.is_excluded(ExclusionPoint(charge=1, mass=1000.5, rt=1000.5, ook0=1000.5,
+                                                                intensity=1000.5)))
+        self.assertEqual(3, self.exlist.filtered)
+
+    def test_overflow(self):
+        interval = deepcopy(messages[0])
+        interval.min_mass, interval.max_mass = None, None
+        interval.convert_none()
+        self.exlist.add(interval)
+        self.assertEqual({1: 1}, self.exlist.grid.overflow)
+        self.assertTrue(self.exlist.is_excluded(ExclusionPoint(charge=1, mass=5000, rt=1000.5, ook0=1000.5,
+                                                               intensity=1000.5)))
+
+    def test_overflow_open_rt(self):
+        # convert_none rt bounds span more bins than len() of a range can count
+        interval = replace(messages[0], min_rt=None, max_rt=None)
+        interval.convert_none()
+        self.exlist.add(interval)
+        self.assertEqual({1: 1}, self.exlist.grid.overflow)
+        self.assertEqual({}, self.exlist.grid.cells)
+        self.assertTrue(self.exlist.is_excluded(ExclusionPoint(charge=1, mass=1000.5, rt=1e9, ook0=1000.5,
+                                                               intensity=1000.5)))
+        self.assertEqual(1, self.exlist.remove(interval))
+        self.assertEqual({}, self.exlist.grid.overflow)
+
+
+class TestCachedExclusionList(TestColumnarExclusionList):
+
+    def setUp(self) -> None:
+        self.exlist = CachedExclusionList(ColumnarExclusionList(merge_threshold=8), max_size=16)
+
+    def test_cache_hits(self):
+        point = ExclusionPoint(charge=1, mass=1000.5, rt=1000.5, ook0=1000.5, intensity=1000.5)
+        self.exlist.add(messages[0])
+        self.assertTrue(self.exlist.is_excluded(point))
+        self.assertTrue(self.exlist.is_excluded(point))
+        self.assertEqual([messages[0]], self.exlist.query_by_point(point))
+        self.assertEqual({'cache_hits': 1, 'cache_misses': 2},
+                         {k: v for k, v in self.exlist.stats().items() if k in ('cache_hits', 'cache_misses')})
+
+        self.exlist.remove(messages[0])
+        self.assertFalse(self.exlist.is_excluded(point))
+        self.assertEqual([], self.exlist.query_by_point(point))
+        self.assertEqual(4, self.exlist.misses)
+
+    def test_cache_lru(self):
+        points = random_points(32)
+        self.exlist.bulk_add(random_intervals(100))
+        expected = self.exlist.is_excluded_batch(points)
+        self.assertEqual(16, len(self.exlist._cache))
+        self.assertEqual(expected, self.exlist.is_excluded_batch(points))
+        self.assertEqual(16, self.exlist.hits)
+        self.assertEqual(48, self.exlist.misses)
+
+    def test_quantized_key(self):
+        self.exlist = CachedExclusionList(ColumnarExclusionList(), mass_ppm=10, rt_width=1, ook0_width=0.01)
+        self.exlist.add(messages[0])
+        self.assertTrue(self.exlist.is_excluded(ExclusionPoint(charge=1, mass=1000.502, rt=1000.5, ook0=1000.5,
+                                                               intensity=1000.5)))
+        self.assertTrue(self.exlist.is_excluded(ExclusionPoint(charge=1, mass=1000.503, rt=1000.6, ook0=1000.501,
+                                                               intensity=1000.5)))
+        self.assertEqual(1, self.exlist.hits)
+
+
+class TestCompactingExclusionList(TestColumnarExclusionList):
+
+    def setUp(self) -> None:
+        self.exlist = CompactingExclusionList(ColumnarExclusionList(merge_threshold=8), max_growth=0.5)
+
+    def add_psms(self):
+        psms = []
+        for i, offset in enumerate([0, 0.1, 0.2, 5]):
+            psm = deepcopy(messages[0])
+            psm.id = f'RUN_{i}'
+            psm.min_mass += offset
+            psm.max_mass += offset
+            psms.append(psm)
+            self.exlist.add(psm)
+        return psms
+
+    def test_compact(self):
+        psms = self.add_psms()
+        self.assertEqual(2, self.exlist.compact())
+        self.assertEqual(2, len(self.exlist))
+        self.assertEqual(0, self.exlist.compact())
+        self.assertEqual([psms[1]], self.exlist.query_by_id('RUN_1'))
+        self.assertEqual(1, len(self.exlist.query_by_id('RUN')))
+        self.assertTrue(self.exlist.is_excluded(ExclusionPoint(charge=1, mass=1001.1, rt=1000.5, ook0=1000.5,
+                                                               intensity=1000.5)))
+
+    def test_compact_open_bounds(self):
+        # the Kafka consumer leaves the intensity bounds None
+        psms = []
+        for i, offset in enumerate([0, 0.1, 0.2, 5]):
+            psm = replace(messages[0], id=f'RUN_{i}', min_mass=1000 + offset, max_mass=1001 + offset,
+                          min_intensity=None, max_intensity=None)
+            psms.append(psm)
+            self.exlist.add(psm)
+        wide = replace(psms[0], id='RUN_4', min_mass=999.5, max_mass=1002.5, min_rt=None)
+        self.exlist.add(wide)
+
+        self.assertEqual(3, self.exlist.compact())
+        self.assertEqual(2, len(self.exlist))
+        box = [interval for interval in self.exlist if interval.id == 'RUN'][0]
+        self.assertEqual((None, None, None, 1002.5), (box.min_intensity, box.max_intensity, box.min_rt, box.max_mass))
+        self.assertEqual([psms[1]], self.exlist.query_by_id('RUN_1'))
+        self.assertTrue(self.exlist.is_excluded(ExclusionPoint(charge=1, mass=1001.1, rt=1000.5, ook0=1000.5,
+                                                               intensity=None)))
+        self.assertEqual(1, self.exlist.remove(psms[2]))
+        self.assertEqual(4, len(self.exlist))
+
+    def test_compact_other_charge(self):
+        psms = self.add_psms()
+        psms[1].charge = 2
+        self.exlist.clear()
+        for psm in psms:
+            self.exlist.add(psm)
+        self.assertEqual(1, self.exlist.compact())
+
+    def test_merge_members(self):
+        psms = self.add_psms()
+        self.exlist.compact()
+        self.assertEqual(0, self.exlist.merge_intervals(psms))
+        self.assertEqual(2, len(self.exlist))
+
+    def test_remove_member(self):
+        psms = self.add_psms()
+        self.exlist.compact()
+        self.assertEqual(1, self.exlist.remove(psms[2]))
+        self.assertEqual(3, len(self.exlist))
+        self.assertEqual([], self.exlist.query_by_id('RUN_2'))
+        self.assertFalse(self.exlist.is_excluded(ExclusionPoint(charge=1, mass=1001.1, rt=1000.5, ook0=1000.5,
+                                                                intensity=1000.5)))
+        self.assertEqual(1, self.exlist.compact())
+        self.assertEqual(2, len(self.exlist))
+
+    def test_remove_by_bounds(self):
+        psms = self.add_psms()
+        self.exlist.compact()
+        bounds = deepcopy(psms[0])
+        bounds.id = None
+        bounds.max_mass = 1001.15
+        self.assertEqual(2, self.exlist.remove(bounds))
+        self.assertEqual([psms[2]], self.exlist.query_by_id('RUN_2'))
+
+    def test_exact_union_only(self):
+        self.exlist.max_growth = 0
+        psms = self.add_psms()
+        psms[1].min_rt, psms[1].max_rt = 1000.5, 1001.5
+        self.exlist.clear()
+        for psm in psms[:2]:
+            self.exlist.add(psm)
+        self.assertEqual(0, self.exlist.compact())
+
+        psms[1].min_mass, psms[1].max_mass = psms[0].min_mass, psms[0].max_mass
+        self.exlist.clear()
+        for psm in psms[:2]:
+            self.exlist.add(psm)
+        self.assertEqual(1, self.exlist.compact())
+        self.assertEqual(1001.5, self.exlist.query_by_id('RUN')[0].max_rt)
+
+class TestSnapshotExclusionList(TestColumnarExclusionList):
+
+    def setUp(self) -> None:
+        self.exlist = SnapshotExclusionList(max_delta=4)
+
+    def test_snapshot_is_immutable(self):
+        self.exlist.add(messages[0])
+        self.exlist.merge()
+        snapshot = self.exlist.snapshot
+        self.exlist.add(messages[1])
+        self.exlist.remove(messages[0])
+        self.assertEqual(1, len(snapshot.index))
+        self.assertEqual([messages[1]], self.exlist.query_by_id('PEPTIDE'))
+        self.assertTrue(self.exlist.merge())
+        self.assertEqual([messages[1]], self.exlist.query_by_id('PEPTIDE'))
+        self.assertEqual(1, len(snapshot.index))
+        self.assertEqual((), self.exlist.snapshot.ops)
+
+    def test_remove_open_bounds(self):
+        exlist = SnapshotExclusionList(index_factory=ExclusionList)
+        interval = replace(messages[0], min_intensity=None, max_intensity=None)
+        exlist.add(interval)
+        self.assertEqual(1, exlist.remove(interval))  # from the delta
+        exlist.add(interval)
+        exlist.merge()
+        self.assertEqual(1, exlist.remove(interval))  # from the index
+        self.assertEqual(0, len(exlist))
+
+    def test_removed_keys(self):
+        self.exlist.bulk_add([messages[0], messages[0], messages[1]])
+        self.exlist.merge()
+        self.assertEqual(2, self.exlist.remove(messages[0]))
+        self.assertEqual(1, len(self.exlist.snapshot.removed_keys))
+        self.assertEqual(1, len(self.exlist))
+        self.assertEqual([messages[1]], self.exlist.query_by_id('PEPTIDE'))
+        self.assertEqual(0, self.exlist.remove(messages[0]))
+        self.exlist.add(messages[0])  # equal to a removed index interval, but in the delta
+        self.assertEqual(2, len(self.exlist.query_by_id('PEPTIDE')))
+        self.assertTrue(self.exlist.merge())
+        self.assertEqual(frozenset(), self.exlist.snapshot.removed_keys)
+        self.assertEqual(2, len(self.exlist))
+
+    def test_pending_adds(self):
+        intervals = random_intervals(300)
+        points = random_points(100)
+        exlist = SnapshotExclusionList(max_delta=1000)
+        exlist.bulk_add(intervals[:100])
+        exlist.merge()
+        exlist.bulk_add(intervals[100:200])
+        snapshot = exlist.snapshot
+        for interval in intervals[200:]:
+            exlist.add(interval)
+        exlist.remove(ExclusionInterval('ID_3', None, *[-1e9, 1e9] * 4))
+        self.assertEqual(intervals[100:200], snapshot.added.intervals())  # views do not see later adds
+
+        reference = ColumnarExclusionList.from_intervals([interval for interval in intervals if interval.id != 'ID_3'])
+        self.assertEqual(1, exlist.merges)  # only the explicit merge
+        self.assertEqual(reference.is_excluded_batch(points), exlist.is_excluded_batch(points))
+        self.assertEqual([sorted(map(interval_key, intervals)) for intervals in reference.query_by_points(points)],
+                         [sorted(map(interval_key, intervals)) for intervals in exlist.query_by_points(points)])
+
+    def test_bulk_add_merges(self):
+        self.exlist.bulk_add(random_intervals(10))
+        self.assertEqual(1, self.exlist.merges)
+        self.assertEqual(0, len(self.exlist.snapshot.added))
+        self.assertEqual(10, len(self.exlist))
+
+    def test_concurrent_reads_and_writes(self):
+        intervals = random_intervals(2000)
+        points = random_points(50)
+        reference = ColumnarExclusionList()
+        for interval in intervals:
+            reference.add(interval)
+
+        self.exlist.max_delta = 256
+        errors = []
+
+        def write():
+            for interval in intervals:
+                self.exlist.add(interval)
+
+        def read():
+            try:
+                while writer.is_alive():
+                    self.exlist.is_excluded_batch(points)
+            except Exception as e:
+                errors.append(e)
+
+        writer = Thread(target=write)
+        readers = [Thread(target=read) for _ in range(2)]
+        writer.start()
+        for reader in readers:
+            reader.start()
+        writer.join()
+        for reader in readers:
+            reader.join()
+
+        self.assertEqual([], errors)
+        self.assertEqual(len(intervals), len(self.exlist))
+        self.assertEqual(reference.is_excluded_batch(points), self.exlist.is_excluded_batch(points))
+
+
 if __name__ == '__main__':
     unittest.main()
+
+
+class TestJournaledExclusionList(TestColumnarExclusionList):
+
+    def setUp(self) -> None:
+        self.folder = tempfile.TemporaryDirectory()
+        self.exlist = JournaledExclusionList(ColumnarExclusionList(merge_threshold=8), self.folder.name)
+
+    def tearDown(self) -> None:
+        self.exlist.close()
+        self.folder.cleanup()
+
+    def recover(self) -> JournaledExclusionList:
+        self.exlist.sync()
+        return JournaledExclusionList(ColumnarExclusionList(), self.folder.name)
+
+    def test_recover(self):
+        intervals = random_intervals(50)
+        self.exlist.bulk_add(intervals[:40])
+        self.exlist.remove(ExclusionInterval('ID_3', None, *[-1e9, 1e9] * 4))
+        self.exlist.checkpoint()
+        self.exlist.add(intervals[40])
+        self.exlist.add(messages[0])
+        self.exlist.remove(messages[0])
+
+        recovered = self.recover()
+        self.assertEqual(3, recovered.replayed)
+        self.assertEqual(sorted(map(interval_key, self.exlist)), sorted(map(interval_key, recovered)))
+        self.assertEqual(['journal_00000003.log', 'snapshot_00000003.col'], sorted(os.listdir(self.folder.name)))
+        recovered.close()
+
+    def test_recover_clear(self):
+        self.exlist.add(messages[0])
+        self.exlist.clear()
+        self.exlist.add(messages[1])
+        recovered = self.recover()
+        self.assertEqual([messages[1]], list(recovered))
+        recovered.close()
+
+    def test_torn_record(self):
+        self.exlist.add(messages[0])
+        self.exlist.add(messages[1])
+        self.exlist.sync()
+        with open(self.exlist.journal.file_path, 'r+b') as file:
+            file.truncate(os.path.getsize(self.exlist.journal.file_path) - 3)
+        recovered = self.recover()
+        self.assertEqual([messages[0]], list(recovered))
+        recovered.close()
+
+    def test_recover_unfinished_checkpoint(self):
+        self.exlist.add(messages[0])
+        with self.exlist._lock:  # a checkpoint which switched the journal but did not write its snapshot
+            self.exlist._rotate()
+        self.exlist.add(messages[1])
+        recovered = self.recover()
+        self.assertEqual(2, recovered.replayed)
+        self.assertEqual([messages[0], messages[1]], list(recovered))
+        recovered.close()
+
+    def test_unsynced_records_are_lost(self):
+        self.exlist.add(messages[0])
+        recovered = JournaledExclusionList(ColumnarExclusionList(), self.folder.name)
+        self.assertEqual(0, len(recovered))
+        recovered.close()
+
+    def test_rt_window_recovers_heap(self):
+        self.exlist.add(messages[0])
+        window = RTWindowExclusionList(self.recover())
+        self.assertEqual(1, window.advance(1001))
+        window.exclusion_list.close()
+
+    def test_recover_compacted(self):
+        compacting = CompactingExclusionList(self.exlist, max_growth=0.5)
+        for i, offset in enumerate([0, 0.1, 0.2]):
+            psm = deepcopy(messages[0])
+            psm.id = f'RUN_{i}'
+            psm.min_mass += offset
+            compacting.add(psm)
+        self.assertEqual(2, compacting.compact())
+        compacting.remove(replace(messages[0], id='RUN_1', min_mass=1000.1))
+
+        recovered = self.recover()
+        self.assertEqual(sorted(map(interval_key, self.exlist)), sorted(map(interval_key, recovered)))
+        recovered.close()
+
+
+class TestDeltaExclusionList(TestColumnarExclusionList):
+
+    def setUp(self) -> None:
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, 'list.col')
+        self.exlist = DeltaExclusionList(ColumnarExclusionList(merge_threshold=8))
+
+    def tearDown(self) -> None:
+        self.folder.cleanup()
+
+    def loaded(self) -> DeltaExclusionList:
+        exlist = DeltaExclusionList(ColumnarExclusionList())
+        exlist.load(self.path)
+        return exlist
+
+    def test_delta_save(self):
+        intervals = random_intervals(200)
+        self.exlist.bulk_add(intervals[:190])
+        self.exlist.save_columnar(self.path)
+        base_size = os.path.getsize(self.path)
+
+        self.exlist.bulk_add(intervals[190:])
+        self.exlist.save_columnar(self.path)
+        self.exlist.remove(ExclusionInterval('ID_3', None, *[-1e9, 1e9] * 4))
+        self.exlist.save_columnar(self.path)
+        self.exlist.save_columnar(self.path)  # nothing changed, nothing written
+        self.assertEqual(2, len(delta_paths(self.path)))
+        self.assertEqual(base_size, os.path.getsize(self.path))
+        self.assertLess(sum(map(os.path.getsize, delta_paths(self.path))), base_size / 10)
+        self.assertEqual(sorted(map(interval_key, self.exlist)), sorted(map(interval_key, self.loaded())))
+
+        self.exlist.consolidate()
+        self.assertEqual([], delta_paths(self.path))
+        self.assertEqual(sorted(map(interval_key, self.exlist)), sorted(map(interval_key, self.loaded())))
+
+    def test_loaded_chain_continues(self):
+        self.exlist.bulk_add(random_intervals(100))
+        self.exlist.save(self.path)
+        exlist = self.loaded()
+        exlist.clear()
+        exlist.add(messages[0])
+        exlist.save(self.path)
+        self.assertEqual(1, len(delta_paths(self.path)))
+        self.assertEqual([messages[0]], list(self.loaded()))
+
+        DeltaExclusionList.consolidate_file(self.path, ColumnarExclusionList())
+        self.assertEqual([], delta_paths(self.path))
+        self.assertEqual([messages[0]], list(self.loaded()))
+
+    def test_failed_base_write_keeps_base(self):
+        path = os.path.join(self.folder.name, 'list.pkl')
+        self.exlist.bulk_add(random_intervals(100))
+        self.exlist.save(path)
+        self.exlist.bulk_add(random_intervals(100, seed=1))
+        os.mkdir(path + '.tmp')  # the base is written to a temporary file first
+        with self.assertRaises(OSError):
+            self.exlist.consolidate()
+        exlist = DeltaExclusionList(ColumnarExclusionList())
+        exlist.load(path)
+        self.assertEqual(100, len(exlist))
+
+    def test_outgrown_deltas_rewrite_base(self):
+        self.exlist.add(messages[0])
+        self.exlist.save_columnar(self.path)
+        self.exlist.bulk_add(random_intervals(100))
+        self.exlist.save_columnar(self.path)
+        self.assertEqual([], delta_paths(self.path))
+        self.assertEqual(101, len(self.loaded()))
+
+    def test_replaced_base_starts_new_chain(self):
+        self.exlist.bulk_add(random_intervals(100))
+        self.exlist.save_columnar(self.path)
+        other = ColumnarExclusionList()
+        other.add(messages[0])
+        other.save_columnar(self.path)
+        self.exlist.add(messages[1])
+        self.exlist.save_columnar(self.path)
+        self.assertEqual([], delta_paths(self.path))
+        self.assertEqual(101, len(self.loaded()))
+
+    def test_queued_writers(self):
+        self.exlist.bulk_add(random_intervals(100))
+        self.exlist.save_columnar(self.path)
+        self.exlist.add(messages[0])
+        write_delta = self.exlist.snapshot_save(self.path, columnar=True)
+        self.exlist.add(messages[1])
+        write_next_delta = self.exlist.snapshot_save(self.path, columnar=True)
+        write_delta()
+        write_next_delta()
+        self.assertEqual(2, len(delta_paths(self.path)))
+        self.assertEqual(102, len(self.loaded()))